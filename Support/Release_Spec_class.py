@@ -45,6 +45,7 @@ class Release_Spec:
         change_logs, misc, prior_subst_cat.
       - Init accepts a list of file paths (relative to root) that will
         be added to the 'misc' category, for which files are not packed.
+        Folder paths add all files within them.
     * ignore_existing_subst01
       - Bool, True to ignore existing subst01 cat/dat files, False (default)
         to copy them to the output and place any new subst files in subst02.
@@ -89,7 +90,11 @@ class Release_Spec:
         # Pack given files as misc ones.
         if files:
             for path_suffix in files:
-                self.files['misc'].append((self.root_path / path_suffix).resolve())
+                path = (self.root_path / path_suffix).resolve()
+                if path.is_dir():
+                    self.files['misc'] += sorted(x for x in path.glob('**/*') if x.is_file())
+                else:
+                    self.files['misc'].append(path)
 
         # Find standard files maybe not included above.
         self.Find_Standard_Files()
@@ -27,7 +27,8 @@ release_specs = [
         name = 'sn_x4_python_pipe_server_exe',
         root_path = project_dir / 'X4_Python_Pipe_Server',
         files = [
-            '../bin/X4_Python_Pipe_Server.exe',
+            # The exe and its support files (from a onedir build).
+            '../bin',
         ],
         ),
     
@@ -25,6 +25,9 @@ New comments (not part of winapi) start with "//--".
 
 #include <winerror.h>
 
+//--Largest message read in one piece. Larger messages from the server
+//  are split into chunks (see X4_Python_Pipe_Server/Classes/Framing.py).
+//  Exported to lua as READ_SIZE.
 #define FILE_BUFF_SIZE 2048
 
 
@@ -162,6 +165,8 @@ void lcb_free(void *data) {
 typedef struct {
     callback_data_
     HANDLE hWrite;
+    //--Bytes in buf from the last read.
+    DWORD bytesRead;
 } File;
 
 
@@ -189,7 +194,9 @@ static void File_ctor(lua_State *L, File *this, HANDLE hread, HANDLE hwrite) {
     lcb_handle(this) = hread;
     this->hWrite = hwrite;
     this->L = L;
-    lcb_allocate_buffer(this, FILE_BUFF_SIZE);
+    this->bytesRead = 0;
+    //--Extra byte for the null terminator added after reads.
+    lcb_allocate_buffer(this, FILE_BUFF_SIZE + 1);
 }
 
 /// write to a file.
@@ -208,8 +215,11 @@ static int l_File_write(lua_State *L) {
 
 static BOOL raw_read(File *this) {
     DWORD bytesRead = 0;
-    BOOL res = ReadFile(lcb_handle(this), lcb_buf(this), lcb_bufsz(this), &bytesRead, NULL);
+    //--Leave room for the terminator, which previously could be written
+    //  past the end of a full buffer.
+    BOOL res = ReadFile(lcb_handle(this), lcb_buf(this), lcb_bufsz(this) - 1, &bytesRead, NULL);
     lcb_buf(this)[bytesRead] = '\0';
+    this->bytesRead = bytesRead;
     return res && bytesRead;
 }
 
@@ -221,7 +231,9 @@ static BOOL raw_read(File *this) {
 static int l_File_read(lua_State *L) {
     File *this = File_arg(L, 1);
     if (raw_read(this)) {
-        lua_pushstring(L, lcb_buf(this));
+        //--Use the read length, so messages with null bytes (eg. framed
+        //  binary messages) aren't cut short.
+        lua_pushlstring(L, lcb_buf(this), this->bytesRead);
         return 1;
     }
     else {
@@ -439,6 +451,9 @@ EXPORT int luaopen_winpipe(lua_State *L) {
     //--Error code constants.
     lua_pushinteger(L, ERROR_IO_PENDING); lua_setfield(L, -2, "ERROR_IO_PENDING");
     lua_pushinteger(L, ERROR_NO_DATA); lua_setfield(L, -2, "ERROR_NO_DATA");
+
+    //--Read size; its presence also tells lua that reads keep null bytes.
+    lua_pushinteger(L, FILE_BUFF_SIZE); lua_setfield(L, -2, "READ_SIZE");
     
     return 1;
 }
@@ -0,0 +1,122 @@
+'''
+Check of the Extension_Index used by module permission checks.
+
+Builds a fake x4 install in a temp folder, and checks that the index
+picks up edited content.xml ids, extensions added or removed between
+refreshes, and bad content.xml files, while skipping unchanged ones.
+Fails with an AssertionError on the first mismatch.
+
+    python Benchmarks/Extension_Index_Check.py
+'''
+import os
+import sys
+import shutil
+import tempfile
+from pathlib import Path
+
+home_path = Path(__file__).resolve().parents[2]
+if str(home_path) not in sys.path:
+    sys.path.append(str(home_path))
+
+from X4_Python_Pipe_Server.Classes import Extension_Index
+
+
+def Write_Content(x4_path, name, content_id = None, enabled = None):
+    '''
+    Write extensions/<name>/content.xml, with the given id and enabled
+    attributes (left out if None), and bump its mtime past any prior one,
+    since quick rewrites can otherwise land on the same timestamp.
+    '''
+    folder = x4_path / 'extensions' / name
+    folder.mkdir(parents = True, exist_ok = True)
+    content_path = folder / 'content.xml'
+    old_mtime_ns = content_path.stat().st_mtime_ns if content_path.exists() else 0
+
+    attributes = ''
+    if content_id is not None:
+        attributes += ' id="{}"'.format(content_id)
+    if enabled is not None:
+        attributes += ' enabled="{}"'.format(enabled)
+    content_path.write_text('<?xml version="1.0" encoding="utf-8"?>\n'
+                            '<content{} name="{}" version="100">\n'
+                            '</content>\n'.format(attributes, name))
+
+    mtime_ns = max(content_path.stat().st_mtime_ns, old_mtime_ns + 1_000_000_000)
+    os.utime(content_path, ns = (mtime_ns, mtime_ns))
+    return
+
+
+def Expect_Error(index, name):
+    '''
+    Check that looking up the named extension raises an exception.
+    '''
+    try:
+        index.Get(name)
+    except Exception:
+        return
+    raise AssertionError('Get({!r}) should have failed'.format(name))
+
+
+def Run_Checks(x4_path):
+    '''
+    Run the checks against a fake x4 install at x4_path.
+    '''
+    index = Extension_Index()
+
+    # Initial index.
+    Write_Content(x4_path, 'x', 'old_id')
+    python_folder = x4_path / 'extensions' / 'x' / 'python'
+    python_folder.mkdir()
+    (python_folder / 'Server.py').write_text('')
+    index.Refresh(x4_path)
+    info = index.Get('x')
+    assert info.content_id == 'old_id', info.content_id
+    assert info.enabled
+    assert info.python_modules == {'Server.py'}, info.python_modules
+
+    # Unchanged content.xml isn't reparsed.
+    index.Refresh(x4_path)
+    assert index.Get('x') is info
+
+    # Edited id is picked up on refresh.
+    Write_Content(x4_path, 'x', 'new_id', enabled = 'false')
+    index.Refresh(x4_path)
+    info = index.Get('x')
+    assert info.content_id == 'new_id', info.content_id
+    assert not info.enabled
+
+    # Extensions added since the refresh are looked up directly.
+    Write_Content(x4_path, 'y', 'y_id')
+    assert 'y' not in index.extensions
+    assert index.Get('y').content_id == 'y_id'
+
+    # Folders without a content.xml aren't extensions.
+    (x4_path / 'extensions' / 'not_ext').mkdir()
+    index.Refresh(x4_path)
+    assert 'not_ext' not in index.extensions
+    Expect_Error(index, 'not_ext')
+
+    # A content.xml without an id is an error, until fixed.
+    Write_Content(x4_path, 'y')
+    index.Refresh(x4_path)
+    assert 'y' not in index.extensions
+    assert 'y' in index.errors
+    Expect_Error(index, 'y')
+    Write_Content(x4_path, 'y', 'y_id')
+    index.Refresh(x4_path)
+    assert index.Get('y').content_id == 'y_id'
+    assert 'y' not in index.errors
+
+    # Removed folders drop out of the index.
+    shutil.rmtree(x4_path / 'extensions' / 'x')
+    index.Refresh(x4_path)
+    assert 'x' not in index.extensions, sorted(index.extensions)
+    Expect_Error(index, 'x')
+    assert sorted(index.extensions) == ['y'], sorted(index.extensions)
+    return
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as temp_dir:
+        Run_Checks(Path(temp_dir))
+    print('Extension_Index checks passed')
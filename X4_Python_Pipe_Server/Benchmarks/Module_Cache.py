@@ -0,0 +1,78 @@
+'''
+Benchmark of extension module import times, compiling from source versus
+using the module cache.
+
+Imports every python server module under the extensions folder, as .txt
+copies the way steam releases ship them, first with no cache, then with
+a cold cache (compiling and writing entries), then with a warm cache.
+Module top levels are run as normal, so this includes their own imports
+(which are the same in each pass, and already in sys.modules after the
+first).
+
+    python Benchmarks/Module_Cache.py [repeat count]
+'''
+import sys
+import time
+import shutil
+import tempfile
+from pathlib import Path
+
+home_path = Path(__file__).resolve().parents[2]
+if str(home_path) not in sys.path:
+    sys.path.append(str(home_path))
+
+from X4_Python_Pipe_Server.Classes import Set_Cache_Dir, Get_Module_Name
+from X4_Python_Pipe_Server.Classes.Module_Cache import Cached_Source_Loader
+from X4_Python_Pipe_Server.Classes.Pipe_Stats import Format_Duration
+
+
+def Import_All(paths):
+    '''
+    Import each module, returning the total time taken and cache hits.
+    '''
+    total = 0
+    hits = 0
+    for path in paths:
+        # Set up the loader as Load_Module does, so its cache_hit can
+        # still be checked when the module top level raises.
+        loader = Cached_Source_Loader(Get_Module_Name(path), str(path))
+        start = time.perf_counter()
+        try:
+            loader.load_module()
+        except Exception:
+            # Servers failing at their top level off windows (eg. Send_Keys,
+            # which raises before starting) still get compiled and cached,
+            # which is what is being timed.
+            pass
+        total += time.perf_counter() - start
+        hits += loader.cache_hit
+    return total, hits
+
+
+if __name__ == '__main__':
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    sources = sorted((home_path / 'extensions').glob('*/python/*.py'))
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp_dir = Path(temp_dir)
+        # Copy sources under several names, to look like a bigger modlist.
+        paths = []
+        for index in range(repeat):
+            for source in sources:
+                path = temp_dir / 'mods' / f'{source.stem}_{index}.txt'
+                path.parent.mkdir(exist_ok = True)
+                shutil.copyfile(source, path)
+                paths.append(path)
+        print(f'{len(paths)} modules, {sum(x.stat().st_size for x in paths) // 1024} kB source')
+
+        Set_Cache_Dir(None)
+        elapsed, hits = Import_All(paths)
+        print(f'  no cache  : {Format_Duration(elapsed)}')
+
+        Set_Cache_Dir(temp_dir / 'module_cache')
+        for label in ['cold cache', 'warm cache']:
+            elapsed, hits = Import_All(paths)
+            print(f'  {label}: {Format_Duration(elapsed)} ({hits} cached)')
+        # Sources are unchanged between passes, so every warm import
+        # should use its cached code.
+        assert hits == len(paths), f'warm cache missed {len(paths) - hits} modules'
@@ -0,0 +1,115 @@
+'''
+Benchmark of small message latency on one server while another server
+is busy with cpu heavy work, with the busy server run as a host thread
+(sharing the GIL) versus in its own process (Server_Process).
+
+The host side runs an echo server (standing in for Send_Keys) in a
+thread, plus the busy server (standing in for the Script_Profiler,
+parsing and sorting ~60 kB messages). A client process keeps the busy
+server fed while timing echo round trips, and prints their percentiles.
+
+Uses the default pipe transport (unix sockets when not on windows):
+    python Benchmarks/Process_Isolation.py
+'''
+import sys
+import time
+import threading
+import multiprocessing
+from pathlib import Path
+
+home_path = Path(__file__).resolve().parents[2]
+if str(home_path) not in sys.path:
+    sys.path.append(str(home_path))
+
+from X4_Python_Pipe_Server.Classes import Pipe_Server, Pipe_Client
+from X4_Python_Pipe_Server.Classes import Server_Thread, Server_Process
+from X4_Python_Pipe_Server.Classes.Pipe_Stats import Histogram, Format_Duration
+from X4_Python_Pipe_Server.Classes.Transport import Close_Standby_Servers
+
+echo_pipe_name = 'x4_bench_echo'
+busy_pipe_name = 'x4_bench_busy'
+echo_count = 500
+echo_interval = 0.005
+
+
+def Echo_Main(args):
+    '''
+    Server replying to each message with itself.
+    '''
+    pipe = Pipe_Server(echo_pipe_name)
+    pipe.Connect()
+    while True:
+        pipe.Write(pipe.Read())
+
+
+def Busy_Main(args):
+    '''
+    Server parsing and sorting each profile-like message it gets.
+    '''
+    pipe = Pipe_Server(busy_pipe_name, buffer_size = 256 * 1024)
+    pipe.Connect()
+    while True:
+        message = pipe.Read()
+        for _ in range(5):
+            pairs = {}
+            for entry in message.split(';'):
+                if entry:
+                    key, value = entry.split(',')
+                    pairs[key] = float(value)
+            ordered = sorted(pairs.items(), key = lambda x: x[1])
+        pipe.Write(len(ordered))
+
+
+def Client():
+    '''
+    Keep the busy server working while timing echo round trips.
+    '''
+    busy = Pipe_Client(busy_pipe_name, buffer_size = 256 * 1024)
+    echo = Pipe_Client(echo_pipe_name)
+    message = ''.join(f'md.Some_Script.cue_{i}.action_{i % 7},{i * 0.37:.3f};' for i in range(2500))
+    done = False
+
+    def Feed():
+        while not done:
+            busy.Write(message)
+            busy.Read()
+    feeder = threading.Thread(target = Feed, daemon = True)
+    feeder.start()
+
+    histogram = Histogram()
+    for _ in range(echo_count):
+        start = time.perf_counter()
+        echo.Write('key')
+        echo.Read()
+        histogram.Add(time.perf_counter() - start)
+        time.sleep(echo_interval)
+    done = True
+    print('  echo round trip: mean {}, {}'.format(
+        Format_Duration(histogram.total / histogram.count), histogram.Format()))
+    return
+
+
+def Run(use_process):
+    print('busy server in ' + ('its own process:' if use_process else 'a host thread:'))
+    # Drop standby pipes left by the prior run's servers in this process,
+    # else the client may connect to one instead of the child's server.
+    Close_Standby_Servers()
+    # Test mode, so servers stop when the client disconnects.
+    echo = Server_Thread(Echo_Main, test = True)
+    if use_process:
+        busy = Server_Process(__file__, test = True, function_name = 'Busy_Main')
+    else:
+        busy = Server_Thread(Busy_Main, test = True)
+    # Give the servers a moment to open their pipes.
+    time.sleep(1)
+    client = multiprocessing.Process(target = Client)
+    client.start()
+    client.join()
+    echo.Join()
+    busy.Join()
+    return
+
+
+if __name__ == '__main__':
+    for use_process in [False, True]:
+        Run(use_process)
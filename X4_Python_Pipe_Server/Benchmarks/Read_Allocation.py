@@ -0,0 +1,116 @@
+'''
+Benchmark of pipe read allocations, comparing the old read path (a new
+buffer_size bytes object requested from the OS read call every time,
+then decoded) with the reused read buffer behind Read and Read_Bytes.
+
+For each buffer size, prints messages per second while streaming small
+messages (similar to Time_API requests) and larger ones (similar to
+Script_Profiler updates), along with the peak memory traced during
+a run of reads. The writer runs in its own process, so that it doesn't
+compete with the reader for the GIL.
+
+Uses the default pipe transport (unix sockets when not on windows):
+    python Benchmarks/Read_Allocation.py
+'''
+import sys
+import time
+import multiprocessing
+import tracemalloc
+from pathlib import Path
+
+home_path = Path(__file__).resolve().parents[2]
+if str(home_path) not in sys.path:
+    sys.path.append(str(home_path))
+
+from X4_Python_Pipe_Server.Classes import Pipe_Server, Pipe_Client
+from X4_Python_Pipe_Server.Classes.Transport import Win_Pipe_Transport
+
+pipe_name = 'x4_bench_reads'
+
+
+def Use_Old_Reads(pipe):
+    '''
+    Switch the pipe to read the way it used to, letting the OS read call
+    allocate a fresh buffer_size result each time. Everything else in
+    the Read path stays the same.
+    '''
+    transport = pipe.read_transport
+    if isinstance(transport, Win_Pipe_Transport):
+        import win32file
+        def Read_View():
+            error, data = win32file.ReadFile(transport.pipe_file, transport.buffer_size)
+            return memoryview(data)
+    else:
+        def Read_View():
+            return memoryview(transport.conn.recvmsg(transport.buffer_size)[0])
+    transport.Read_View = Read_View
+    return
+
+
+def Read_Text(pipe):
+    return pipe.Read()
+
+
+def Read_Bytes(pipe):
+    return pipe.Read_Bytes()
+
+
+def Server(buffer_size, message_size, count):
+    '''
+    Write count messages of message_size, twice (once for the timed
+    reads, once for the traced reads).
+    '''
+    message = 'x' * message_size
+    pipe = Pipe_Server(pipe_name, buffer_size = buffer_size)
+    pipe.Connect()
+    for _ in range(count * 2):
+        pipe.Write(message)
+    # Wait for the client to finish before closing.
+    pipe.Read()
+    pipe.Close()
+    return
+
+
+def Run(label, buffer_size, message_size, count, read_func, old_reads = False):
+    '''
+    Stream count messages of message_size from a server to a client,
+    reading them with read_func, optionally using the old allocating
+    reads. Prints messages per second and the
+    peak traced memory while reading.
+    '''
+    server = multiprocessing.Process(
+        target = Server, args = (buffer_size, message_size, count))
+    server.start()
+    # Give the server a moment to open the pipe.
+    time.sleep(0.2)
+    client = Pipe_Client(pipe_name, buffer_size = buffer_size)
+    if old_reads:
+        Use_Old_Reads(client)
+
+    start = time.perf_counter()
+    for _ in range(count):
+        read_func(client)
+    elapsed = time.perf_counter() - start
+
+    # Tracing slows everything down, so trace a separate run.
+    tracemalloc.start()
+    for _ in range(count):
+        read_func(client)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    client.Write('done')
+    server.join()
+    client.Close()
+    print('{:<32}: {:>9.0f} msg/s  ({:6.2f} us/msg), peak {:>7.1f} kB'.format(
+        label, count / elapsed, elapsed / count * 1e6, peak / 1024))
+    return
+
+
+if __name__ == '__main__':
+    for buffer_size in [64 * 1024, 256 * 1024]:
+        for message_size, count in [(32, 100000), (16 * 1024, 10000)]:
+            print(f'buffer {buffer_size // 1024} kB, messages {message_size} B:')
+            Run('  old (allocate per read)', buffer_size, message_size, count, Read_Text, old_reads = True)
+            Run('  Read (reused buffer)'   , buffer_size, message_size, count, Read_Text)
+            Run('  Read_Bytes (no decode)' , buffer_size, message_size, count, Read_Bytes)
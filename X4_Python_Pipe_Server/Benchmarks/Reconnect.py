@@ -0,0 +1,97 @@
+'''
+Benchmark of client reconnect latency, with and without the standby
+server pipe kept by transports after a client connects.
+
+A server process runs an echo server restarted on every disconnect,
+the way Server_Thread restarts extension servers. The client then
+repeatedly disconnects and reconnects, retrying failed connects every
+retry_interval (x4 retries on its next pipe access), and times each
+reconnect from closing the old pipe to the reply to its first message.
+The server's pipe stats give its own view of the reconnect time.
+
+Uses the default pipe transport (unix sockets when not on windows):
+    python Benchmarks/Reconnect.py
+'''
+import sys
+import time
+import multiprocessing
+from pathlib import Path
+
+home_path = Path(__file__).resolve().parents[2]
+if str(home_path) not in sys.path:
+    sys.path.append(str(home_path))
+
+from X4_Python_Pipe_Server.Classes import Pipe_Server, Pipe_Client
+from X4_Python_Pipe_Server.Classes import Enable_Stats, Format_Stats
+from X4_Python_Pipe_Server.Classes import pipe_errors, Is_Disconnect_Error
+from X4_Python_Pipe_Server.Classes.Transport import Transport, Close_Standby_Servers
+from X4_Python_Pipe_Server.Classes.Pipe_Stats import Histogram, Format_Duration
+
+pipe_name = 'x4_bench_reconnect'
+retry_interval = 0.005
+
+
+def Server(use_standby, count):
+    '''
+    Echo server, restarted after each of count disconnects.
+    '''
+    Transport.use_standby = use_standby
+    Enable_Stats()
+    for _ in range(count):
+        try:
+            pipe = Pipe_Server(pipe_name)
+            pipe.Connect()
+            while True:
+                pipe.Write(pipe.Read())
+        except pipe_errors as ex:
+            if not Is_Disconnect_Error(ex):
+                raise
+        # Servers drop the pipe without closing it, like most extension
+        # servers do.
+        del pipe
+    print(Format_Stats().splitlines()[1])
+    # Process workers skip atexit handlers.
+    Close_Standby_Servers()
+    return
+
+
+def Connect():
+    '''
+    Connect a client and get a reply to a first message, retrying until
+    this succeeds. (Without a standby, the client may land in the closing
+    server's backlog and be dropped.)
+    '''
+    while True:
+        try:
+            client = Pipe_Client(pipe_name)
+            client.Write('ping')
+            client.Read()
+            return client
+        except pipe_errors:
+            time.sleep(retry_interval)
+
+
+def Run(use_standby, count = 200):
+    server = multiprocessing.Process(target = Server, args = (use_standby, count))
+    server.start()
+    client = Connect()
+
+    histogram = Histogram()
+    for index in range(count):
+        start = time.perf_counter()
+        client.Close()
+        if index == count - 1:
+            break
+        client = Connect()
+        histogram.Add(time.perf_counter() - start)
+    server.join()
+    print('{:<16}: mean {}, {}'.format(
+        'standby' if use_standby else 'no standby',
+        Format_Duration(histogram.total / histogram.count),
+        histogram.Format()))
+    return
+
+
+if __name__ == '__main__':
+    Run(False)
+    Run(True)
@@ -0,0 +1,92 @@
+'''
+Replay a recorded pipe session against a server module, and time it.
+
+Recordings come from the host "--record-pipes" arg, capturing real game
+sessions (eg. a Script_Profiler pipe during a large save). The server
+module is loaded and run in a thread here, the x4 side of the recording
+is replayed into it through a Pipe_Client, and the server's cpu time and
+handler times are reported, making runs comparable across machines and
+code changes.
+
+    python Benchmarks/Replay_Session.py <recording> <module path>
+        [--speed N|max] [--repeat N] [--transport unix]
+
+Speed is a multiplier on the recorded pace (default "max", sending as
+fast as the server reads).
+'''
+import sys
+import argparse
+from pathlib import Path
+
+home_path = Path(__file__).resolve().parents[2]
+if str(home_path) not in sys.path:
+    sys.path.append(str(home_path))
+
+from X4_Python_Pipe_Server.Classes import Server_Thread, Load_Module, Replayer
+from X4_Python_Pipe_Server.Classes import Enable_Server_Stats, Set_Default_Transport, transports
+from X4_Python_Pipe_Server.Classes.Pipe_Stats import Format_Duration
+
+
+def Parse_Speed(text):
+    '''
+    Returns the speed multiplier for a --speed arg; 0 for "max".
+    '''
+    if text == 'max':
+        return 0
+    return float(text)
+
+
+def Replay_Once(recording_path, module, speed):
+    '''
+    Start the module's server, replay the recording into it, and stop it.
+    Returns the replay summary dict, with the server's stats snapshot
+    added under 'server'.
+    '''
+    server = Server_Thread(module.main)
+    try:
+        summary = Replayer(recording_path, speed).Run()
+        # Take this before the server thread ends.
+        summary['server'] = server.stats.Get_Snapshot()
+    finally:
+        server.Close()
+        server.Join(5)
+    return summary
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(
+        description = 'Replay a recorded pipe session against a server module.')
+    argparser.add_argument('recording', help = 'Path to a .x4rec file of the server side.')
+    argparser.add_argument('module', help = 'Path to the server module (.py or .txt).')
+    argparser.add_argument('--speed', type = Parse_Speed, default = 0,
+                           help = 'Replay speed multiplier, or "max" (default).')
+    argparser.add_argument('--repeat', type = int, default = 1,
+                           help = 'Number of replays, each with a fresh server.')
+    argparser.add_argument('--transport', choices = list(transports),
+                           help = 'Pipe transport to use.')
+    args = argparser.parse_args()
+
+    if args.transport:
+        Set_Default_Transport(args.transport)
+    # Account the server's cpu and handler times.
+    Enable_Server_Stats()
+    module = Load_Module(Path(args.module).resolve())
+
+    for index in range(args.repeat):
+        summary = Replay_Once(args.recording, module, args.speed)
+        snapshot = summary['server']
+        cpu_time = snapshot['cpu_time']
+        rate = summary['sent'] / summary['total_time'] if summary['total_time'] else 0
+        print(('Replay {}: sent {} msgs in {}, {} / {} replies, total {} ({:.0f} msgs/s),'
+               ' server cpu {}, handler avg {} max {}').format(
+            index + 1,
+            summary['sent'],
+            Format_Duration(summary['send_time']),
+            summary['replies'],
+            summary['expected_replies'],
+            Format_Duration(summary['total_time']),
+            rate,
+            'n/a' if cpu_time is None else Format_Duration(cpu_time),
+            Format_Duration(snapshot['handler_avg']),
+            Format_Duration(snapshot['handler_max']),
+            ))
@@ -0,0 +1,107 @@
+'''
+Benchmark of the shared memory ring buffer side channel, comparing
+telemetry samples sent as one pipe message each, against samples written
+to a Ring_Buffer with one doorbell pipe message per simulated frame.
+
+The producer runs in its own process (as x4 would), writing small
+samples (similar to script profiler timestamps) in frames of
+samples_per_frame; the consumer reads until all samples arrive, and
+prints samples per second.
+
+Uses the default pipe transport (unix sockets when not on windows):
+    python Benchmarks/Ring_Buffer.py
+'''
+import sys
+import time
+import struct
+import multiprocessing
+from pathlib import Path
+
+home_path = Path(__file__).resolve().parents[2]
+if str(home_path) not in sys.path:
+    sys.path.append(str(home_path))
+
+from X4_Python_Pipe_Server.Classes import Pipe_Server, Pipe_Client
+from X4_Python_Pipe_Server.Classes.Ring_Buffer import Ring_Buffer
+
+pipe_name = 'x4_bench_ring'
+ring_name = 'x4_bench_ring'
+# Sample: id, timestamp, value.
+sample_struct = struct.Struct('<Idd')
+
+
+def Producer(mode, count, samples_per_frame):
+    '''
+    Send count samples, either as pipe messages ('pipe') or through the
+    ring with a doorbell per frame ('ring').
+    '''
+    pipe = Pipe_Client(pipe_name)
+    if mode == 'ring':
+        ring = Ring_Buffer(ring_name, create = False)
+
+    for index in range(count):
+        sample = sample_struct.pack(index, time.perf_counter(), 1.5)
+        if mode == 'pipe':
+            pipe.Write(sample.hex())
+        else:
+            # Spin if the consumer falls behind, so no samples are dropped.
+            while not ring.Write(sample):
+                pipe.Write('doorbell')
+                time.sleep(0)
+            if index % samples_per_frame == samples_per_frame - 1:
+                pipe.Write('doorbell')
+    if mode == 'ring':
+        pipe.Write('doorbell')
+        ring.Close()
+    # Wait for the consumer to finish before closing.
+    pipe.Read()
+    pipe.Close()
+    return
+
+
+def Run(mode, count, samples_per_frame = 100):
+    '''
+    Receive count samples using the given mode, printing the rate.
+    '''
+    ring = Ring_Buffer(ring_name, capacity = 256 * 1024) if mode == 'ring' else None
+    pipe = Pipe_Server(pipe_name)
+    producer = multiprocessing.Process(
+        target = Producer, args = (mode, count, samples_per_frame))
+    producer.start()
+    pipe.Connect()
+
+    received = 0
+    doorbells = 0
+    start = time.perf_counter()
+    if mode == 'pipe':
+        while received < count:
+            sample_struct.unpack(bytes.fromhex(pipe.Read()))
+            received += 1
+    else:
+        def Wait():
+            nonlocal doorbells
+            pipe.Read()
+            doorbells += 1
+        for records in ring.Iter_Batches(wait = Wait):
+            for record in records:
+                sample_struct.unpack(record)
+            received += len(records)
+            if received >= count:
+                break
+    elapsed = time.perf_counter() - start
+
+    pipe.Write('done')
+    producer.join()
+    pipe.Close()
+    if ring:
+        ring.Close()
+    label = 'pipe message per sample' if mode == 'pipe' else 'ring buffer + doorbells'
+    print('{:<26}: {:>9.0f} samples/s  ({:5.2f} us/sample), {} pipe reads'.format(
+        label, count / elapsed, elapsed / count * 1e6,
+        count if mode == 'pipe' else doorbells))
+    return
+
+
+if __name__ == '__main__':
+    Run('pipe', 100000)
+    Run('ring', 100000)
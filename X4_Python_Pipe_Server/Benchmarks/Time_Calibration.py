@@ -0,0 +1,96 @@
+'''
+Benchmark of the Time_API pipe overheads, using its calibration mode.
+
+Runs the Time_API server in a thread, with a python client standing in
+for x4: the client answers each calibration probe with two echos, as the
+lua side does, and the server prints its table of round trip and
+overhead times. Empty tic/toc pairs are then timed with and without the
+calibrated overhead removed, to show what toc measures for no work.
+
+Python reads the pipe as soon as a message arrives, so round trips here
+lack the frame-polled read delay seen in game.
+
+    python Benchmarks/Time_Calibration.py [--count N] [--transport unix]
+'''
+import sys
+import time
+import argparse
+from pathlib import Path
+
+home_path = Path(__file__).resolve().parents[2]
+if str(home_path) not in sys.path:
+    sys.path.append(str(home_path))
+
+from X4_Python_Pipe_Server.Classes import Server_Thread, Load_Module, Pipe_Client
+from X4_Python_Pipe_Server.Classes import Set_Default_Transport, transports
+from X4_Python_Pipe_Server.Classes.Pipe_Stats import Format_Duration
+
+module_path = home_path / 'extensions/sn_mod_support_apis/python/Time_API.py'
+
+
+def Connect(pipe_name, timeout = 5):
+    '''
+    Returns a Pipe_Client to the named pipe, retrying until the server
+    is up.
+    '''
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            return Pipe_Client(pipe_name)
+        except Exception:
+            if time.perf_counter() > deadline:
+                raise
+            time.sleep(0.01)
+
+
+def Time_Empty_Tocs(pipe, count):
+    '''
+    Returns the median toc reply of count empty tic/toc pairs, in seconds.
+    '''
+    tocs = []
+    for _ in range(count):
+        pipe.Write('tic:empty')
+        pipe.Write('toc:empty')
+        tocs.append(float(pipe.Read()))
+    return sorted(tocs)[count // 2]
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(
+        description = 'Measure Time_API pipe overheads.')
+    argparser.add_argument('--count', type = int, default = 1000,
+                           help = 'Number of calibration probes (up to 1000)'
+                                  ' and toc pairs.')
+    argparser.add_argument('--transport', choices = list(transports),
+                           help = 'Pipe transport to use.')
+    args = argparser.parse_args()
+    # Rejected counts would leave the probe loop below waiting.
+    if not 0 < args.count <= 1000:
+        argparser.error('--count must be 1 to 1000')
+
+    if args.transport:
+        Set_Default_Transport(args.transport)
+    module = Load_Module(module_path)
+    server = Server_Thread(module.main)
+    try:
+        pipe = Connect(module.pipe_name)
+
+        # The server runs in this process, and prints the table itself
+        # before replying with it.
+        print(f'Calibration over {args.count} probes:')
+        pipe.Write(f'calibrate:{args.count}')
+        for _ in range(args.count):
+            pipe.Read()
+            pipe.Write('echo')
+            pipe.Write('echo')
+        pipe.Read()
+
+        raw = Time_Empty_Tocs(pipe, args.count)
+        pipe.Write('correct:1')
+        corrected = Time_Empty_Tocs(pipe, args.count)
+        print('Empty tic/toc median: {} raw, {} corrected'.format(
+            Format_Duration(raw), Format_Duration(corrected)))
+        pipe.Close()
+    finally:
+        server.Close()
+        server.Join(5)
@@ -0,0 +1,102 @@
+'''
+Benchmark of pipe write coalescing, printing messages per second for
+small perf_counter messages, similar to Time_API's get/toc replies.
+
+Scenarios:
+* bursts
+  - The client sends one request per simulated frame, and the server
+    answers with a burst of replies. Batched replies are flushed by the
+    server's next Read.
+* stream
+  - The server sends messages one way as fast as it can. Batched
+    messages are flushed by the flush_delay timer or when full.
+
+Uses the default pipe transport (unix sockets when not on windows):
+    python Benchmarks/Write_Batching.py
+'''
+import sys
+import time
+import threading
+from pathlib import Path
+
+home_path = Path(__file__).resolve().parents[2]
+if str(home_path) not in sys.path:
+    sys.path.append(str(home_path))
+
+from X4_Python_Pipe_Server.Classes import Pipe_Server, Pipe_Client
+
+pipe_name = 'x4_bench_batching'
+
+
+def Burst_Server(pipe, bursts, burst_size):
+    for _ in range(bursts):
+        pipe.Read()
+        for _ in range(burst_size):
+            pipe.Write(time.perf_counter())
+    return
+
+
+def Burst_Client(pipe, bursts, burst_size):
+    for _ in range(bursts):
+        pipe.Write('get')
+        for _ in range(burst_size):
+            pipe.Read()
+    return bursts * burst_size
+
+
+def Stream_Server(pipe, count):
+    # Wait for a first request, which also handles the client's control
+    # messages enabling batches.
+    pipe.Read()
+    for _ in range(count):
+        pipe.Write(time.perf_counter())
+    return
+
+
+def Stream_Client(pipe, count):
+    pipe.Write('start')
+    for _ in range(count):
+        pipe.Read()
+    return count
+
+
+def Run(label, pipe_kwargs, server_func, client_func, *args):
+    '''
+    Run one configuration, printing messages per second.
+    '''
+    def Server():
+        pipe = Pipe_Server(pipe_name, **pipe_kwargs)
+        pipe.Connect()
+        server_func(pipe, *args)
+        # Wait for the client to finish before closing.
+        pipe.Read()
+        pipe.Close()
+
+    server = threading.Thread(target = Server)
+    server.start()
+    # Give the server a moment to open the pipe.
+    time.sleep(0.2)
+    client = Pipe_Client(pipe_name)
+
+    start = time.perf_counter()
+    count = client_func(client, *args)
+    elapsed = time.perf_counter() - start
+
+    client.Write('done')
+    server.join()
+    client.Close()
+    print('{:<28}: {:>10.0f} msg/s  ({:.2f} us/msg)'.format(
+        label, count / elapsed, elapsed / count * 1e6))
+    return
+
+
+if __name__ == '__main__':
+    bursts, burst_size = 2000, 20
+    Run('bursts, plain', {}, Burst_Server, Burst_Client, bursts, burst_size)
+    Run('bursts, batched', {'batch_writes' : True},
+        Burst_Server, Burst_Client, bursts, burst_size)
+
+    count = 200000
+    Run('stream, plain', {}, Stream_Server, Stream_Client, count)
+    Run('stream, batched 1 ms flush', {'batch_writes' : True, 'flush_delay' : 0.001},
+        Stream_Server, Stream_Client, count)
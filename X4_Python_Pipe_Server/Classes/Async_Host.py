@@ -0,0 +1,178 @@
+import sys
+import threading
+import asyncio
+import traceback
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
+
+from .Server_Thread import Server_Thread, _current_server
+
+class Async_Server_Host:
+    '''
+    Runs extension servers from a single asyncio event loop, which runs
+    in one background thread.
+
+    Servers with an "async def main(args)" entry function run as tasks
+    on the loop, and should use Async_Pipe_Server for their pipes.
+    Legacy servers with a plain "main(args)" run on the loop's thread
+    executor, keeping their blocking pipe accesses off the loop.
+
+    Attributes:
+    * loop
+      - The asyncio event loop.
+    * thread
+      - Thread running the loop.
+    * executor
+      - ThreadPoolExecutor used for legacy servers.
+    '''
+    # Each legacy server holds an executor worker for its whole life, so
+    # this needs to be larger than any expected module count.
+    max_legacy_servers = 256
+
+    def __init__(self):
+        # Windows pipes wait on the proactor loop's completion port; be
+        # explicit in case a different default event loop policy is set.
+        if sys.platform == 'win32':
+            self.loop = asyncio.ProactorEventLoop()
+        else:
+            self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(
+            max_workers = self.max_legacy_servers,
+            thread_name_prefix = 'x4_host_executor')
+        self.loop.set_default_executor(self.executor)
+        self.thread = threading.Thread(target = self.loop.run_forever,
+                                       name = 'x4_host_loop')
+        self.thread.start()
+        return
+
+
+    def Start_Server(self, entry_function, test = False):
+        '''
+        Start a server for the given entry function, returning its
+        Async_Server object.
+        '''
+        return Async_Server(entry_function, self, test = test)
+
+
+    def Close(self, timeout = None):
+        '''
+        Stop the event loop and its thread, after servers have been
+        closed. Blocks until the loop thread finishes, or until timeout
+        seconds if given. Returns True if it finished.
+        '''
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout)
+        # Executor workers of stopped servers exit once idle.
+        self.executor.shutdown(wait = False, cancel_futures = True)
+        return not self.thread.is_alive()
+
+
+class Async_Server(Server_Thread):
+    '''
+    Server_Thread variant which runs on an Async_Server_Host instead of
+    a dedicated thread. Restart behavior matches Server_Thread.
+
+    Attributes:
+    * host
+      - The Async_Server_Host running this server.
+    * future
+      - concurrent.futures.Future tracking the server's completion.
+    '''
+    def __init__(self, entry_function, host, test = False):
+        self.host = host
+        self.future = None
+        super().__init__(entry_function, test)
+        return
+
+
+    def Start(self):
+        '''
+        Schedule the server on the host's event loop.
+        '''
+        if asyncio.iscoroutinefunction(self.entry_function):
+            coroutine = self.Run_Server_Async()
+        else:
+            coroutine = self.Run_Server_Executor()
+        self.future = asyncio.run_coroutine_threadsafe(coroutine, self.host.loop)
+        self.future.add_done_callback(self.Report_Exit)
+        return
+
+
+    async def Run_Server_Async(self):
+        '''
+        Async version of Run_Server, for coroutine entry functions.
+        '''
+        # Set within this task's context only.
+        _current_server.set(self)
+        try:
+            while not self.Is_Closing():
+                self.Begin_Run()
+                ex = None
+                try:
+                    await self.entry_function(self.Get_Args())
+                except Exception as run_ex:
+                    ex = run_ex
+                except asyncio.CancelledError:
+                    # Closed; still clean up the run.
+                    self.End_Run()
+                    raise
+
+                delay = self.End_Run(ex)
+                if delay is None:
+                    break
+                if delay:
+                    # Close cancels the task, ending this sleep.
+                    await asyncio.sleep(delay)
+        finally:
+            if self.Is_Closing():
+                self.supervisor.Set_Stopped()
+        return
+
+
+    async def Run_Server_Executor(self):
+        '''
+        Run a legacy blocking entry function on the executor.
+        '''
+        await asyncio.get_running_loop().run_in_executor(
+            self.host.executor, self.Run_Server)
+        return
+
+
+    def Uses_Shared_Thread(self):
+        '''
+        Coroutine servers share the loop thread.
+        '''
+        return asyncio.iscoroutinefunction(self.entry_function)
+
+
+    def Report_Exit(self, future):
+        '''
+        Print any unhandled exception that stopped the server, since
+        the loop would otherwise hold onto it silently.
+        '''
+        if not future.cancelled() and future.exception() is not None:
+            ex = future.exception()
+            self.exception = ex
+            print(f'Server {self.entry_function.__module__} stopped on exception:')
+            print(''.join(traceback.format_exception(type(ex), ex, ex.__traceback__)))
+        return
+
+
+    def Close(self):
+        '''
+        Stop the server, interrupting its pipes. Coroutine servers are
+        also cancelled, in case they are waiting on something else.
+        '''
+        super().Close()
+        if asyncio.iscoroutinefunction(self.entry_function):
+            self.future.cancel()
+        return
+
+
+    def Join(self, timeout = None):
+        '''
+        Block until the server finishes, or until timeout seconds if given.
+        Returns True if it finished.
+        '''
+        concurrent.futures.wait([self.future], timeout)
+        return self.future.done()
@@ -0,0 +1,152 @@
+import time
+from .Pipe import Pipe_Server, Pipe_Client
+from .Transport import pipe_errors
+from .Pipe_Recorder import direction_write
+
+class Async_Pipe_Methods:
+    '''
+    Coroutine Read and Write, shared by the async pipe classes.
+
+    Attributes:
+    * async_write_lock
+      - asyncio.Lock held while a message's frames are written, so chunks
+        of messages from different coroutines don't interleave. Made on
+        the first unbatched Write.
+    '''
+    async_write_lock = None
+    # Windows pipes wait on the event loop's proactor.
+    overlapped_io = True
+
+    async def Read(self):
+        '''
+        Wait for and return the next message.
+
+        Raises Client_Garbage_Collected exception if this gets a
+        "garbage_collected" message.
+        '''
+        return self.Decode_Message(await self.Read_Bytes())
+
+    async def Read_Bytes(self):
+        '''
+        Wait for and return the next message without decoding it, as a
+        memoryview valid until the next read.
+        '''
+        self.Check_Cancelled()
+        self.Record_Handler_End()
+        if not self.read_queue and self.write_queue and self.flush_delay is None:
+            self.Flush()
+        stats = self.stats
+        wait = None
+        if not self.read_queue:
+            if stats is not None:
+                start = time.perf_counter()
+            try:
+                while not self.read_queue:
+                    data = await self.read_transport.Read_View_Async()
+                    self.read_queue.extend(self.Unpack_Messages(data))
+            except pipe_errors as ex:
+                self.Note_Pipe_Error(ex)
+                self.Check_Cancelled(ex)
+                raise
+            if stats is not None:
+                wait = time.perf_counter() - start
+
+        data = self.read_queue.popleft()
+        if stats is not None:
+            stats.Record_Read(len(data), wait)
+        self.Record_Handler_Start()
+        return data
+
+    async def Write(self, message):
+        '''
+        Write a message to the open pipe.
+        '''
+        if self.batch_writes:
+            # Queueing doesn't wait on the pipe, so reuse the plain Write.
+            super().Write(message)
+            return
+        self.Check_Cancelled()
+        if self.async_write_lock is None:
+            import asyncio
+            self.async_write_lock = asyncio.Lock()
+        data = self.Encode_Message(message)
+        if self.recorder is not None:
+            self.recorder.Record(direction_write, data)
+        if self.stats is not None:
+            start = time.perf_counter()
+        try:
+            # Chunks of a message go out back to back, as the sync Write
+            # does under its write_lock.
+            async with self.async_write_lock:
+                for frame in self.Split_Message(data):
+                    await self.write_transport.Write_Async(frame)
+        except pipe_errors as ex:
+            self.Check_Cancelled(ex)
+            raise
+        if self.stats is not None:
+            self.stats.Record_Write(len(data), time.perf_counter() - start)
+        return
+
+
+class Async_Pipe_Server(Async_Pipe_Methods, Pipe_Server):
+    '''
+    Asyncio version of Pipe_Server, for servers with an "async def main"
+    entry function. Connect, Read and Write are coroutines, letting many
+    servers share one event loop instead of each blocking a thread.
+
+    Example:
+        pipe = Async_Pipe_Server('x4_pipe')
+        await pipe.Connect()
+        message = await pipe.Read()
+        await pipe.Write('reply')
+
+    Read always waits for a message; non-blocking mode is not used.
+    '''
+    async def Connect(self):
+        '''
+        Wait for a client to connect to this pipe.
+        '''
+        self.Check_Cancelled()
+        try:
+            for transport in self.Get_Transports():
+                await transport.Connect_Async()
+        except pipe_errors as ex:
+            self.Check_Cancelled(ex)
+            raise
+        self.Report_Connect()
+        return
+
+
+class Async_Pipe_Client(Async_Pipe_Methods, Pipe_Client):
+    '''
+    Asyncio version of Pipe_Client, for testing async servers.
+
+    The first Write waits for the server's reply to the read_size
+    announcement, so shouldn't overlap a Read.
+    '''
+    is_async = True
+
+    async def Write(self, message):
+        '''
+        Write a message to the open pipe, after the server's read size
+        is known.
+        '''
+        if self.peer_read_size is None:
+            await self.Wait_For_Peer_Read_Size()
+        await super().Write(message)
+        return
+
+    async def Wait_For_Peer_Read_Size(self):
+        '''
+        Wait for the server's read size reply, keeping any messages sent
+        ahead of it for later reads.
+        '''
+        try:
+            while self.peer_read_size is None:
+                data = await self.read_transport.Read_View_Async()
+                self.read_queue.extend(bytes(x) for x in self.Unpack_Messages(data))
+        except pipe_errors as ex:
+            self.Note_Pipe_Error(ex)
+            self.Check_Cancelled(ex)
+            raise
+        return
@@ -0,0 +1,231 @@
+'''
+Typed binary codec for pipe messages.
+
+Text messages need hand parsing on both sides (eg. "command;key:value;")
+with numbers formatted to strings and cast back. Typed messages instead
+carry values with their types, packed as bytes, so that ints, floats,
+strings, lists and dicts come out of Read ready to use.
+
+Layout:
+    b'\x00T' header
+    One encoded value, where each value is a 1-byte tag followed by:
+        'n' : None, nothing further.
+        't' : True, nothing further.
+        'f' : False, nothing further.
+        'i' : Zigzag varint int (0,-1,1,-2,... as 0,1,2,3,...).
+              Only ints within +/-2**52 are sent this way, so that lua
+              numbers hold them exactly; larger ints are sent as doubles.
+        'd' : 8-byte little-endian double.
+        's' : Varint length, utf8 bytes. The string is also interned,
+              given the next index (from 0) in this message's string table.
+        'r' : Varint index of a previously interned string.
+        'l' : Varint count, then that many values.
+        'm' : Varint count, then that many key,value pairs.
+
+Varints are unsigned LEB128: 7 bits per byte, low bits first, with the
+high bit set on all but the last byte. Small ints, lengths and counts
+take a single byte, and repeated strings (eg. dict keys in a list of
+records) are sent once per message and then referenced by index.
+
+Use of the codec is negotiated per pipe, so text stays the default:
+the side that can decode typed messages sends a control message (see
+Framing.py) naming the codec, b'\x00Ccodec:typed', after which the
+other side may send it typed messages. Typed messages are always
+recognized on read, by their header, so either side may send them
+once it knows the other side supports them.
+
+The lua side (named_pipes/codec.lua) implements the same format.
+'''
+import struct
+
+typed_header = b'\x00T'
+
+# Names of the supported codecs; 'text' is plain utf8 strings.
+codecs = ('text', 'typed')
+
+_double_struct = struct.Struct('<d')
+_int_limit = 2**52
+
+
+def Is_Typed(data):
+    '''
+    Returns True if the given message bytes are a typed message.
+    '''
+    return data[:2] == typed_header
+
+
+def _Pack_Varint(value):
+    '''
+    Returns the varint bytes for a non-negative int.
+    '''
+    if value < 0x80:
+        return bytes((value,))
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _Unpack_Varint(data, position):
+    '''
+    Returns the varint at position, and the position following it.
+    '''
+    byte = data[position]
+    position += 1
+    if byte < 0x80:
+        return byte, position
+    value = byte & 0x7F
+    shift = 7
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+def Encode(value):
+    '''
+    Encode a value into typed message bytes.
+    Supports None, bool, int, float, str, list/tuple, and dict.
+    Raises TypeError on other types.
+    '''
+    parts = [typed_header]
+    _Encode_Value(value, parts, {})
+    return b''.join(parts)
+
+
+def _Encode_Value(value, parts, interned):
+    '''
+    Append the encoding of a value to parts.
+    * interned
+      - Dict of strings already sent, keyed to their index.
+    '''
+    # Check bool before int, since bools are ints.
+    if value is None:
+        parts.append(b'n')
+    elif value is True:
+        parts.append(b't')
+    elif value is False:
+        parts.append(b'f')
+
+    elif isinstance(value, int):
+        if -_int_limit <= value <= _int_limit:
+            parts.append(b'i')
+            # Zigzag, so small negative numbers stay small.
+            parts.append(_Pack_Varint(value * 2 if value >= 0 else -value * 2 - 1))
+        else:
+            parts.append(b'd')
+            parts.append(_double_struct.pack(value))
+
+    elif isinstance(value, float):
+        parts.append(b'd')
+        parts.append(_double_struct.pack(value))
+
+    elif isinstance(value, str):
+        index = interned.get(value)
+        if index is not None:
+            parts.append(b'r')
+            parts.append(_Pack_Varint(index))
+        else:
+            interned[value] = len(interned)
+            encoded = value.encode()
+            parts.append(b's')
+            parts.append(_Pack_Varint(len(encoded)))
+            parts.append(encoded)
+
+    elif isinstance(value, (list, tuple)):
+        parts.append(b'l')
+        parts.append(_Pack_Varint(len(value)))
+        for item in value:
+            _Encode_Value(item, parts, interned)
+
+    elif isinstance(value, dict):
+        parts.append(b'm')
+        parts.append(_Pack_Varint(len(value)))
+        for key, item in value.items():
+            _Encode_Value(key, parts, interned)
+            _Encode_Value(item, parts, interned)
+
+    else:
+        raise TypeError(f'Typed codec cannot encode {type(value).__name__}')
+    return
+
+
+def Decode(data):
+    '''
+    Decode typed message bytes (or memoryview) into a value.
+    Raises ValueError on malformed data.
+    '''
+    if not Is_Typed(data):
+        raise ValueError('Message is missing the typed header')
+    try:
+        value, position = _Decode_Value(data, len(typed_header), [])
+    except (IndexError, struct.error) as ex:
+        raise ValueError(f'Truncated typed message: {ex}')
+    if position != len(data):
+        raise ValueError('Extra data after typed message value')
+    return value
+
+
+def _Decode_Value(data, position, interned):
+    '''
+    Decode the value starting at position.
+    Returns the value and the position following it.
+    * interned
+      - List of strings decoded so far, by index.
+    '''
+    tag = data[position]
+    position += 1
+
+    # Roughly in order of expected frequency.
+    if tag == 0x69: # 'i'
+        value, position = _Unpack_Varint(data, position)
+        if value & 1:
+            return -(value >> 1) - 1, position
+        return value >> 1, position
+
+    if tag == 0x72: # 'r'
+        index, position = _Unpack_Varint(data, position)
+        return interned[index], position
+
+    if tag == 0x73: # 's'
+        length, position = _Unpack_Varint(data, position)
+        end = position + length
+        if end > len(data):
+            raise IndexError('string runs past end of message')
+        value = str(data[position : end], 'utf-8')
+        interned.append(value)
+        return value, end
+
+    if tag == 0x64: # 'd'
+        return _double_struct.unpack_from(data, position)[0], position + 8
+
+    if tag == 0x6D: # 'm'
+        count, position = _Unpack_Varint(data, position)
+        value = {}
+        for _ in range(count):
+            key , position = _Decode_Value(data, position, interned)
+            item, position = _Decode_Value(data, position, interned)
+            value[key] = item
+        return value, position
+
+    if tag == 0x6C: # 'l'
+        count, position = _Unpack_Varint(data, position)
+        value = []
+        for _ in range(count):
+            item, position = _Decode_Value(data, position, interned)
+            value.append(item)
+        return value, position
+
+    if tag == 0x6E: # 'n'
+        return None, position
+    if tag == 0x74: # 't'
+        return True, position
+    if tag == 0x66: # 'f'
+        return False, position
+
+    raise ValueError(f'Unknown typed tag {tag!r} at position {position - 1}')
@@ -0,0 +1,184 @@
+'''
+Index of the x4 extensions folder, for permission checks on announced
+server modules.
+
+x4 re-announces every server module on each save reload, so rather than
+reading each module's content.xml on every announcement, the host keeps
+one index per x4 install, refreshed once per host pipe connection. Each
+refresh stats every extensions/*/content.xml and only reparses those
+whose mtime changed (or that are new), dropping extensions that went
+away. Lookups are then dict accesses by extension folder name.
+'''
+import os
+import re
+from pathlib import Path
+
+# Attributes within the opening <content ...> tag.
+_attribute_re = re.compile(r'([\w:]+)\s*=\s*"([^"]*)"')
+
+
+class Extension_Info:
+    '''
+    Details of one extension, from its content.xml.
+
+    Attributes:
+    * folder
+      - Path to the extension folder.
+    * content_id
+      - String, extension id from content.xml.
+    * enabled
+      - Bool, the "enabled" attribute of content.xml (defaulting to True,
+        as x4 does).
+    * python_modules
+      - Set of file names found in the extension's python folder (.py,
+        or .txt as in steam releases).
+    * mtime_ns
+      - content.xml modification time when parsed.
+    '''
+    def __init__(self, folder, content_id, enabled, python_modules, mtime_ns):
+        self.folder = folder
+        self.content_id = content_id
+        self.enabled = enabled
+        self.python_modules = python_modules
+        self.mtime_ns = mtime_ns
+        return
+
+
+    @staticmethod
+    def Parse(folder, mtime_ns = None):
+        '''
+        Returns an Extension_Info for the given extension folder, reading
+        its content.xml. Raises an exception if that is missing or has no id.
+        '''
+        folder = Path(folder)
+        content_path = folder / 'content.xml'
+        if mtime_ns is None:
+            mtime_ns = os.stat(content_path).st_mtime_ns
+
+        # Load the content.xml. Can do xml or raw text; text should
+        # be good enough for now (avoid adding lxml to the exe).
+        content_text = content_path.read_text(errors = 'replace')
+
+        # Pull attributes from the content tag.
+        start = content_text.find('<content')
+        end = content_text.find('>', start)
+        if start < 0 or end < 0:
+            raise Exception('No <content> tag in content.xml')
+        attributes = dict(_attribute_re.findall(content_text[start : end]))
+        if not attributes.get('id'):
+            raise Exception('No id in content.xml')
+
+        python_modules = set()
+        python_folder = folder / 'python'
+        if python_folder.is_dir():
+            python_modules = set(x.name for x in python_folder.iterdir()
+                                 if x.suffix in ('.py', '.txt'))
+
+        return Extension_Info(
+            folder         = folder,
+            content_id     = attributes['id'],
+            enabled        = attributes.get('enabled', 'true').lower() not in ('false', '0'),
+            python_modules = python_modules,
+            mtime_ns       = mtime_ns,
+            )
+
+
+class Extension_Index:
+    '''
+    Extension_Info for each extension folder of an x4 install.
+
+    Attributes:
+    * x4_path
+      - Path to the x4 folder indexed, or None before the first Refresh.
+    * extensions
+      - Dict of Extension_Info, keyed by extension folder name.
+    * errors
+      - Dict of error strings for folders whose content.xml could not be
+        parsed, keyed by folder name, with the mtime_ns seen.
+    '''
+    def __init__(self):
+        self.x4_path = None
+        self.extensions = {}
+        self.errors = {}
+        return
+
+
+    def Refresh(self, x4_path):
+        '''
+        Bring the index up to date with the extensions folder of the
+        given x4 install, reparsing only changed content.xml files.
+        '''
+        x4_path = Path(x4_path)
+        if x4_path != self.x4_path:
+            # Different install; start over.
+            self.x4_path = x4_path
+            self.extensions = {}
+            self.errors = {}
+
+        seen = set()
+        try:
+            entries = list(os.scandir(x4_path / 'extensions'))
+        except OSError:
+            entries = []
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+            try:
+                mtime_ns = os.stat(os.path.join(entry.path, 'content.xml')).st_mtime_ns
+            except OSError:
+                # Not an extension.
+                continue
+            seen.add(entry.name)
+            self._Update(entry.name, mtime_ns)
+
+        # Forget removed extensions.
+        for name in list(self.extensions):
+            if name not in seen:
+                del self.extensions[name]
+        for name in list(self.errors):
+            if name not in seen:
+                del self.errors[name]
+        return
+
+
+    def _Update(self, name, mtime_ns):
+        '''
+        Parse the named extension folder, unless already parsed at the
+        given content.xml mtime.
+        '''
+        info = self.extensions.get(name)
+        if info is not None and info.mtime_ns == mtime_ns:
+            return
+        error = self.errors.get(name)
+        if error is not None and error[1] == mtime_ns:
+            return
+        self.extensions.pop(name, None)
+        self.errors.pop(name, None)
+        try:
+            self.extensions[name] = Extension_Info.Parse(
+                self.x4_path / 'extensions' / name, mtime_ns)
+        except Exception as ex:
+            self.errors[name] = ('{}: {}'.format(type(ex).__name__, ex if str(ex) else 'Unspecified'), mtime_ns)
+        return
+
+
+    def Get(self, name):
+        '''
+        Returns the Extension_Info for the named extension folder.
+        Folders not in the index (eg. added since the last Refresh) are
+        looked up directly. Raises an exception if it isn't a valid
+        extension.
+        '''
+        info = self.extensions.get(name)
+        if info is not None:
+            return info
+        if name not in self.errors:
+            try:
+                mtime_ns = os.stat(self.x4_path / 'extensions' / name / 'content.xml').st_mtime_ns
+            except OSError:
+                raise Exception('Extension content.xml not found')
+            self._Update(name, mtime_ns)
+            info = self.extensions.get(name)
+            if info is not None:
+                return info
+        raise Exception(self.errors[name][0])
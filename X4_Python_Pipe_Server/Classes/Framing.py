@@ -0,0 +1,133 @@
+'''
+Message framing used on top of the raw pipe messages.
+
+Batches pack several messages into one pipe message, so that many small
+messages cost a single pipe write and a single read on the other side.
+Layout:
+    b'\x00B' header
+    Repeated for each message:
+        4-byte little-endian unsigned length
+        message bytes
+
+Chunks split a message too large for the reader's buffer into several
+pipe messages, which the reader joins back together.
+Layout, for each chunk:
+    b'\x00F' header on all but the last chunk (more follows)
+    b'\x00L' header on the last chunk
+    part of the message bytes
+Chunks are never put in batches.
+
+Control messages let each side tell the other what it supports.
+Layout:
+    b'\x00C' header
+    utf8 "name:value" text, eg. "read_size:2048" or "codec:typed".
+Control messages are handled by the Pipe and never returned by Read.
+
+Text messages never start with a null byte, so framed messages can be
+told apart from plain ones, and plain messages can still pass through
+a pipe that uses framing. The lua side (named_pipes/pipes.lua) handles
+frames the same way.
+'''
+import struct
+
+batch_header = b'\x00B'
+_length_struct = struct.Struct('<I')
+# Bytes added per message in a batch.
+batch_entry_overhead = _length_struct.size
+
+chunk_header      = b'\x00F'
+last_chunk_header = b'\x00L'
+# Bytes added to each chunk.
+chunk_overhead = len(chunk_header)
+
+control_header = b'\x00C'
+
+
+def Is_Batch(data):
+    '''
+    Returns True if the given message bytes are a batch.
+    '''
+    return data[:2] == batch_header
+
+
+def Pack_Batch(messages):
+    '''
+    Pack a list of message bytes into a single batch message.
+    '''
+    pack = _length_struct.pack
+    parts = [batch_header]
+    for message in messages:
+        parts.append(pack(len(message)))
+        parts.append(message)
+    return b''.join(parts)
+
+
+def Unpack_Batch(data):
+    '''
+    Unpack a batch message into a list of message bytes.
+    '''
+    unpack_from = _length_struct.unpack_from
+    messages = []
+    position = len(batch_header)
+    end = len(data)
+    while position < end:
+        length, = unpack_from(data, position)
+        position += batch_entry_overhead
+        messages.append(data[position : position + length])
+        position += length
+    return messages
+
+
+def Is_Chunk(data):
+    '''
+    Returns True if the given message bytes are a chunk of a larger
+    message, including the last chunk.
+    '''
+    header = data[:2]
+    return header == chunk_header or header == last_chunk_header
+
+
+def Is_Last_Chunk(data):
+    '''
+    Returns True if the given message bytes are the last chunk of a
+    larger message.
+    '''
+    return data[:2] == last_chunk_header
+
+
+def Split_Chunks(data, max_size):
+    '''
+    Split message bytes into a list of chunks, each at most max_size
+    bytes including its header.
+    '''
+    part_size = max_size - chunk_overhead
+    if part_size <= 0:
+        raise ValueError(f'max_size {max_size} too small for chunks')
+    view = memoryview(data)
+    chunks = []
+    for start in range(0, len(view), part_size):
+        chunks.append(chunk_header + view[start : start + part_size])
+    chunks[-1] = last_chunk_header + chunks[-1][chunk_overhead:]
+    return chunks
+
+
+def Is_Control(data):
+    '''
+    Returns True if the given message bytes are a control message.
+    '''
+    return data[:2] == control_header
+
+
+def Pack_Control(name, value):
+    '''
+    Returns a control message setting name to value.
+    '''
+    return control_header + f'{name}:{value}'.encode()
+
+
+def Unpack_Control(data):
+    '''
+    Returns the name and value strings of a control message.
+    '''
+    name, _, value = str(data[len(control_header):], 'utf-8').partition(':')
+    return name, value
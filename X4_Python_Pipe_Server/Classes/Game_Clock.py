@@ -0,0 +1,235 @@
+'''
+Mapping between x4 game time and wall clock time.
+
+X4 scripts see game time ($gametime, GetCurTime), which runs faster
+under SETA and stops while paused, and lua sees engine real time
+(GetCurRealTime), which skips time the game is minimized. Python servers
+see the wall clock (time.perf_counter). The Time_API server feeds the
+shared Game_Clock with periodic (game time, engine time) samples, each
+stamped with the wall clock time it arrived, and running linear fits
+relate the three clocks:
+* game time per engine second: the current time dilation (SETA factor),
+  0 while paused.
+* engine time per wall second: nominally 1, with the difference being
+  the drift between the clocks (and pipe delay variation).
+
+Other servers in the host process can then convert timestamps (eg. the
+$gametime of Measure_FPS samples) without pipe round trips, through
+Get_Game_Clock(). Servers run in their own process (run_in_process) get
+their own, unfed, Game_Clock.
+'''
+import time
+import threading
+from collections import deque
+
+# Shared clock, made on first use.
+_game_clock = None
+_game_clock_lock = threading.Lock()
+
+
+def Get_Game_Clock():
+    '''
+    Returns the Game_Clock shared by all servers of this process.
+    '''
+    global _game_clock
+    with _game_clock_lock:
+        if _game_clock is None:
+            _game_clock = Game_Clock()
+    return _game_clock
+
+
+class Linear_Fit:
+    '''
+    Least squares fit of y = intercept + slope * x over a window of
+    recent samples. When a sample lands further than tolerance from the
+    fitted line, the relation is taken to have changed (eg. SETA toggled,
+    or the game was minimized), and the fit restarts from the samples
+    either side of the change.
+
+    Parameters:
+    * max_samples
+      - Int, number of recent samples fitted.
+    * tolerance
+      - Float, largest y distance from the fit of a sample that doesn't
+        restart it.
+    * default_slope
+      - Float, slope used until two samples are available.
+
+    Attributes:
+    * samples
+      - Deque of (x, y) samples in the fit.
+    * slope
+    * intercept
+      - Floats, the current fit.
+    * restarts
+      - Int, number of times the fit was restarted.
+    '''
+    def __init__(self, max_samples = 30, tolerance = 0.05, default_slope = 1.0):
+        self.samples = deque(maxlen = max_samples)
+        self.tolerance = tolerance
+        self.slope = default_slope
+        self.intercept = 0.0
+        self.restarts = 0
+        return
+
+
+    def Add(self, x, y):
+        '''
+        Add a sample, and refit.
+        '''
+        if len(self.samples) >= 2 and abs(self.Get_Y(x) - y) > self.tolerance:
+            # Keep only the last sample, which is assumed to be at or
+            # after the change.
+            last = self.samples[-1]
+            self.samples.clear()
+            self.samples.append(last)
+            self.restarts += 1
+        self.samples.append((x, y))
+        self.Refit()
+        return
+
+
+    def Refit(self):
+        '''
+        Recompute the slope and intercept from the samples.
+        '''
+        count = len(self.samples)
+        mean_x = sum(x for x, _ in self.samples) / count
+        mean_y = sum(y for _, y in self.samples) / count
+        if count >= 2:
+            var_x = sum((x - mean_x) ** 2 for x, _ in self.samples)
+            if var_x > 0:
+                self.slope = sum((x - mean_x) * (y - mean_y)
+                                 for x, y in self.samples) / var_x
+        self.intercept = mean_y - self.slope * mean_x
+        return
+
+
+    def Get_Y(self, x):
+        '''
+        Returns the fitted y at x.
+        '''
+        return self.intercept + self.slope * x
+
+
+    def Get_X(self, y):
+        '''
+        Returns the fitted x at y, or None if the slope is 0.
+        '''
+        if self.slope == 0:
+            return None
+        return (y - self.intercept) / self.slope
+
+
+class Game_Clock:
+    '''
+    Converts between game time, engine time and wall clock time, from
+    fits of samples sent by x4.
+
+    Attributes:
+    * engine_fit
+      - Linear_Fit of engine time (y) against wall time (x).
+    * game_fit
+      - Linear_Fit of game time (y) against engine time (x).
+    * sample_count
+      - Int, number of samples added.
+    * last_sample
+      - Tuple of (game time, engine time, wall time) of the last sample,
+        or None.
+    * lock
+      - Lock serializing updates with conversions from other threads.
+    '''
+    def __init__(self):
+        # Engine time is stamped at frame start, and arrives after some
+        # pipe delay, so allow for a long frame of jitter.
+        self.engine_fit = Linear_Fit(tolerance = 0.1)
+        # Game time and engine time are stamped in the same frame.
+        self.game_fit = Linear_Fit(tolerance = 0.05)
+        self.sample_count = 0
+        self.last_sample = None
+        self.lock = threading.Lock()
+        return
+
+
+    def Add_Sample(self, game_time, engine_time, wall_time = None):
+        '''
+        Add a sample of the game and engine times, taken at the given
+        wall time (time.perf_counter(); default now).
+        '''
+        if wall_time is None:
+            wall_time = time.perf_counter()
+        with self.lock:
+            self.engine_fit.Add(wall_time, engine_time)
+            self.game_fit.Add(engine_time, game_time)
+            self.sample_count += 1
+            self.last_sample = (game_time, engine_time, wall_time)
+        return
+
+
+    def Is_Synced(self):
+        '''
+        Returns True once enough samples arrived for conversions.
+        '''
+        return self.sample_count >= 2
+
+
+    def Get_Dilation(self):
+        '''
+        Returns the game seconds passing per engine second, eg. 1 normally,
+        higher under SETA, 0 while paused. None if not synced.
+        '''
+        if not self.Is_Synced():
+            return None
+        return self.game_fit.slope
+
+
+    def Get_Drift(self):
+        '''
+        Returns the fractional rate the engine clock gains on the wall
+        clock, eg. 1e-5 for 10 us per second, or None if not synced.
+        '''
+        if not self.Is_Synced():
+            return None
+        return self.engine_fit.slope - 1
+
+
+    def Wall_To_Game(self, wall_time = None):
+        '''
+        Returns the game time at the given wall time (default now), or None
+        if not synced.
+        '''
+        if wall_time is None:
+            wall_time = time.perf_counter()
+        if not self.Is_Synced():
+            return None
+        with self.lock:
+            return self.game_fit.Get_Y(self.engine_fit.Get_Y(wall_time))
+
+
+    def Game_To_Wall(self, game_time):
+        '''
+        Returns the wall time at which the game reached the given game
+        time, or None if not synced or the game is paused.
+        '''
+        if not self.Is_Synced():
+            return None
+        with self.lock:
+            engine_time = self.game_fit.Get_X(game_time)
+            if engine_time is None:
+                return None
+            return self.engine_fit.Get_X(engine_time)
+
+
+    def Get_Snapshot(self):
+        '''
+        Returns a dict of the clock state: synced, dilation, drift, samples,
+        and restarts of the game and engine fits.
+        '''
+        return {
+            'synced'          : self.Is_Synced(),
+            'dilation'        : self.Get_Dilation(),
+            'drift'           : self.Get_Drift(),
+            'samples'         : self.sample_count,
+            'game_restarts'   : self.game_fit.restarts,
+            'engine_restarts' : self.engine_fit.restarts,
+            }
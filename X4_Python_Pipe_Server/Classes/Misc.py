@@ -1,3 +1,6 @@
+import sys
+import functools
+import threading
 
 class Client_Garbage_Collected(Exception):
     '''
@@ -5,3 +8,155 @@ class Client_Garbage_Collected(Exception):
     garbage collected. Added as an alternative to proper file closing,
     since that started crashing x4 around v3.0.
     '''
+
+class Pipe_Error(Exception):
+    '''
+    Pipe access error raised by non-windows transports.
+    Fields mirror those of win32api.error, so that handlers can treat
+    both alike.
+
+    Attributes:
+    * winerror
+      - Int, closest matching windows error code, eg. ERROR_BROKEN_PIPE
+        when the other end of the pipe closed.
+    * funcname
+      - String, name of the function that errored, eg. 'recv'.
+    * strerror
+      - String description of the error.
+    '''
+    def __init__(self, winerror, funcname, strerror):
+        super().__init__(winerror, funcname, strerror)
+        self.winerror = winerror
+        self.funcname = funcname
+        self.strerror = strerror
+        return
+
+
+class Server_Cancelled(Exception):
+    '''
+    Raised by pipe operations in a server whose run was cancelled (see
+    Cancel_Token), eg. when the host closes the server. Servers should
+    let this propagate out of main(), cleaning up on the way.
+    '''
+
+
+class Cancel_Token:
+    '''
+    Cooperative cancellation flag for one run of a server, passed to its
+    main() as args['cancel_token'].
+
+    Pipes created by the server check the token on each Connect, Read
+    and Write, and are interrupted when it is cancelled, so blocked calls
+    raise Server_Cancelled. Servers with their own loops or subthreads
+    can poll Is_Cancelled, sleep with Wait, or register a callback (eg.
+    to stop a listener thread) with Add_Callback.
+
+    Tokens are cancelled when the host closes the server, and also when
+    the run ends for any reason (eg. a pipe disconnect before a restart),
+    so that anything started for the run can be stopped.
+
+    Parameters:
+    * parent
+      - Optional Cancel_Token; this token is cancelled along with it.
+
+    Attributes:
+    * event
+      - threading.Event set on cancellation.
+    * callbacks
+      - List of functions to call on cancellation.
+    '''
+    def __init__(self, parent = None):
+        self.event = threading.Event()
+        self.callbacks = []
+        self.lock = threading.Lock()
+        if parent is not None:
+            parent.Add_Callback(self.Cancel)
+        return
+
+
+    def Cancel(self):
+        '''
+        Cancel the token, calling any callbacks (once).
+        '''
+        with self.lock:
+            if self.event.is_set():
+                return
+            self.event.set()
+            callbacks = self.callbacks
+            self.callbacks = []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as ex:
+                print(f'Cancel callback {callback} failed: {type(ex).__name__}: {ex}')
+        return
+
+
+    def Is_Cancelled(self):
+        '''
+        Returns True if the token has been cancelled.
+        '''
+        return self.event.is_set()
+
+
+    def Check(self):
+        '''
+        Raise Server_Cancelled if the token has been cancelled.
+        '''
+        if self.event.is_set():
+            raise Server_Cancelled()
+        return
+
+
+    def Wait(self, timeout = None):
+        '''
+        Sleep until cancelled, or for timeout seconds if given.
+        Returns True if cancelled.
+        '''
+        return self.event.wait(timeout)
+
+
+    def Add_Callback(self, callback):
+        '''
+        Register a function (taking no args) to call on cancellation, from
+        the cancelling thread. Called right away if already cancelled.
+        '''
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(callback)
+                return
+        callback()
+        return
+
+
+    def Remove_Callback(self, callback):
+        '''
+        Unregister a callback, if present.
+        '''
+        with self.lock:
+            if callback in self.callbacks:
+                self.callbacks.remove(callback)
+        return
+
+
+# Code flag of "async def" functions (inspect.CO_COROUTINE), duplicated
+# here to avoid importing inspect.
+CO_COROUTINE = 0x80
+
+def Is_Coroutine_Function(function):
+    '''
+    Returns True if function is an "async def" function (or a partial or
+    method of one). Checked without importing asyncio, which is slow to
+    import and only needed once an async server is found.
+    '''
+    while isinstance(function, functools.partial):
+        function = function.func
+    function = getattr(function, '__func__', function)
+    code = getattr(function, '__code__', None)
+    if code is not None and code.co_flags & CO_COROUTINE:
+        return True
+    # Other callables (eg. asyncio marked ones) need asyncio to tell, though
+    # only if it was loaded to make them.
+    if 'asyncio' in sys.modules:
+        return sys.modules['asyncio'].iscoroutinefunction(function)
+    return False
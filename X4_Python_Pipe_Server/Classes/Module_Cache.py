@@ -0,0 +1,168 @@
+'''
+Compiled code cache for extension server modules.
+
+Steam releases ship server modules renamed to .txt, and the host loads
+them straight from source, so python never writes a .pyc for them (and
+the game folder may not be writable anyway). Every host start would
+then recompile every module.
+
+Instead, the host keeps its own cache of compiled code objects, in a
+folder next to permissions.json, one file per module. Each entry records
+the module path, source size, mtime and content hash:
+* If size and mtime match, the cached code is used without reading
+  the source.
+* Otherwise, the source is read and hashed; if the hash matches (eg. a
+  steam update rewrote an unchanged file), the cached code is still used
+  and the entry is refreshed.
+* Otherwise, the source is compiled and the entry rewritten.
+Entries also record the python bytecode magic number, so a host built
+on another python version recompiles.
+
+Failures to read or write the cache are never fatal; the module is just
+compiled from source.
+'''
+import os
+import hashlib
+import marshal
+import importlib.util
+from pathlib import Path
+# Note: in other projects importlib.machinery could be used directly,
+# but appears to be failing when pyinstalling this package, so do
+# a more directly import of machinery.
+from importlib import machinery
+
+# Folder holding the cache entries; None disables the cache.
+cache_dir = None
+
+# Bumped if the entry layout changes.
+_entry_format = 1
+
+
+def Set_Cache_Dir(path):
+    '''
+    Set the folder to cache compiled modules in, or None to disable
+    caching. The folder is created when the first entry is written.
+    '''
+    global cache_dir
+    cache_dir = Path(path) if path is not None else None
+    return
+
+
+def Get_Module_Name(path):
+    '''
+    Returns the sys.modules name used for the extension module at the
+    given path. The basename is prefixed to keep it from colliding with
+    other loaded modules.
+    '''
+    return 'user_module_' + Path(path).name.replace(' ','_')
+
+
+def _Get_Entry_Path(folder, path):
+    '''
+    Returns the cache file path for the module at the given path.
+    Named by module for readability, plus a hash of the full path to
+    keep same named modules of different extensions apart.
+    '''
+    path_hash = hashlib.sha1(str(path).encode()).hexdigest()[:16]
+    return folder / f'{Path(path).name}.{path_hash}.bin'
+
+
+class Cached_Source_Loader(machinery.SourceFileLoader):
+    '''
+    Source file loader that gets its code objects through the module
+    cache, when one is set.
+
+    Parameters:
+    * fullname
+      - String, module name.
+    * path
+      - String, path to the source file (.py or .txt).
+    * cache_folder
+      - Optional folder to cache in, overriding the global cache_dir
+        (eg. in server processes, which don't share host globals).
+
+    Attributes:
+    * cache_hit
+      - Bool, True if the last get_code call used cached code.
+    '''
+    def __init__(self, fullname, path, cache_folder = None):
+        super().__init__(fullname, path)
+        self.cache_folder = Path(cache_folder) if cache_folder else None
+        self.cache_hit = False
+        return
+
+
+    def get_code(self, fullname):
+        '''
+        Returns the code object for the module, from the cache if valid,
+        else compiled from source (updating the cache).
+        '''
+        self.cache_hit = False
+        folder = self.cache_folder or cache_dir
+        if folder is None:
+            return super().get_code(fullname)
+
+        path = Path(self.path)
+        entry_path = _Get_Entry_Path(folder, path)
+        stat = os.stat(path)
+
+        # Load any existing entry. Anything unexpected counts as a miss.
+        entry = None
+        try:
+            entry = marshal.loads(entry_path.read_bytes())
+            if (not isinstance(entry, tuple) or len(entry) != 7
+            or entry[0] != _entry_format
+            or entry[1] != importlib.util.MAGIC_NUMBER
+            or entry[2] != str(path)):
+                entry = None
+        except (OSError, EOFError, ValueError, TypeError):
+            entry = None
+
+        # Quick check on the file stats.
+        if (entry is not None
+        and entry[3] == stat.st_size and entry[4] == stat.st_mtime_ns):
+            self.cache_hit = True
+            return entry[6]
+
+        source = self.get_data(self.path)
+        source_hash = hashlib.sha256(source).digest()
+
+        if entry is not None and entry[5] == source_hash:
+            # Unchanged contents with new stats; reuse the code.
+            self.cache_hit = True
+            code = entry[6]
+        else:
+            code = self.source_to_code(source, self.path)
+
+        # Save the (re)validated entry. Write to a temp file and swap it
+        # in, so a concurrent reader never sees a partial entry.
+        try:
+            folder.mkdir(parents = True, exist_ok = True)
+            temp_path = entry_path.with_name(entry_path.name + f'.{os.getpid()}.tmp')
+            temp_path.write_bytes(marshal.dumps((
+                _entry_format,
+                importlib.util.MAGIC_NUMBER,
+                str(path),
+                stat.st_size,
+                stat.st_mtime_ns,
+                source_hash,
+                code,
+                )))
+            os.replace(temp_path, entry_path)
+        except OSError as ex:
+            print(f'Failed to write module cache entry {entry_path}: {ex}')
+        return code
+
+
+def Load_Module(path, cache_folder = None):
+    '''
+    Import and return the module at the given path, named as by
+    Get_Module_Name, using the module cache.
+    Check module.__loader__.cache_hit to see if cached code was used.
+    '''
+    # Note: load_module also registers the module in sys.modules.
+    return Cached_Source_Loader(
+        Get_Module_Name(path),
+        str(path),
+        cache_folder,
+        ).load_module()
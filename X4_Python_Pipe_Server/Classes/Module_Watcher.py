@@ -0,0 +1,84 @@
+import os
+import hashlib
+from pathlib import Path
+
+class Module_Watcher:
+    '''
+    Watches server module source files for changes, for hot reloading.
+
+    Poll compares each file's size and mtime against the last seen; if
+    those changed, the contents are hashed, so that a save without edits
+    (or a copy keeping the contents) doesn't count as a change.
+
+    Attributes:
+    * files
+      - Dict, keyed by a caller chosen key (eg. the module's relative
+        path), holding [path, (size, mtime_ns), sha256 digest] for each
+        watched file.
+    '''
+    def __init__(self):
+        self.files = {}
+        return
+
+
+    @staticmethod
+    def Get_Signature(path):
+        '''
+        Returns the (size, mtime_ns) of the file, or None if missing.
+        '''
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (stat.st_size, stat.st_mtime_ns)
+
+
+    @staticmethod
+    def Get_Hash(path):
+        '''
+        Returns the sha256 digest of the file contents, or None if it
+        could not be read.
+        '''
+        try:
+            return hashlib.sha256(Path(path).read_bytes()).digest()
+        except OSError:
+            return None
+
+
+    def Add(self, key, path):
+        '''
+        Start watching the file at path under the given key, taking its
+        current state as unchanged. Replaces any prior file for the key.
+        '''
+        self.files[key] = [Path(path), self.Get_Signature(path), self.Get_Hash(path)]
+        return
+
+
+    def Remove(self, key):
+        '''
+        Stop watching the file for the given key.
+        '''
+        self.files.pop(key, None)
+        return
+
+
+    def Poll(self):
+        '''
+        Returns a list of (key, path) for watched files whose contents
+        changed since they were added or last polled. Files that went
+        missing are not reported until they reappear.
+        '''
+        changed = []
+        # Copy, in case files are added from another thread meanwhile.
+        for key, entry in list(self.files.items()):
+            path, signature, digest = entry
+            new_signature = self.Get_Signature(path)
+            if new_signature is None or new_signature == signature:
+                continue
+            entry[1] = new_signature
+            new_digest = self.Get_Hash(path)
+            if new_digest is None or new_digest == digest:
+                continue
+            entry[2] = new_digest
+            changed.append((key, path))
+        return changed
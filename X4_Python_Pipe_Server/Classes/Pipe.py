@@ -1,115 +1,628 @@
-
+import time
+import threading
+from collections import deque
 from pathlib import Path
-# Note: import pywin32 as win32api, if needed, though subpackages are
-#  directly available.
-# The top level has the "error" exception.
-import win32api
-# This has windows error codes.
-import winerror
-# This can open a pipe.
-import win32pipe
-# This reads/writes the pipe file.
-import win32file
-# This provides support for changing access permissions (for users where
-# the defaults don't work). Note: defaults work for most users.
-import win32security
-# Support for looking at processes.
-import win32process
-import win32con
-#import ntsecuritycon as con
-
-from .Misc import Client_Garbage_Collected
+
+from .Misc import Client_Garbage_Collected, Server_Cancelled
+from .Transport import Get_Transport_Class, pipe_errors, Is_Disconnect_Error
+from .Framing import Is_Batch, Pack_Batch, Unpack_Batch
+from .Framing import batch_header, batch_entry_overhead
+from .Framing import Is_Chunk, Is_Last_Chunk, Split_Chunks
+from .Framing import chunk_header, last_chunk_header, chunk_overhead
+from .Framing import Is_Control, Pack_Control, Unpack_Control
+from .Pipe_Stats import Get_Pipe_Stats
+from .Pipe_Recorder import Get_Recorder, direction_read, direction_write
+from .Server_Thread import Get_Current_Server
+from . import Codec
 
 class Pipe:
     '''
     Base class for Pipe_Server and Pipe_Client.
     Aims to implement any shared functionality.
+    OS specific pipe access is handled by a Transport object, selected
+    at runtime (windows named pipes by default on windows, unix domain
+    sockets elsewhere).
+
+    By default a single bidirectional pipe is used. With dual_channel
+    set, messages to the server go through the named pipe and messages
+    from the server go through a second "<pipe_name>_out" pipe, so that
+    a thread blocked in Read will not obstruct another thread trying
+    to Write (as happens when both wait on the same windows pipe handle).
+    The x4 side must be told to match, using md.Named_Pipes.Set_Dual_Channel.
+
+    With batch_writes set, Write queues messages, and queued messages are
+    sent together as one framed batch message (see Framing.py). Queued
+    messages are flushed by an explicit Flush call, when the batch would
+    exceed buffer_size, and either by the next Read (so replies go out
+    at the end of handling a request) or, if flush_delay is given, by a
+    timer that long after the first queued message. Read always unpacks
+    received batches, returning their messages one at a time.
+    Writes are thread safe in either mode.
+
+    Messages larger than the reader's buffer are split into chunks (see
+    Framing.py), which Read joins back into the whole message, so the
+    buffer_size no longer limits message size. Read_Chunks instead
+    yields the chunks as they arrive, for streaming large messages, and
+    Write_Chunks sends a message from an iterable of parts.
+
+    Framed messages (batches, chunks, typed) are only sent once the other
+    side has announced its read size with a control message. Pipe_Clients
+    and x4 (with an up to date winpipe dll) announce this on connecting,
+    and Pipe_Servers reply with their own read size. Until then, batched
+    writes are sent one message at a time and nothing is chunked.
+
+    Messages may also use the typed binary codec (see Codec.py), which
+    sends ints, floats, strings, lists and dicts with their types intact.
+    Typed messages are always decoded on Read, returning python values.
+    Writes stay text unless codec is 'typed': a Pipe_Server then switches
+    to typed writes once the client announces it can decode them (as x4
+    does after md.Named_Pipes.Set_Typed_Codec), and a Pipe_Client announces
+    this on opening and writes typed right away.
+
+    When stats are enabled (see Pipe_Stats.py) before the pipe is created,
+    reads, writes and connects are recorded into the stats for its name.
+
+    Pipes created by a server run through Server_Thread are tracked by
+    that server, and given the Cancel_Token of the current run. Connect,
+    Read and Write raise Server_Cancelled once that is cancelled, including
+    calls blocked at the time (which are interrupted, see Interrupt).
 
-    TODO: switch to paired unidirectional pipes instead of a single
-    bidirectional pipe, to better match what linux would need, and
-    to enable servers to set parallel read/write threads without them
-    blocking each other by trying to use the same pipe (eg. pipe
-    waiting to be Read will obstruct to other thread trying to Write)
-    
     Parameters:
     * pipe_name
       - String, name of the pipe without OS path prefix.
     * buffer_size
       - Int, bytes to reserve for the buffers in each direction.
-      - This has to be larger than the largest message that will pass
-        through the pipe, and large enough that writes from x4 to the
-        server will never fill the pipe to capacity.
+      - This is the largest message read in one piece; larger messages
+        need to be chunked by the writer. It should also be large enough
+        that writes from x4 to the server will never fill the pipe to
+        capacity.
       - Defaults to 64 kB.
       - Pipe_Clients use this for knowing how much to read.
+    * transport
+      - Optional string, name of the transport to use, eg. 'win_pipe'
+        or 'unix_socket'. Defaults to the host's selected transport.
+    * verbose
+      - Bool, if True then the transport prints extra setup messages.
+    * dual_channel
+      - Bool, if True then use paired unidirectional pipes.
+    * batch_writes
+      - Bool, if True then coalesce writes into batches.
+    * flush_delay
+      - Optional float, seconds after queueing a batched write at which
+        the batch is sent automatically. Since x4 reads pipes once per
+        frame, around 0.001 adds no noticeable latency.
 
     Attributes:
-    * pipe_file
-      - Open pipe/file object.
+    * transport
+      - Transport object owning the OS pipe handles.
+      - For dual_channel, this is the pipe toward the server.
+    * out_transport
+      - Transport for the pipe from the server, when dual_channel.
+    * read_transport
+    * write_transport
+      - The transports that Read and Write will use.
+    * write_lock
+      - Lock serializing writes from multiple threads.
+    * write_queue
+      - List of encoded messages waiting to be sent in a batch.
+    * read_queue
+      - Deque of undecoded messages unpacked from a batch but not yet
+        returned.
+    * write_codec
+      - String, codec currently used by Write, after negotiation.
+    * peer_read_size
+      - Int, largest message the other side reads in one piece, or None
+        if it hasn't said (and so may not handle framed messages).
+    * chunk_parts
+      - List of bytes of a chunked message received so far.
+    * stats
+      - Pipe_Stats recording this pipe's traffic, or None if disabled.
+    * recorder
+      - Pipe_Recorder logging this pipe's messages, or None if disabled.
     * pipe_path
       - String, path with name for the pipe.
-      - Must be: "//<server>/pipe/<pipename>"
+      - For windows, must be: "//<server>/pipe/<pipename>"
     * nowait_set
       - Bool, if True then the pipe is in non-blocking mode, and doesn't
         wait for read/write to go through.
       - Defaults to not-set (blocks).
     '''
-    def __init__(self, pipe_name, buffer_size = None):
+    # Added to the pipe_name when naming the stats, to tell apart both
+    # ends of a pipe in the same process.
+    stats_suffix = ''
+    # Which end of the pipe this is, for recordings.
+    record_side = 'server'
+    # If windows pipes are opened for overlapped io, as async pipes want.
+    overlapped_io = False
+
+    def __init__(
+            self,
+            pipe_name,
+            buffer_size = None,
+            transport = None,
+            verbose = False,
+            dual_channel = False,
+            batch_writes = False,
+            flush_delay = None,
+            codec = 'text',
+        ):
         self.pipe_name = pipe_name
-        self.pipe_path = "\\\\.\\pipe\\" + pipe_name
         # Default None to 64k buffer.
         self.buffer_size = buffer_size if buffer_size else 64*1024
         self.nowait_set = False
+        self.dual_channel = dual_channel
+        self.write_lock = threading.Lock()
+
+        self.batch_writes = batch_writes
+        self.flush_delay = flush_delay
+        self.write_queue = []
+        self.write_queue_size = len(batch_header)
+        self.flush_timer = None
+        self.read_queue = deque()
+
+        if codec not in Codec.codecs:
+            raise ValueError(f'Unknown codec {codec!r}, expected one of {Codec.codecs}')
+        self.codec = codec
+        self.write_codec = 'text'
+        self.peer_read_size = None
+        self.chunk_parts = []
+        self.stats = Get_Pipe_Stats(pipe_name + self.stats_suffix)
+        self.recorder = Get_Recorder(pipe_name, self.record_side, {
+            'buffer_size'  : self.buffer_size,
+            'dual_channel' : dual_channel,
+            })
+
+        transport_class = Get_Transport_Class(transport)
+        self.transport = transport_class(
+            pipe_name, self.buffer_size, verbose = verbose,
+            overlapped = self.overlapped_io)
+        self.out_transport = None
+        if dual_channel:
+            self.out_transport = transport_class(
+                pipe_name + '_out', self.buffer_size, verbose = verbose,
+                overlapped = self.overlapped_io)
+        self.pipe_path = self.transport.pipe_path
+
+        # Subclasses pick the directions; default to the single pipe.
+        self.read_transport  = self.transport
+        self.write_transport = self.transport
+
+        # Let the owning server find this pipe when closing; it also sets
+        # the cancel_token, and server_stats if accounting is enabled.
+        self.cancel_token = None
+        self.server_stats = None
+        # perf_counter time the last message was returned, for handler
+        # times in server_stats.
+        self.handler_start = None
+        server = Get_Current_Server()
+        if server is not None:
+            server.Add_Pipe(self)
+        return
+
+
+    def Get_Transports(self):
+        '''
+        Returns a list of all transports used by this pipe.
+        '''
+        if self.out_transport is None:
+            return [self.transport]
+        return [self.transport, self.out_transport]
+
+
+    def Interrupt(self):
+        '''
+        Stop this pipe from another thread: a Connect or Read blocked on
+        it, or made later, raises a pipe error (see Is_Interrupt_Error).
+        '''
+        for transport in self.Get_Transports():
+            transport.Interrupt()
+        return
+
+
+    def Check_Cancelled(self, ex = None):
+        '''
+        Raise Server_Cancelled if this pipe's server run was cancelled.
+        If given, ex is the pipe error being handled, chained as the cause.
+        '''
+        if self.cancel_token is not None and self.cancel_token.Is_Cancelled():
+            raise Server_Cancelled() from ex
+        return
+
+
+    def Record_Handler_End(self):
+        '''
+        If accounting, record the time spent handling the last message
+        read, as this pipe goes to read the next one.
+        '''
+        if self.handler_start is not None:
+            self.server_stats.Record_Handler(time.perf_counter() - self.handler_start)
+            self.handler_start = None
+        return
+
+
+    def Record_Handler_Start(self):
+        '''
+        If accounting, count a message returned by a read, and start
+        timing its handling.
+        '''
+        if self.server_stats is not None:
+            self.server_stats.messages += 1
+            self.handler_start = time.perf_counter()
         return
 
 
     def Read(self):
         '''
         Read a message from the open pipe.
-        This will block unless Set_Nonblocking has been called.
+        This will block unless Set_Nonblocking has been called, in which
+        case None is returned if no message is waiting.
 
         Raises Client_Garbage_Collected exception if this gets a
         "garbage_collected" message.
         '''
-        # Get byte data, up to the size of the buffer.
-        # Non-blocking reads raise ERROR_NO_DATA if the pipe is empty.
+        return self.Decode_Message(self.Read_Bytes())
+
+
+    def Read_Bytes(self):
+        '''
+        Read a message from the open pipe without decoding it, for binary
+        consumers. Blocking behavior matches Read.
+
+        Returns a memoryview of the message bytes within the transport's
+        reused read buffer, which is only valid until the next Read or
+        Read_Bytes call; use bytes() on it to keep a copy.
+        '''
+        self.Check_Cancelled()
+        self.Record_Handler_End()
+        # Send any queued replies before waiting for the next request.
+        if not self.read_queue and self.write_queue and self.flush_delay is None:
+            self.Flush()
+
+        # Get byte data, up to the size of the buffer, until something
+        # other than codec control messages arrives.
+        # Messages left over from a prior batch are returned first; these
+        # are views into the same read buffer, which isn't refilled until
+        # they have all been returned.
         # TODO: maybe find a way to interrupt blocking reads on a ctrl-c
         # keyboard interrupt. Currently, ctrl-c does nothing during readfile,
         # though ctrl-pause still works.
-        try:
-            error, data = win32file.ReadFile(self.pipe_file, self.buffer_size)
-            # Default decode (utf8) into a string to return.
-            message = data.decode()
-
-        except win32api.error as ex:
-            # These exceptions have the fields:
-            #  winerror : integer error code (eg. 109)
-            #  funcname : Name of function that errored, eg. 'ReadFile'
-            #  strerror : String description of error
-            if ex.winerror == winerror.ERROR_NO_DATA and self.nowait_set:
-                # Return None in this case.
-                message = None
+        stats = self.stats
+        wait = None
+        if not self.read_queue:
+            if stats is not None:
+                start = time.perf_counter()
+            try:
+                while not self.read_queue:
+                    data = self.read_transport.Read_View()
+                    if data is None:
+                        if stats is not None:
+                            stats.empty_polls += 1
+                        return None
+                    self.read_queue.extend(self.Unpack_Messages(data))
+            except pipe_errors as ex:
+                self.Note_Pipe_Error(ex)
+                self.Check_Cancelled(ex)
+                raise
+            if stats is not None:
+                wait = time.perf_counter() - start
+
+        data = self.read_queue.popleft()
+        if stats is not None:
+            stats.Record_Read(len(data), wait)
+        self.Record_Handler_Start()
+        return data
+
+
+    def Unpack_Messages(self, data):
+        '''
+        Split raw bytes from the transport into messages, unpacking batches
+        and handling codec control messages.
+        Returns a list of undecoded messages, which is empty if the data
+        only held control messages.
+        '''
+        # Text messages never start with a null byte, so can skip the
+        # special message checks. Empty messages (eg. Write('')) have
+        # no first byte to check, and are plain text.
+        if not data or data[0] != 0:
+            if self.recorder is not None:
+                self.recorder.Record(direction_read, data)
+            return [data]
+        # Collect chunks until the last one, then handle the whole message.
+        # (Copy the chunk out of the read buffer, which gets reused.)
+        if Is_Chunk(data):
+            self.chunk_parts.append(bytes(data[chunk_overhead:]))
+            if not Is_Last_Chunk(data):
+                return []
+            data = b''.join(self.chunk_parts)
+            self.chunk_parts = []
+            return self.Unpack_Messages(data)
+
+        if Is_Batch(data):
+            packed = Unpack_Batch(data)
+        else:
+            packed = [data]
+        messages = []
+        for message_data in packed:
+            if self.recorder is not None:
+                self.recorder.Record(direction_read, message_data)
+            if Is_Control(message_data):
+                self.Handle_Control(*Unpack_Control(message_data))
+            else:
+                messages.append(message_data)
+        return messages
+
+
+    def Handle_Control(self, name, value):
+        '''
+        Handle a control message from the other side of the pipe.
+        Unknown names are ignored.
+
+        Names:
+        * read_size
+          - Largest message the other side reads in one piece; framed
+            messages may be sent after this.
+        * codec
+          - Codec the other side can decode; writes switch to it if it
+            is the one this pipe prefers.
+        '''
+        if name == 'read_size':
+            self.peer_read_size = int(value)
+        elif name == 'codec':
+            if value == self.codec:
+                self.write_codec = value
+        return
+
+
+    def Read_Chunks(self):
+        '''
+        Generator reading one message, yielding its bytes in pieces as
+        they arrive instead of joining them, for streaming large messages.
+        Unchunked messages are yielded in one piece. Blocks until the
+        whole message is read (regardless of Set_Nonblocking).
+
+        Pieces are memoryviews into the reused read buffer, only valid
+        until the next piece is requested. They are not decoded.
+        '''
+        self.Check_Cancelled()
+        if self.read_queue:
+            yield self.read_queue.popleft()
+            return
+        if self.write_queue and self.flush_delay is None:
+            self.Flush()
+
+        started = False
+        size = 0
+        while True:
+            try:
+                data = self.read_transport.Read_View()
+                # Nothing waiting in non-blocking mode; wait for it.
+                if data is None:
+                    self.read_transport.Set_Blocking(True)
+                    try:
+                        data = self.read_transport.Read_View()
+                    finally:
+                        self.read_transport.Set_Blocking(False)
+            except pipe_errors as ex:
+                self.Note_Pipe_Error(ex)
+                self.Check_Cancelled(ex)
+                raise
+
+            if Is_Chunk(data):
+                started = True
+                size += len(data) - chunk_overhead
+                yield data[chunk_overhead:]
+                if Is_Last_Chunk(data):
+                    if self.stats is not None:
+                        self.stats.Record_Read(size)
+                    return
+                continue
+
+            # Anything else is unpacked as by Read_Bytes, handling control
+            # messages and queueing whole messages for later reads.
+            messages = self.Unpack_Messages(data)
+            # Before the first chunk, the first of these is the message
+            # read here.
+            if not started:
+                self.read_queue.extend(messages)
+                if self.read_queue:
+                    yield self.read_queue.popleft()
+                    return
+            # Otherwise they interleaved with the chunks; copy them out of
+            # the read buffer, which the next chunk overwrites.
             else:
-                # Re-raise other exceptions.
-                raise ex
+                self.read_queue.extend(bytes(message) for message in messages)
+
 
+    def Decode_Message(self, data):
+        '''
+        Convert raw message bytes read from the transport into the message
+        to return from Read. None (no message available) passes through.
+        '''
+        if data is None:
+            return None
+        if not data:
+            return ''
+        # Typed messages carry their own python values.
+        if data[0] == 0 and Codec.Is_Typed(data):
+            return Codec.Decode(data)
+        # Default decode (utf8) into a string to return.
+        # (Data may be a memoryview, which lacks a decode method.)
+        message = str(data, 'utf-8')
         if message == 'garbage_collected':
+            if self.stats is not None:
+                self.stats.Record_Disconnect()
             raise Client_Garbage_Collected()
         return message
 
-    
+
+    def Note_Pipe_Error(self, ex):
+        '''
+        Record a pipe error in the stats, if it was a disconnect.
+        '''
+        if self.stats is not None and Is_Disconnect_Error(ex):
+            self.stats.Record_Disconnect()
+        return
+
+
+    def Encode_Message(self, message):
+        '''
+        Convert a message passed to Write into bytes for the transport.
+        '''
+        if self.write_codec == 'typed':
+            return Codec.Encode(message)
+        # Data will be utf8 encoded.
+        return str(message).encode()
+
+
     def Write(self, message):
         '''
         Write a message to the open pipe.
         This generally shouldn't block (plenty of room in pipe), but will
         explicitly not-block if Set_Nonblocking has been called.
         '''
-        # Similar to above, ignore this error, rely on exceptions.
-        # Data will be utf8 encoded.
         # Don't worry about non-blocking full-pipe exceptions for now;
         #  assume there is always room.
-        error, bytes_written = win32file.WriteFile(self.pipe_file, str(message).encode())
+        self.Write_Bytes(self.Encode_Message(message))
+        return
+
+
+    def Write_Bytes(self, data):
+        '''
+        Write already encoded message bytes to the open pipe, for binary
+        producers (and replays). Blocking behavior matches Write.
+        '''
+        self.Check_Cancelled()
+        if self.recorder is not None:
+            self.recorder.Record(direction_write, data)
+        try:
+            if self.stats is None:
+                self._Write(data)
+            else:
+                start = time.perf_counter()
+                self._Write(data)
+                self.stats.Record_Write(len(data), time.perf_counter() - start)
+        except pipe_errors as ex:
+            self.Check_Cancelled(ex)
+            raise
+        return
+
+
+    def _Write(self, data):
+        '''
+        Write (or queue) encoded message data.
+        '''
+        frames = self.Split_Message(data)
+        with self.write_lock:
+            # Chunked messages skip the batch, after sending what's queued.
+            if not self.batch_writes or len(frames) > 1:
+                self._Flush()
+                for frame in frames:
+                    self.write_transport.Write(frame)
+                return
+
+            # Send out the current batch first if this won't fit.
+            entry_size = len(data) + batch_entry_overhead
+            if self.write_queue_size + entry_size > self.Get_Write_Size():
+                self._Flush()
+            self.write_queue.append(data)
+            self.write_queue_size += entry_size
+
+            # Start the flush timer on the first queued message.
+            if self.flush_delay is not None and self.flush_timer is None:
+                self.flush_timer = threading.Timer(self.flush_delay, self.Flush)
+                self.flush_timer.daemon = True
+                self.flush_timer.start()
         return
-    
+
+
+    def Get_Write_Size(self):
+        '''
+        Returns the largest message that can be sent in one piece: the
+        other side's read size if known, else this pipe's buffer_size.
+        '''
+        if self.peer_read_size is not None:
+            return self.peer_read_size
+        return self.buffer_size
+
+
+    def Split_Message(self, data):
+        '''
+        Returns a list of the pipe messages to write for the given encoded
+        message: the message itself, or its chunks if too large for the
+        other side to read in one piece.
+        '''
+        # Only chunk for readers known to support it.
+        if self.peer_read_size is None or len(data) <= self.peer_read_size:
+            return [data]
+        return Split_Chunks(data, self.peer_read_size)
+
+
+    def Write_Chunks(self, parts):
+        '''
+        Write one message made from an iterable of parts (bytes or str),
+        without joining them first. Parts are regrouped into chunks
+        sized for the reader, so any part size works.
+        Needs a reader that supports chunks (see peer_read_size).
+        '''
+        if self.peer_read_size is None:
+            raise RuntimeError('Other side of the pipe has not announced chunk support')
+        part_size = self.peer_read_size - chunk_overhead
+        if self.stats is not None:
+            start = time.perf_counter()
+        size = 0
+        with self.write_lock:
+            self._Flush()
+            # Hold back one full chunk, since the last gets a special header.
+            pending = bytearray()
+            held = None
+            for part in parts:
+                if isinstance(part, str):
+                    part = part.encode()
+                size += len(part)
+                pending += part
+                while len(pending) > part_size:
+                    if held is not None:
+                        self.write_transport.Write(held)
+                    held = chunk_header + pending[:part_size]
+                    del pending[:part_size]
+            if held is not None:
+                self.write_transport.Write(held)
+            self.write_transport.Write(last_chunk_header + pending)
+        if self.stats is not None:
+            self.stats.Record_Write(size, time.perf_counter() - start)
+        return
+
+
+    def Flush(self):
+        '''
+        Send any messages queued by batched writes.
+        '''
+        with self.write_lock:
+            self._Flush()
+        return
+
+
+    def _Flush(self):
+        '''
+        Flush without taking the write_lock; caller must hold it.
+        '''
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+        if not self.write_queue:
+            return
+        # A lone message goes out as-is, skipping the framing, as do all
+        # messages for a reader that hasn't announced framing support.
+        if len(self.write_queue) == 1 or self.peer_read_size is None:
+            frames = self.write_queue
+        else:
+            frames = [Pack_Batch(self.write_queue)]
+        self.write_queue = []
+        self.write_queue_size = len(batch_header)
+        for frame in frames:
+            self.write_transport.Write(frame)
+        return
+
 
     def Set_Nonblocking(self):
         '''
@@ -119,11 +632,8 @@ class Pipe:
         # (Use this to reduce overhead for these calls.)
         if not self.nowait_set:
             self.nowait_set = True
-            win32pipe.SetNamedPipeHandleState(
-                self.pipe_file, 
-                win32pipe.PIPE_READMODE_MESSAGE | win32pipe.PIPE_NOWAIT, 
-                None, 
-                None)
+            for transport in self.Get_Transports():
+                transport.Set_Blocking(False)
         return
 
     def Set_Blocking(self):
@@ -133,11 +643,8 @@ class Pipe:
         # Only need to change state if nowait is set.
         if  self.nowait_set:
             self.nowait_set = False
-            win32pipe.SetNamedPipeHandleState(
-                self.pipe_file, 
-                win32pipe.PIPE_READMODE_MESSAGE | win32pipe.PIPE_WAIT, 
-                None, 
-                None)
+            for transport in self.Get_Transports():
+                transport.Set_Blocking(True)
         return
 
 
@@ -147,116 +654,16 @@ class Pipe_Server(Pipe):
     The OS pipe will be opened for serving when this is created.
     Call Connect to wait for a client to connect to the pipe.
     Use Read and Write to interact with the pipe.
+    Keyword args beyond those listed are passed to Pipe.
     '''
-    def __init__(self, pipe_name, buffer_size = None, verbose = False):
-        super().__init__(pipe_name, buffer_size)
+    def __init__(self, pipe_name, buffer_size = None, verbose = False, **kwargs):
+        super().__init__(pipe_name, buffer_size, verbose = verbose, **kwargs)
         self.verbose = verbose
-        
-        
-        # Note: at least one user had access_denied errors from the x4
-        # lua code, not resolved by running x4 as admin, possibly linked
-        # to pipe permissions.
-        # Documentation on setting up security is very sparse. The only
-        # solid python example found is here:
-        # http://timgolden.me.uk/python/win32_how_do_i/add-security-to-a-file.html
-        # This edits permissions after creation, though in testing this
-        # approach requires a separate read connection to the pipe, and
-        # would prevent nMaxInstances==1 from working.
-        # As such, it would be possible for x4 to connect twice to the same
-        # pipe after the security permissions are done, which is undesirable.
-
-        # Security attributes have a SECURITY_DESCRIPTOR member to modify.
-        sec_attr = win32security.SECURITY_ATTRIBUTES()
-        sec_desc = sec_attr.SECURITY_DESCRIPTOR
-        
-        
-        # Create a new dacl ("discretionary access control list").
-        dacl = win32security.ACL ()
-        
-        # Look up windows users.
-        # Note: for the person with perm problems, "Everyone" and 
-        # "Administrators" lookups failed (1332 error), but the user lookup
-        # worked, and just setting read/write for the user was sufficient.
-        perms_set = False
-        for account_name in [win32api.GetUserName()]:
-            # One user indicated the printed account name for them was blank,
-            # followed by perms not working. Warn in that case, and leave
-            # perms at default.
-            # TODO: this didn't fix the problem; would need more input from
-            # the user to figure out exactly what is going on.
-            if not account_name.strip():
-                if self.verbose:
-                    print(f'Failed to retrieve account name with win32api.GetUserName')
-                continue
-
-            try:
-                account_id, domain, type = win32security.LookupAccountName (None, account_name)
-                # Set read/write permission (execute doesn't make sense).
-                dacl.AddAccessAllowedAce(win32security.ACL_REVISION, 
-                                            win32file.FILE_GENERIC_READ | win32file.FILE_GENERIC_WRITE, 
-                                            account_id)
-                perms_set = True
-                if self.verbose:
-                    print(f'Setting pipe read/write permission for account "{account_name}"')
-            except win32api.error as ex:
-                if self.verbose:
-                    print(f'Failed to set pipe read/write permission for account '
-                            f'"{account_name}"; error code {ex.winerror} in '
-                            f'{ex.funcname} : {ex.strerror}')
-                continue
-
-        if perms_set:
-            # Apply to the security object.
-            # Args are: (1 if dacle used, dacl, 1 if using defaults)
-            sec_desc.SetSecurityDescriptorDacl(1, dacl, 0)
-            # Leave user/group/etc. at defaults (eg. unspecified).
-        else:
-            # If all perms failed, just clear this and use defaults.
-            sec_attr = None
-
-        # Create the pipe in server mode.
-        self.pipe_file = win32pipe.CreateNamedPipe(
-            # Note: for some reason this doesn't use keyword args,
-            #  so arg names included in comments.
-            # pipeName
-            self.pipe_path, 
-            # The lua winapi opens pipes as read/write; try to match that.
-            # openMode
-            win32pipe.PIPE_ACCESS_DUPLEX,
-            # pipeMode
-            # Set writes to message, reads to message.
-            # This means reading from the pipe grabs a complete message
-            # as written, instead of a lump of bytes.
-            win32pipe.PIPE_TYPE_MESSAGE | win32pipe.PIPE_READMODE_MESSAGE | win32pipe.PIPE_WAIT,
-            # nMaxInstances
-            1, 
-            # nOutBufferSize
-            self.buffer_size, 
-            # nInBufferSize
-            # Can limit this to choke writes and see what errors they give.
-            # In testing, this needs to be large enough for any single message,
-            #  else the client write fails with no error code (eg. code 0).
-            # In testing, a closed server and a full pipe generate the same
-            #  error code, so x4 stalling on full buffers will not be supported.
-            # This buffer should be sized large enough to never fill up.
-            self.buffer_size,
-            # nDefaultTimeOut
-            300,
-
-            # sa, security access.
-            # If set to None, will use some system defaults, with rd/wr
-            # access for the owner and rd for others (maybe, unclear).
-            sec_attr,
-            )
-        
-        # -Removed; requires nMaxInstances > 1 (or does it? maybe some other problem)
-        ## Get the existing file security to be modified, dacl information.
-        #sd = win32security.GetFileSecurity (self.pipe_path, win32security.DACL_SECURITY_INFORMATION)
-        ## Apply the dacl.
-        #sd.SetSecurityDescriptorDacl (1, dacl, 0)
-        #win32security.SetFileSecurity (self.pipe_path, win32security.DACL_SECURITY_INFORMATION, sd)
-
-        print('Started serving: ' + self.pipe_path)
+        if self.dual_channel:
+            self.write_transport = self.out_transport
+        for transport in self.Get_Transports():
+            transport.Open_Server()
+            print('Started serving: ' + transport.pipe_path)
         return
 
 
@@ -264,14 +671,29 @@ class Pipe_Server(Pipe):
         '''
         Wait for a client to connect to this pipe.
         '''
-        # Wait to connect automatically.
-        # This appears to be a stall op that waits for a client to connect.
-        # Returns 0, an integer for okayish errors (io pending, or pipe already
-        #  connected), or raises an exception on other errors.
-        # If the client connected first, don't consider that an error, so
-        #  just ignore any error code but let exceptions get raised.
-        win32pipe.ConnectNamedPipe(self.pipe_file, None)
-        print('Connected to client')
+        # For dual_channel, the client opens the inbound pipe first.
+        self.Check_Cancelled()
+        try:
+            for transport in self.Get_Transports():
+                transport.Connect()
+        except pipe_errors as ex:
+            self.Check_Cancelled(ex)
+            raise
+        self.Report_Connect()
+        return
+
+
+    def Report_Connect(self):
+        '''
+        Print that a client connected, with the reconnect time if known.
+        '''
+        wait = None
+        if self.stats is not None:
+            wait = self.stats.Record_Connect()
+        if wait is None:
+            print('Connected to client')
+        else:
+            print('Connected to client (reconnected after {:.1f} ms)'.format(wait * 1000))
         return
 
 
@@ -280,23 +702,19 @@ class Pipe_Server(Pipe):
         Returns the path of the executable of the process that opened
         the client side of the pipe. Should only be called after connecting.
         '''
-        proc_handle = None
-        try:
-            proc_id = win32pipe.GetNamedPipeClientProcessId(self.pipe_file)
-            proc_handle = win32api.OpenProcess(
-                win32con.PROCESS_QUERY_INFORMATION,# | win32con.PROCESS_VM_READ,
-                False,
-                proc_id)
-            exe_path_name = win32process.GetModuleFileNameEx(proc_handle,0)
-        except Exception as ex:
-            print(f'Get_Client_Executable failed with exception: {ex}')
-            exe_path_name = ''
-        finally:
-            # Close the handle if open.
-            if proc_handle is not None:
-                win32api.CloseHandle(proc_handle)                
-        path = Path(exe_path_name)
-        return path
+        return self.transport.Get_Client_Executable()
+
+
+    def Handle_Control(self, name, value):
+        '''
+        Handle a control message, replying to a client's read_size with
+        this server's read size.
+        '''
+        super().Handle_Control(name, value)
+        if name == 'read_size':
+            with self.write_lock:
+                self.write_transport.Write(Pack_Control('read_size', self.buffer_size))
+        return
 
 
     def Close(self):
@@ -305,11 +723,11 @@ class Pipe_Server(Pipe):
         '''
         # Close the pipe.
         print('Closing ' + self.pipe_path)
-        # The routine for closing is described here:
-        # https://docs.microsoft.com/en-us/windows/win32/ipc/named-pipe-operations
-        win32file.FlushFileBuffers(self.pipe_file)
-        win32pipe.DisconnectNamedPipe(self.pipe_file)
-        win32file.CloseHandle(self.pipe_file)
+        self.Flush()
+        for transport in self.Get_Transports():
+            transport.Close()
+        if self.recorder is not None:
+            self.recorder.Close()
         return
 
 
@@ -317,52 +735,63 @@ class Pipe_Client(Pipe):
     '''
     Opens a pipe as a client.
     To be used for testing servers by building a model of the x4 side.
-    TODO: maybe share some functions with Pipe.
-    
+    Keyword args are passed to Pipe.
+
     Attributes:
-    * pipe_file
-      - Open pipe/file object.
     * pipe_path
       - String, path with name for the pipe.
-      - Must be: "//<server>/pipe/<pipename>"
     '''
-    def __init__(self, pipe_name, buffer_size = None):
-        super().__init__(pipe_name, buffer_size)
-        
-        '''
-        Note: the lua side winapi uses this for opening the pipe:
-          HANDLE hPipe = CreateFile(
-              pipename,
-              GENERIC_READ |  // read and write access
-              GENERIC_WRITE,
-              0,              // no sharing
-              NULL,           // default security attributes
-              OPEN_EXISTING,  // opens existing pipe
-              0,              // default attributes
-              NULL);          // no template file
-        '''
-        self.pipe_file = win32file.CreateFile(
-            # pipeName
-            self.pipe_path, 
-            # Access mode; both read and write.
-            win32file.GENERIC_WRITE | win32file.GENERIC_READ, 
-            # No sharing.
-            0, 
-            # Default security.
-            None, 
-            # Open existing.
-            win32file.OPEN_EXISTING, 
-            # Default attributes.
-            0, 
-            # No template.
-            None)
-
-        # The above defaults to byte mode. Switch to message.
-        win32pipe.SetNamedPipeHandleState(
-            self.pipe_file, 
-            win32pipe.PIPE_READMODE_MESSAGE, 
-            None, 
-            None)
+    stats_suffix = ' (client)'
+    record_side = 'client'
+    # Async clients can't wait for the server's reply when created.
+    is_async = False
 
+    def __init__(self, pipe_name, buffer_size = None, **kwargs):
+        super().__init__(pipe_name, buffer_size, **kwargs)
+        if self.dual_channel:
+            self.read_transport = self.out_transport
+        for transport in self.Get_Transports():
+            transport.Open_Client()
         print('Client opened: ' + self.pipe_path)
-        return
\ No newline at end of file
+
+        # Like x4, announce the read size (and so framing support) and
+        # any typed support before anything else is sent.
+        self.transport.Write(Pack_Control('read_size', self.buffer_size))
+        if self.codec != 'text':
+            self.transport.Write(Pack_Control('codec', self.codec))
+            self.write_codec = self.codec
+        # Writes may need chunking to fit the server's read size, so wait
+        # for the server's reply. Async clients wait on their first Write.
+        if not self.is_async:
+            self.Wait_For_Peer_Read_Size()
+        return
+
+
+    def Wait_For_Peer_Read_Size(self):
+        '''
+        Read until the server replies with its read size, which it sends
+        on its first Read. Messages the server sent ahead of the reply are
+        kept for later reads.
+        '''
+        try:
+            while self.peer_read_size is None:
+                data = self.read_transport.Read_View()
+                # Copy out of the read buffer, which the next read reuses.
+                self.read_queue.extend(bytes(x) for x in self.Unpack_Messages(data))
+        except pipe_errors as ex:
+            self.Note_Pipe_Error(ex)
+            self.Check_Cancelled(ex)
+            raise
+        return
+
+
+    def Close(self):
+        '''
+        Close the client end of the pipe.
+        '''
+        self.Flush()
+        for transport in self.Get_Transports():
+            transport.Close()
+        if self.recorder is not None:
+            self.recorder.Close()
+        return
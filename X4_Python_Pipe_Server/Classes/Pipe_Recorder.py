@@ -0,0 +1,304 @@
+'''
+Recording and replay of pipe traffic.
+
+When recording is enabled (eg. by the host "--record-pipes" arg) before
+a pipe is created, every message it reads or writes is logged to its own
+file, with a nanosecond timestamp. Recordings of real game sessions can
+then be replayed against a server module off-machine (see
+Benchmarks/Replay_Session.py), at the original pace, faster, or as fast
+as the server will take them.
+
+Messages are recorded as the bytes passed between pipe and server code:
+after unpacking batches and reassembling chunks on reads, and before
+batching and chunking on writes. Codec control messages read (eg. x4
+announcing typed message support) are recorded as well, so that a
+replay negotiates the same way.
+
+File layout:
+* Header: the magic bytes, then a json line of recording details.
+* Records: direction byte, timestamp (uint64 ns since the recording
+  started), payload length (uint32), payload bytes; little endian.
+'''
+import json
+import time
+import struct
+import threading
+from pathlib import Path
+
+magic = b'X4REC\x01'
+record_header = struct.Struct('<BQI')
+file_suffix = '.x4rec'
+
+# Record directions, relative to the recorded pipe.
+direction_read  = 0
+direction_write = 1
+
+# Settings from Enable_Recording; None while disabled.
+_settings = None
+
+
+def Enable_Recording(output_dir, names = None):
+    '''
+    Turn on recording for pipes created afterward.
+
+    * output_dir
+      - Folder to write recordings to; created when first needed.
+    * names
+      - Optional list of pipe names to record; all if empty.
+    '''
+    global _settings
+    _settings = {
+        'output_dir' : str(output_dir),
+        'names'      : list(names) if names else [],
+        }
+    return
+
+
+def Get_Settings():
+    '''
+    Returns a dict of the recording settings (the Enable_Recording args),
+    or None if disabled.
+    '''
+    return dict(_settings) if _settings is not None else None
+
+
+def Get_Recorder(pipe_name, side, options = None):
+    '''
+    Returns a Pipe_Recorder for a new pipe, or None if it isn't being
+    recorded. side is 'server' or 'client', and options is a dict of pipe
+    settings to note in the recording (eg. dual_channel).
+    '''
+    if _settings is None:
+        return None
+    if _settings['names'] and pipe_name not in _settings['names']:
+        return None
+    try:
+        return Pipe_Recorder(_settings['output_dir'], pipe_name, side, options)
+    except OSError as ex:
+        print(f'Failed to start recording of {pipe_name}: {ex}')
+        return None
+
+
+class Pipe_Recorder:
+    '''
+    Writes the messages of one pipe to a recording file.
+
+    Parameters:
+    * output_dir
+      - Folder to write the recording to.
+    * pipe_name
+      - String, name of the recorded pipe.
+    * side
+      - String, 'server' or 'client'.
+    * options
+      - Optional dict of pipe settings to note in the recording header.
+
+    Attributes:
+    * path
+      - Path of the recording file.
+    * file
+      - Open file, or None once closed.
+    * start_ns
+      - time.perf_counter_ns() when the recording started.
+    * lock
+      - Lock serializing writes from the pipe's threads.
+    * count
+      - Int, messages recorded.
+    '''
+    def __init__(self, output_dir, pipe_name, side, options = None):
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents = True, exist_ok = True)
+        stamp = time.strftime('%Y%m%d_%H%M%S')
+        path = output_dir / f'{pipe_name}_{side}_{stamp}{file_suffix}'
+        index = 1
+        while path.exists():
+            index += 1
+            path = output_dir / f'{pipe_name}_{side}_{stamp}_{index}{file_suffix}'
+        self.path = path
+        self.lock = threading.Lock()
+        self.count = 0
+        # Unbuffered, so the recording is complete up to the last message
+        # even if the pipe is never closed (or the host is killed).
+        self.file = open(path, 'wb', buffering = 0)
+        self.file.write(magic)
+        self.file.write(json.dumps({
+            'pipe_name'  : pipe_name,
+            'side'       : side,
+            'start_time' : time.time(),
+            'options'    : options or {},
+            }).encode() + b'\n')
+        self.start_ns = time.perf_counter_ns()
+        print(f'Recording pipe {pipe_name} to {path}')
+        return
+
+
+    def Record(self, direction, data):
+        '''
+        Record a message read (direction_read) or written (direction_write).
+        data may be bytes or a memoryview.
+        '''
+        timestamp = time.perf_counter_ns() - self.start_ns
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(b''.join([
+                record_header.pack(direction, timestamp, len(data)), data]))
+            self.count += 1
+        return
+
+
+    def Close(self):
+        '''
+        Finish the recording.
+        '''
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+        return
+
+
+def Read_Recording(path):
+    '''
+    Read a recording file.
+    Returns (details, records): the header details dict, and a list of
+    (direction, seconds since start, bytes) tuples.
+    '''
+    data = Path(path).read_bytes()
+    if not data.startswith(magic):
+        raise ValueError(f'Not a pipe recording: {path}')
+    header_end = data.index(b'\n', len(magic))
+    details = json.loads(data[len(magic) : header_end])
+
+    records = []
+    offset = header_end + 1
+    while offset + record_header.size <= len(data):
+        direction, timestamp, length = record_header.unpack_from(data, offset)
+        offset += record_header.size
+        if offset + length > len(data):
+            # Truncated by a crash; keep what's complete.
+            break
+        records.append((direction, timestamp / 1e9, data[offset : offset + length]))
+        offset += length
+    return details, records
+
+
+class Replayer:
+    '''
+    Replays the x4 side of a recording against a live server, through a
+    Pipe_Client: messages the recorded pipe read are written, at their
+    recorded times scaled by speed, while a reader thread takes the
+    server's replies.
+
+    Parameters:
+    * path
+      - Path to a recording of the server side of a pipe.
+    * speed
+      - Float, replay speed multiplier (eg. 1 for real time, 10 for ten
+        times as fast), or 0 to send as fast as possible.
+    * pipe_name
+      - Optional pipe name to connect to, overriding the recorded one.
+    * client_kwargs
+      - Optional dict of extra Pipe_Client args (eg. transport). The
+        recorded buffer_size and dual_channel are used by default.
+
+    Attributes:
+    * details
+      - Dict of recording details.
+    * records
+      - List of recorded (direction, seconds, bytes).
+    * replies
+      - Int, replies read from the server during the replay.
+    * reply_error
+      - Exception that stopped the reply reader, if any.
+    '''
+    def __init__(self, path, speed = 1.0, pipe_name = None, client_kwargs = None):
+        self.details, self.records = Read_Recording(path)
+        if self.details.get('side') != 'server':
+            raise ValueError('Replay needs a recording of the server side of a pipe')
+        self.speed = speed
+        self.pipe_name = pipe_name or self.details['pipe_name']
+        self.client_kwargs = dict(self.details.get('options', {}))
+        self.client_kwargs.update(client_kwargs or {})
+        self.replies = 0
+        self.reply_error = None
+        return
+
+
+    def Get_Expected_Replies(self):
+        '''
+        Returns the number of messages the server wrote in the recording.
+        '''
+        return sum(1 for x in self.records if x[0] == direction_write)
+
+
+    def Read_Replies(self, pipe):
+        '''
+        Thread loop, reading replies until the pipe closes.
+        '''
+        try:
+            while True:
+                pipe.Read_Bytes()
+                self.replies += 1
+        except Exception as ex:
+            self.reply_error = ex
+        return
+
+
+    def Run(self, reply_timeout = 5):
+        '''
+        Connect to the server and replay the recording, then wait up to
+        reply_timeout seconds for the server to send as many replies as
+        it did when recorded.
+        Returns a dict with the message counts and times in seconds:
+        sent, send_time, replies, expected_replies, total_time.
+        '''
+        # Imported here to avoid a circular import with Pipe.
+        from .Pipe import Pipe_Client
+
+        # Retry until the server is up.
+        deadline = time.perf_counter() + reply_timeout
+        while True:
+            try:
+                pipe = Pipe_Client(self.pipe_name, **self.client_kwargs)
+                break
+            except Exception:
+                if time.perf_counter() > deadline:
+                    raise
+                time.sleep(0.01)
+
+        reader = threading.Thread(target = self.Read_Replies, args = (pipe,),
+                                  daemon = True)
+        reader.start()
+
+        expected = self.Get_Expected_Replies()
+        sent = 0
+        start = time.perf_counter()
+        for direction, timestamp, data in self.records:
+            if direction != direction_read:
+                continue
+            if self.speed:
+                delay = start + timestamp / self.speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            # Control messages (eg. codec) go through as-is too.
+            pipe.Write_Bytes(data)
+            sent += 1
+        pipe.Flush()
+        send_time = time.perf_counter() - start
+
+        # Wait for the replies to catch up.
+        deadline = time.perf_counter() + reply_timeout
+        while (self.replies < expected and reader.is_alive()
+        and time.perf_counter() < deadline):
+            time.sleep(0.001)
+        total_time = time.perf_counter() - start
+        pipe.Close()
+
+        return {
+            'sent'             : sent,
+            'send_time'        : send_time,
+            'replies'          : self.replies,
+            'expected_replies' : expected,
+            'total_time'       : total_time,
+            }
@@ -0,0 +1,337 @@
+'''
+Per-pipe instrumentation: message and byte counters, and read/write
+latency histograms.
+
+Stats are off by default, in which case pipes hold no stats object and
+skip all of this. Once enabled (eg. by the host "--pipe-stats" arg),
+each pipe created afterward records into the Pipe_Stats for its name.
+Stats are kept by name rather than per pipe object, since servers
+create a fresh pipe after each x4 disconnect, so counts carry across
+reconnects (which are themselves counted).
+
+Counters are updated without locks; with several threads on one pipe
+they may occasionally miss an update, which is fine for monitoring.
+'''
+import math
+import time
+import threading
+
+from .Quantile_Sketch import Quantile_Sketch
+
+# Registry of stats, keyed by pipe name; None while stats are disabled.
+_pipe_stats = None
+_registry_lock = threading.Lock()
+
+
+def Enable_Stats(enable = True):
+    '''
+    Turn stats collection on or off for pipes created afterward.
+    Turning it off clears any collected stats.
+    '''
+    global _pipe_stats
+    with _registry_lock:
+        if not enable:
+            _pipe_stats = None
+        elif _pipe_stats is None:
+            _pipe_stats = {}
+    return
+
+
+def Stats_Enabled():
+    '''
+    Returns True if stats collection is enabled.
+    '''
+    return _pipe_stats is not None
+
+
+def Get_Pipe_Stats(pipe_name):
+    '''
+    Returns the Pipe_Stats for the given pipe name, creating it if needed,
+    or None if stats are disabled.
+    '''
+    # Grab a local reference, in case stats are disabled concurrently.
+    registry = _pipe_stats
+    if registry is None:
+        return None
+    with _registry_lock:
+        stats = registry.get(pipe_name)
+        if stats is None:
+            stats = registry[pipe_name] = Pipe_Stats(pipe_name)
+    return stats
+
+
+def Get_Snapshot():
+    '''
+    Returns a dict of stats snapshot dicts (see Pipe_Stats.Get_Snapshot),
+    keyed by pipe name. Empty if stats are disabled.
+    '''
+    registry = _pipe_stats
+    if registry is None:
+        return {}
+    with _registry_lock:
+        stats_list = list(registry.values())
+    return {x.pipe_name : x.Get_Snapshot() for x in stats_list}
+
+
+def Format_Stats():
+    '''
+    Returns a printable multi-line summary of all pipe stats.
+    '''
+    registry = _pipe_stats
+    if registry is None:
+        return 'Pipe stats are disabled (enable with --pipe-stats).'
+    with _registry_lock:
+        stats_list = sorted(registry.values(), key = lambda x: x.pipe_name)
+    if not stats_list:
+        return 'Pipe stats: no pipes opened yet.'
+    return '\n'.join(['Pipe stats:'] + ['  ' + x.Format() for x in stats_list])
+
+
+def Format_Size(size):
+    '''
+    Returns a short string for a byte count, eg. "12.3 kB".
+    '''
+    for unit in ['B', 'kB', 'MB']:
+        if size < 1024:
+            return f'{size:.0f} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.1f} GB'
+
+
+def Format_Duration(seconds):
+    '''
+    Returns a short string for a duration, eg. "250 us" or "1.5 s".
+    '''
+    if seconds < 1e-3:
+        return f'{seconds * 1e6:.0f} us'
+    if seconds < 1:
+        return f'{seconds * 1e3:.1f} ms'
+    return f'{seconds:.1f} s'
+
+
+class Histogram:
+    '''
+    Histogram of durations, with running totals and quantile estimates
+    from a Quantile_Sketch (within 1% of the true values).
+
+    Attributes:
+    * sketch
+      - Quantile_Sketch of the durations.
+    * count
+      - Int, total durations added.
+    * total
+      - Float, sum of durations in seconds.
+    * min
+    * max
+      - Float, shortest and longest durations in seconds.
+    '''
+    def __init__(self):
+        self.sketch = Quantile_Sketch()
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+        return
+
+
+    def Add(self, seconds):
+        '''
+        Add a duration, in seconds.
+        '''
+        self.sketch.Add(seconds)
+        self.count += 1
+        self.total += seconds
+        if seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+        return
+
+
+    def Get_Quantile(self, quantile):
+        '''
+        Returns an estimate, in seconds, of the given quantile (0 to 1)
+        of the added durations, clamped to the min and max seen.
+        Returns 0 if empty.
+        '''
+        if not self.count:
+            return 0.0
+        return min(max(self.sketch.Get_Quantile(quantile), self.min), self.max)
+
+
+    def Get_Snapshot(self):
+        '''
+        Returns a dict summarizing the histogram, with times in seconds:
+        count, total, mean, min, max, p50, p95 and p99.
+        '''
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean' : self.total / self.count if self.count else 0.0,
+            'min'  : self.min if self.count else 0.0,
+            'max'  : self.max,
+            'p50'  : self.Get_Quantile(0.5),
+            'p95'  : self.Get_Quantile(0.95),
+            'p99'  : self.Get_Quantile(0.99),
+            }
+
+
+    def Format(self):
+        '''
+        Returns a short summary string of the quantiles.
+        '''
+        if not self.count:
+            return 'none'
+        return 'p50 {} p99 {} max {}'.format(
+            Format_Duration(self.Get_Quantile(0.5)),
+            Format_Duration(self.Get_Quantile(0.99)),
+            Format_Duration(self.max))
+
+
+class Pipe_Stats:
+    '''
+    Counters and latency histograms for one named pipe.
+
+    Attributes:
+    * pipe_name
+      - String, name of the pipe.
+    * messages_read
+    * messages_written
+      - Ints, messages returned by Read or passed to Write (so a batch
+        counts once per message inside it).
+    * bytes_read
+    * bytes_written
+      - Ints, encoded message bytes, excluding framing.
+    * max_read_size
+    * max_write_size
+      - Ints, largest message seen in each direction.
+    * read_wait
+      - Histogram of time blocked in Read waiting for each message that
+        needed a transport read.
+    * write_time
+      - Histogram of time spent sending each message in Write, after
+        encoding (just queueing it, for batched writes).
+    * empty_polls
+      - Int, non-blocking reads that found no message.
+    * connects
+      - Int, times a client connected; any past the first are reconnects.
+    * reconnect_wait
+      - Histogram of time from a pipe seeing its client disconnect (or
+        be garbage collected) to a client connecting again, including the
+        server restarting.
+    * last_disconnect
+      - Float perf_counter time of the last seen disconnect, or None if
+        connected since.
+    '''
+    def __init__(self, pipe_name):
+        self.pipe_name = pipe_name
+        self.messages_read = 0
+        self.messages_written = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.max_read_size = 0
+        self.max_write_size = 0
+        self.read_wait = Histogram()
+        self.write_time = Histogram()
+        self.empty_polls = 0
+        self.connects = 0
+        self.reconnect_wait = Histogram()
+        self.last_disconnect = None
+        return
+
+
+    def Record_Disconnect(self):
+        '''
+        Record that the client was seen to disconnect.
+        '''
+        self.last_disconnect = time.perf_counter()
+        return
+
+
+    def Record_Connect(self):
+        '''
+        Record a client connecting, and the time since the last disconnect.
+        Returns that time in seconds, or None if this isn't a reconnect.
+        '''
+        self.connects += 1
+        if self.last_disconnect is None:
+            return None
+        wait = time.perf_counter() - self.last_disconnect
+        self.last_disconnect = None
+        self.reconnect_wait.Add(wait)
+        return wait
+
+
+    def Record_Read(self, size, wait = None):
+        '''
+        Record a message of the given size returned by Read, and the time
+        spent waiting for it, if it needed a transport read.
+        '''
+        self.messages_read += 1
+        self.bytes_read += size
+        if size > self.max_read_size:
+            self.max_read_size = size
+        if wait is not None:
+            self.read_wait.Add(wait)
+        return
+
+
+    def Record_Write(self, size, elapsed):
+        '''
+        Record a written message of the given size, and the time taken.
+        '''
+        self.messages_written += 1
+        self.bytes_written += size
+        if size > self.max_write_size:
+            self.max_write_size = size
+        self.write_time.Add(elapsed)
+        return
+
+
+    def Get_Reconnects(self):
+        '''
+        Returns the number of client connections after the first.
+        '''
+        return max(0, self.connects - 1)
+
+
+    def Get_Snapshot(self):
+        '''
+        Returns a dict of the current counters and histogram summaries.
+        '''
+        return {
+            'messages_read'   : self.messages_read,
+            'messages_written': self.messages_written,
+            'bytes_read'      : self.bytes_read,
+            'bytes_written'   : self.bytes_written,
+            'max_read_size'   : self.max_read_size,
+            'max_write_size'  : self.max_write_size,
+            'read_wait'       : self.read_wait.Get_Snapshot(),
+            'write_time'      : self.write_time.Get_Snapshot(),
+            'empty_polls'     : self.empty_polls,
+            'reconnects'      : self.Get_Reconnects(),
+            'reconnect_wait'  : self.reconnect_wait.Get_Snapshot(),
+            }
+
+
+    def Format(self):
+        '''
+        Returns a one line summary.
+        '''
+        return ('{}: read {} msg {} (max {}), wait {} ({}); '
+                'write {} msg {} (max {}), {}; '
+                'empty polls {}, reconnects {} ({})').format(
+            self.pipe_name,
+            self.messages_read,
+            Format_Size(self.bytes_read),
+            Format_Size(self.max_read_size),
+            Format_Duration(self.read_wait.total),
+            self.read_wait.Format(),
+            self.messages_written,
+            Format_Size(self.bytes_written),
+            Format_Size(self.max_write_size),
+            self.write_time.Format(),
+            self.empty_polls,
+            self.Get_Reconnects(),
+            self.reconnect_wait.Format(),
+            )
@@ -0,0 +1,76 @@
+'''
+Streaming quantile estimates, shared by the pipe stats histograms and
+by server modules that keep their own timing statistics (eg. Time_API).
+'''
+import math
+
+
+class Quantile_Sketch:
+    '''
+    Streaming quantile estimates of positive values, with bounded
+    relative error (a DDSketch). Values are counted in buckets spaced
+    logarithmically by a factor of gamma, so any quantile is returned
+    within the given accuracy (eg. 1%) of a true value, while memory
+    only grows with the log of the range of values seen (at 1%, about
+    115 buckets per factor of 10).
+
+    Parameters:
+    * accuracy
+      - Float, relative accuracy of the quantiles.
+
+    Attributes:
+    * gamma
+      - Float, ratio between bucket bounds.
+    * log_gamma
+      - Float, natural log of gamma.
+    * buckets
+      - Dict of counts, keyed by bucket index; bucket i counts values
+        in (gamma**(i-1), gamma**i].
+    * zero_count
+      - Int, count of values too small to bucket (under min_value).
+    * count
+      - Int, total values added.
+    '''
+    # Values under this (1 ns) are counted as 0.
+    min_value = 1e-9
+
+    def __init__(self, accuracy = 0.01):
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+        return
+
+
+    def Add(self, value):
+        '''
+        Add a value.
+        '''
+        self.count += 1
+        if value < self.min_value:
+            self.zero_count += 1
+            return
+        index = math.ceil(math.log(value) / self.log_gamma)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        return
+
+
+    def Get_Quantile(self, quantile):
+        '''
+        Returns an estimate of the given quantile (0 to 1) of the added
+        values, or 0 if empty.
+        '''
+        if not self.count:
+            return 0.0
+        # Rank of the wanted value among the sorted values.
+        rank = quantile * (self.count - 1)
+        running = self.zero_count
+        if running > rank:
+            return 0.0
+        for index in sorted(self.buckets):
+            running += self.buckets[index]
+            if running > rank:
+                # Midpoint of the bucket, in relative terms.
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 0.0
@@ -0,0 +1,348 @@
+'''
+Shared memory ring buffer, a side channel for high volume telemetry.
+
+Sending every sample (profiler timestamps, fps samples, etc.) as its own
+pipe message costs a pipe write in lua and a pipe read plus decode in
+python per sample. Instead, the producer (x4 lua, through ffi) can copy
+records into a shared memory ring, and the pipe only carries setup and
+an occasional doorbell message saying there are records waiting, which
+python then drains as a batch.
+
+Single producer, single consumer: the producer only writes the
+write_offset, the consumer only writes the read_offset, so no locks are
+needed. The producer writes a record fully before publishing the new
+write_offset, and the consumer copies records out before publishing the
+new read_offset. This relies on stores being seen in program order by
+the other process, which holds on x86/x64 (where x4 runs), as long as
+each offset is stored with a single aligned 4-byte write (python packing
+with struct writes byte by byte, letting the reader see a torn offset,
+so uint32 memoryviews are used instead).
+
+Layout, all fields little-endian, offsets in bytes:
+    0   : 4-byte magic, b'X4RB'.
+    4   : uint32 version, currently 1.
+    8   : uint32 capacity of the data area, a multiple of 8.
+    12  : uint32 dropped count; the producer increments this for each
+          record it discards because the ring was full.
+    64  : uint32 write_offset into the data area (producer owned).
+    128 : uint32 read_offset into the data area (consumer owned).
+    192 : Data area, capacity bytes.
+The offsets sit on their own 64-byte cache lines, so the two sides
+don't contend for one line.
+
+Each record in the data area is:
+    uint32 length, then length payload bytes, padded with unused bytes
+    so the next record starts 8-byte aligned.
+Records never wrap: if a record doesn't fit between write_offset and the
+end of the data area, the producer writes a length of 0xFFFFFFFF there
+(the wrap marker) and writes the record at offset 0 instead.
+The ring is empty when write_offset == read_offset, so the producer
+always leaves at least 8 bytes free to avoid filling it completely.
+
+Producer steps, per record of n bytes (as ring_buffer.lua does):
+    size = (4 + n + 7) rounded down to a multiple of 8
+    w = write_offset, r = read_offset
+    if w >= r:
+        if size fits before the end (keeping 8 free when r == 0): use w
+        elif size + 8 <= r: write wrap marker at w, use 0
+        else: full
+    elif w + size + 8 <= r: use w
+    else: full
+    If full, increment dropped and discard the record.
+    Write length and payload at the used offset, then set
+    write_offset = (used + size) mod capacity.
+
+Setup goes over the pipe: the python server creates the ring and
+sends its name and total size to lua, which opens the same mapping.
+On windows this is a named file mapping (no backing file); elsewhere
+it is a file (under /dev/shm when available), or an anonymous mapping
+shared with forked processes when no name is given.
+'''
+import os
+import sys
+import mmap
+import time
+import struct
+import tempfile
+from pathlib import Path
+
+magic = b'X4RB'
+version = 1
+# Size of the header ahead of the data area.
+header_size = 192
+write_offset_position = 64
+read_offset_position  = 128
+dropped_position      = 12
+# Length value marking the producer wrapped to the start of the data area.
+wrap_marker = 0xFFFFFFFF
+# Length field size, and record alignment.
+length_size = 4
+alignment = 8
+
+_header_struct = struct.Struct('<4sIII')
+
+# Fields are accessed through native uint32 views, matching the
+# little-endian layout on the supported platforms.
+if sys.byteorder != 'little':
+    raise ImportError('Ring_Buffer requires a little-endian platform')
+
+
+def _Record_Size(length):
+    '''
+    Returns the space taken in the data area by a record of the given
+    payload length.
+    '''
+    return (length_size + length + alignment - 1) & ~(alignment - 1)
+
+
+def Get_Ring_Path(name):
+    '''
+    Returns the file path backing a named ring when not on windows,
+    under /dev/shm if present (memory backed), else the temp dir.
+    '''
+    folder = Path('/dev/shm')
+    if not folder.is_dir():
+        folder = Path(tempfile.gettempdir())
+    return folder / f'x4_ring_{name}'
+
+
+class Ring_Buffer:
+    '''
+    Shared memory single-producer/single-consumer ring buffer.
+    Python normally consumes (Read_Records, Iter_Batches); Write is
+    provided for python producers and testing.
+
+    Parameters:
+    * name
+      - String, name of the shared mapping, sent to the other side during
+        setup. On windows this is the file mapping tag name; elsewhere
+        it names a file from Get_Ring_Path.
+      - If None (not on windows), uses an anonymous mapping, shared only
+        with child processes forked after creation.
+    * capacity
+      - Int, bytes in the data area, rounded up to a multiple of 8.
+        Only used when creating.
+    * create
+      - Bool, if True (default) a new ring is created and initialized,
+        else an existing one is opened.
+    * path
+      - Optional file path to use instead of Get_Ring_Path (not windows).
+
+    Attributes:
+    * total_size
+      - Int, size of the whole mapping (header plus data area).
+    * capacity
+      - Int, size of the data area.
+    * mmap
+      - The mmap object.
+    '''
+    def __init__(self, name = None, capacity = 1024 * 1024, create = True, path = None):
+        self.name = name
+        self.create = create
+        self.path = None
+
+        if create:
+            capacity = _Record_Size(capacity - length_size)
+            # Need space for at least one small record plus the free gap.
+            if capacity < 2 * alignment:
+                raise ValueError(f'Ring_Buffer capacity too small: {capacity}')
+            self.total_size = header_size + capacity
+
+        if sys.platform == 'win32':
+            if name is None:
+                raise ValueError('Ring_Buffer requires a name on windows')
+            if not create:
+                # Read just the header to find the full size, then remap.
+                header = mmap.mmap(-1, header_size, tagname = name)
+                self.total_size = header_size + self._Read_Header(header)
+                header.close()
+            self.mmap = mmap.mmap(-1, self.total_size, tagname = name)
+
+        elif name is None and path is None:
+            if not create:
+                raise ValueError('Ring_Buffer requires a name or path to open')
+            self.mmap = mmap.mmap(-1, self.total_size)
+
+        else:
+            self.path = Path(path) if path else Get_Ring_Path(name)
+            if create:
+                with open(self.path, 'w+b') as file:
+                    file.truncate(self.total_size)
+                    self.mmap = mmap.mmap(file.fileno(), self.total_size)
+            else:
+                with open(self.path, 'r+b') as file:
+                    self.mmap = mmap.mmap(file.fileno(), 0)
+                self.total_size = header_size + self._Read_Header(self.mmap)
+
+        if create:
+            # Fresh mappings are zeroed, so offsets and dropped start at 0;
+            # write the magic last, once the rest is in place.
+            self.mmap[:header_size] = bytes(header_size)
+            _header_struct.pack_into(self.mmap, 0, b'\x00' * 4, version, self.total_size - header_size, 0)
+            self.mmap[0:4] = magic
+        self.capacity = self.total_size - header_size
+        # Header as uint32 fields, for single store offset updates.
+        self.header = memoryview(self.mmap)[:header_size].cast('I')
+        # Data area view, for slicing out records, and as uint32s for
+        # record lengths (which are 4-byte aligned).
+        self.data = memoryview(self.mmap)[header_size:]
+        self.data_words = self.data.cast('I')
+        return
+
+
+    @staticmethod
+    def _Read_Header(buffer):
+        '''
+        Check the header of an existing ring, returning its capacity.
+        Raises ValueError if it isn't a ring buffer.
+        '''
+        ring_magic, ring_version, capacity, _ = _header_struct.unpack_from(buffer, 0)
+        if ring_magic != magic:
+            raise ValueError('Shared memory is not an initialized ring buffer')
+        if ring_version != version:
+            raise ValueError(f'Unsupported ring buffer version {ring_version}')
+        return capacity
+
+
+    def Get_Dropped(self):
+        '''
+        Returns the count of records the producer dropped because the
+        ring was full.
+        '''
+        return self.header[dropped_position // 4]
+
+
+    def Get_Used(self):
+        '''
+        Returns the bytes of the data area currently holding unread records.
+        '''
+        header = self.header
+        return (header[write_offset_position // 4]
+                - header[read_offset_position // 4]) % self.capacity
+
+
+    def Write(self, record):
+        '''
+        Write one record (bytes or str). Returns True if written, False if
+        the ring was full (in which case the dropped count is incremented).
+        Raises ValueError if the record could never fit.
+        '''
+        if isinstance(record, str):
+            record = record.encode()
+        length = len(record)
+        size = _Record_Size(length)
+        capacity = self.capacity
+        if size + alignment > capacity:
+            raise ValueError(f'Record of {length} bytes is too large for the ring')
+
+        header = self.header
+        write_offset = header[write_offset_position // 4]
+        read_offset  = header[read_offset_position // 4]
+
+        if write_offset >= read_offset:
+            end_space = capacity - write_offset
+            if read_offset == 0:
+                # Cannot end exactly at capacity, since that wraps to 0.
+                end_space -= alignment
+            if size <= end_space:
+                position = write_offset
+            elif size + alignment <= read_offset:
+                self.data_words[write_offset // 4] = wrap_marker
+                position = 0
+            else:
+                position = None
+        elif write_offset + size + alignment <= read_offset:
+            position = write_offset
+        else:
+            position = None
+
+        if position is None:
+            header[dropped_position // 4] = (header[dropped_position // 4] + 1) & 0xFFFFFFFF
+            return False
+
+        self.data_words[position // 4] = length
+        start = position + length_size
+        self.data[start : start + length] = record
+        # Publish only after the record is in place.
+        header[write_offset_position // 4] = (position + size) % capacity
+        return True
+
+
+    def Read_Records(self, max_records = None):
+        '''
+        Returns a list of the records (bytes) currently in the ring, oldest
+        first, up to max_records if given, and frees their space.
+        Returns an empty list if there are none.
+        '''
+        records = []
+        data = self.data
+        data_words = self.data_words
+        capacity = self.capacity
+        header = self.header
+        # Snapshot the write_offset; anything written after this is left
+        # for the next call.
+        write_offset = header[write_offset_position // 4]
+        read_offset  = header[read_offset_position // 4]
+
+        while read_offset != write_offset:
+            if max_records is not None and len(records) >= max_records:
+                break
+            length = data_words[read_offset // 4]
+            if length == wrap_marker:
+                read_offset = 0
+                continue
+            start = read_offset + length_size
+            if start + length > capacity:
+                raise ValueError(f'Corrupt ring buffer record length {length} at {read_offset}')
+            records.append(bytes(data[start : start + length]))
+            read_offset = (read_offset + _Record_Size(length)) % capacity
+
+        # Release the space only after copying the records out.
+        header[read_offset_position // 4] = read_offset
+        return records
+
+
+    def Iter_Batches(self, wait = None, poll_interval = 0.01):
+        '''
+        Generator yielding lists of records as they arrive.
+
+        * wait
+          - Optional function that blocks until records may be available,
+            eg. a Pipe.Read waiting on the producer's doorbell message.
+            Its return value is ignored. When it raises (eg. a pipe
+            disconnect), any remaining records are yielded and the
+            exception is passed on.
+          - If None, the ring is polled every poll_interval seconds.
+        '''
+        while True:
+            records = self.Read_Records()
+            if records:
+                yield records
+                # Check again before waiting, in case more arrived.
+                continue
+            try:
+                if wait is None:
+                    time.sleep(poll_interval)
+                else:
+                    wait()
+            except Exception:
+                records = self.Read_Records()
+                if records:
+                    yield records
+                raise
+
+
+    def Close(self):
+        '''
+        Unmap the ring. If this side created a file backed ring, the file
+        is also removed (an open mapping in the other process stays valid).
+        '''
+        for view in (self.header, self.data_words, self.data):
+            view.release()
+        self.mmap.close()
+        if self.create and self.path is not None:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+        return
@@ -0,0 +1,183 @@
+import os
+import sys
+import time
+import threading
+from pathlib import Path
+
+from .Server_Thread import Server_Thread
+from . import Module_Cache
+from . import Server_Profiler
+from . import Pipe_Recorder
+
+class Server_Process:
+    '''
+    Runs a server module's entry function in a child process, so that
+    cpu heavy servers don't hold the GIL against the others (eg. keeping
+    Send_Keys responsive while the Script_Profiler parses and sorts).
+
+    The child imports the module from its path and runs the entry
+    function with the same restart behavior as Server_Thread (restarting
+    on a pipe disconnect, finishing on a normal return or other
+    exception). The child opens its own pipes, so nothing else crosses
+    the process boundary. The child exits if the host process does.
+
+    Child processes are always started fresh (spawn), as on windows, so
+    module level state of the host is not inherited.
+
+    Modules opt in by setting a module attribute:
+        run_in_process = True
+
+    Attributes:
+    * module_path
+      - Path to the server module.
+    * function_name
+      - String, name of the entry function in the module.
+    * test
+      - Bool, if True then in test mode.
+    * process
+      - multiprocessing.Process running the server.
+    * thread
+      - Thread waiting on the process, reporting how it exited.
+    * exitcode
+      - Int exit code of the process once finished, else None; nonzero
+        if the server stopped on an exception.
+    * cache_dir
+      - The host's module cache folder when started, passed to the child
+        for its import.
+    * profile_settings
+    * record_settings
+      - The host's profiling and pipe recording settings, passed to
+        the child.
+    * closing
+      - Bool, True once Close has been called.
+    * start_time
+      - time.monotonic() when the process was started.
+    '''
+    def __init__(self, module_path, test = False, function_name = 'main'):
+        self.module_path = Path(module_path)
+        self.function_name = function_name
+        self.test = test
+        self.process = None
+        self.thread = None
+        self.exitcode = None
+        self.closing = False
+        self.start_time = None
+        self.cache_dir = Module_Cache.cache_dir
+        self.profile_settings = Server_Profiler.Get_Settings()
+        self.record_settings = Pipe_Recorder.Get_Settings()
+        self.Start()
+        return
+
+
+    def Start(self):
+        '''
+        Start running the server in a new process.
+        '''
+        # multiprocessing is only imported once a server process is used,
+        # as most hosts never start one.
+        import multiprocessing
+        # Spawn on all systems, so behavior matches windows.
+        context = multiprocessing.get_context('spawn')
+        self.process = context.Process(
+            target = Run_Child,
+            args = (str(self.module_path), self.function_name, self.test,
+                    str(self.cache_dir) if self.cache_dir else None,
+                    self.profile_settings, self.record_settings),
+            name = f'x4_server_{self.module_path.stem}')
+        self.process.start()
+        self.start_time = time.monotonic()
+        # Watch for the process ending, from a daemon thread so this
+        # doesn't hold up host shutdown.
+        self.thread = threading.Thread(target = self.Watch, daemon = True,
+                                       name = f'x4_host_watch_{self.module_path.stem}')
+        self.thread.start()
+        return
+
+
+    def Watch(self):
+        '''
+        Wait for the process to finish, and report abnormal exits.
+        '''
+        self.process.join()
+        self.exitcode = self.process.exitcode
+        if self.exitcode:
+            print(f'Server process {self.module_path.name} exited with code {self.exitcode}')
+        return
+
+
+    def Close(self):
+        '''
+        Stop the server process. Its pipes close with it.
+        '''
+        self.closing = True
+        if self.process is not None and self.process.is_alive():
+            self.process.terminate()
+        return
+
+
+    def Get_Health(self):
+        '''
+        Returns a dict of the server health, in the form of
+        Supervisor.Get_Health. Restarts happen within the child, so
+        only the process state is known here.
+        '''
+        alive = self.process.is_alive()
+        if alive:
+            state = 'running'
+        elif self.process.exitcode and not self.closing:
+            state = 'failed'
+        else:
+            state = 'stopped'
+        return {
+            'state'      : state,
+            'restarts'   : None,
+            'crashes'    : None,
+            'uptime'     : time.monotonic() - self.start_time if alive else None,
+            'last_error' : (f'Process exited with code {self.process.exitcode}'
+                            if state == 'failed' else None),
+            }
+
+
+    def Join(self, timeout = None):
+        '''
+        Block until the server process finishes, or until timeout seconds
+        if given. Returns True if it finished.
+        '''
+        self.process.join(timeout)
+        return not self.process.is_alive()
+
+
+def Run_Child(module_path, function_name, test, cache_dir = None,
+              profile_settings = None, record_settings = None):
+    '''
+    Entry point of a server child process.
+    '''
+    # Exit with the host; a parent killed outright leaves no other signal.
+    threading.Thread(target = Exit_With_Parent, daemon = True).start()
+    if profile_settings:
+        Server_Profiler.Enable_Profiling(**profile_settings)
+    if record_settings:
+        Pipe_Recorder.Enable_Recording(**record_settings)
+
+    module = Module_Cache.Load_Module(module_path, cache_dir)
+    entry_function = getattr(module, function_name)
+    server = Server_Thread(entry_function, test = test)
+    server.Join()
+    # Nonzero exit code if the server failed (already printed by the
+    # thread).
+    sys.exit(1 if server.supervisor.state == 'failed' else 0)
+
+
+def Exit_With_Parent():
+    '''
+    Wait for the parent process to end, then exit this one.
+    '''
+    import multiprocessing
+    import multiprocessing.connection
+    parent = multiprocessing.parent_process()
+    if parent is None:
+        return
+    multiprocessing.connection.wait([parent.sentinel])
+    print(f'Host process ended; stopping {multiprocessing.current_process().name}')
+    # Skip cleanup, since server threads may be blocked in pipe reads.
+    os._exit(0)
@@ -0,0 +1,276 @@
+'''
+Profiling of extension servers, without editing their source.
+
+When enabled (eg. by the host "--profile-servers" arg), each selected
+server gets a profiler covering each run of its entry function, dumped
+to the output folder whenever the run ends (on a restart, reload or
+host exit). Two kinds are available:
+* 'cprofile': deterministic cProfile of the server thread, dumped as a
+  .pstats file (load with pstats, snakeviz, etc.). Adds overhead to
+  every python call in the server.
+* 'sample': a host thread samples the server thread's stack every few
+  milliseconds, dumped as a .collapsed file of "frame;frame;... count"
+  lines (load with flamegraph.pl, speedscope, etc.). Overhead is low
+  and independent of the server's call rate, so it suits normal play.
+  Samples are of wall-clock time, so time blocked waiting on pipes shows
+  up too (under the pipe Read or Connect).
+
+Coroutine servers on the async host share the loop thread, so they can
+only be sampled, and samples include whatever else the loop is running.
+'''
+import os
+import sys
+import time
+import threading
+from pathlib import Path
+from collections import Counter
+
+# Settings from Enable_Profiling; None while disabled.
+_settings = None
+
+profile_modes = ['sample', 'cprofile']
+
+
+def Enable_Profiling(output_dir, names = None, mode = 'sample', interval = 0.005):
+    '''
+    Turn on profiling for servers created afterward.
+
+    * output_dir
+      - Folder to write profiles to; created when first needed.
+    * names
+      - Optional list of server names to profile, as module file names
+        with or without extension (eg. "Send_Keys"); all if empty.
+    * mode
+      - String, 'sample' or 'cprofile'.
+    * interval
+      - Float, seconds between stack samples.
+    '''
+    global _settings
+    if mode not in profile_modes:
+        raise ValueError(f'Unknown profile mode: {mode}')
+    _settings = {
+        'output_dir' : str(output_dir),
+        'names'      : list(names) if names else [],
+        'mode'       : mode,
+        'interval'   : interval,
+        }
+    return
+
+
+def Get_Settings():
+    '''
+    Returns a dict of the profiling settings (the Enable_Profiling args),
+    or None if disabled.
+    '''
+    return dict(_settings) if _settings is not None else None
+
+
+def Get_Profiler(name, shared_thread = False):
+    '''
+    Returns a profiler for the named server, or None if it isn't being
+    profiled. shared_thread servers always get a sampler.
+    '''
+    if _settings is None:
+        return None
+    if _settings['names']:
+        wanted = [x.lower() for x in _settings['names']]
+        if name.lower() not in wanted and name.split('.')[0].lower() not in wanted:
+            return None
+    if _settings['mode'] == 'cprofile' and not shared_thread:
+        return CProfile_Profiler(name, _settings['output_dir'])
+    return Stack_Sampler(name, _settings['output_dir'], _settings['interval'])
+
+
+class Server_Profiler:
+    '''
+    Base class for profiling the runs of one server.
+    Start and Stop are called from the server's thread, around each run.
+
+    Attributes:
+    * name
+      - String, server name, used in file names.
+    * output_dir
+      - Path to write profiles to.
+    * run_count
+      - Int, number of runs profiled.
+    '''
+    suffix = ''
+
+    def __init__(self, name, output_dir):
+        self.name = name
+        self.output_dir = Path(output_dir)
+        self.run_count = 0
+        return
+
+
+    def Get_Output_Path(self):
+        '''
+        Returns a path for dumping the current run.
+        '''
+        stamp = time.strftime('%Y%m%d_%H%M%S')
+        base_name = f'{self.name}_{stamp}_{os.getpid()}_run{self.run_count}'
+        # Don't overwrite a same named dump (eg. from a reloaded server).
+        path = self.output_dir / (base_name + self.suffix)
+        index = 1
+        while path.exists():
+            index += 1
+            path = self.output_dir / f'{base_name}_{index}{self.suffix}'
+        return path
+
+
+    def Start(self):
+        '''
+        Start profiling a run, from the server thread.
+        '''
+        self.run_count += 1
+        return
+
+
+    def Stop(self):
+        '''
+        Stop profiling the run and dump the results, from the server
+        thread. Failures are printed, not raised.
+        '''
+        try:
+            self.output_dir.mkdir(parents = True, exist_ok = True)
+            path = self.Dump(self.Get_Output_Path())
+            if path is not None:
+                print(f'Wrote profile of {self.name} to {path}')
+        except Exception as ex:
+            print(f'Failed to write profile of {self.name}: {type(ex).__name__}: {ex}')
+        return
+
+
+    def Dump(self, path):
+        '''
+        Write out results to path, returning it, or None if nothing to write.
+        '''
+        raise NotImplementedError()
+
+
+class CProfile_Profiler(Server_Profiler):
+    '''
+    Deterministic profiler, using cProfile on the server thread.
+
+    Attributes:
+    * profile
+      - cProfile.Profile of the current run.
+    '''
+    suffix = '.pstats'
+
+    def __init__(self, name, output_dir):
+        super().__init__(name, output_dir)
+        self.profile = None
+        return
+
+
+    def Start(self):
+        super().Start()
+        # Imported on first use, since most hosts don't profile.
+        import cProfile
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        return
+
+
+    def Stop(self):
+        if self.profile is None:
+            return
+        self.profile.disable()
+        super().Stop()
+        self.profile = None
+        return
+
+
+    def Dump(self, path):
+        self.profile.dump_stats(path)
+        return path
+
+
+class Stack_Sampler(Server_Profiler):
+    '''
+    Statistical profiler, sampling the server thread's stack from a
+    separate thread.
+
+    Attributes:
+    * interval
+      - Float, seconds between samples.
+    * counts
+      - Counter of sample counts, keyed by collapsed stack string.
+    * samples
+      - Int, samples taken this run (including idle ones).
+    * thread
+      - Sampling thread, while running.
+    * stop_event
+      - threading.Event to stop the sampling thread.
+    '''
+    suffix = '.collapsed'
+
+    def __init__(self, name, output_dir, interval = 0.005):
+        super().__init__(name, output_dir)
+        self.interval = interval
+        self.counts = Counter()
+        self.samples = 0
+        self.thread = None
+        self.stop_event = None
+        return
+
+
+    def Start(self):
+        super().Start()
+        self.counts = Counter()
+        self.samples = 0
+        self.stop_event = threading.Event()
+        # Named as a host thread, so it isn't reported as leaked.
+        self.thread = threading.Thread(
+            target = self.Sample_Loop,
+            args = (threading.get_ident(), self.stop_event),
+            name = f'x4_host_sampler_{self.name}',
+            daemon = True)
+        self.thread.start()
+        return
+
+
+    def Stop(self):
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        super().Stop()
+        return
+
+
+    def Sample_Loop(self, ident, stop_event):
+        '''
+        Thread loop, sampling the given thread until stopped.
+        '''
+        # Code objects repeat, so cache their labels.
+        labels = {}
+        while not stop_event.wait(self.interval):
+            frame = sys._current_frames().get(ident)
+            if frame is None:
+                break
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                label = labels.get(code)
+                if label is None:
+                    label = labels[code] = '{} ({}:{})'.format(
+                        code.co_name, Path(code.co_filename).name, code.co_firstlineno)
+                names.append(label)
+                frame = frame.f_back
+            # Root first, as collapsed stack tools expect.
+            names.reverse()
+            self.counts[';'.join(names)] += 1
+            self.samples += 1
+        return
+
+
+    def Dump(self, path):
+        if not self.counts:
+            return None
+        with open(path, 'w') as file:
+            for stack, count in self.counts.most_common():
+                file.write(f'{stack} {count}\n')
+        return path
@@ -0,0 +1,210 @@
+'''
+Per-server accounting: thread cpu time, messages handled, and handler
+times, to find which extension server is eating cpu.
+
+Like pipe stats, this is off by default; once enabled (eg. by the host
+"--server-stats" arg), each server started afterward gets a Server_Stats,
+which its pipes record into:
+* A message is counted each time a pipe Read returns one.
+* Handler time is the time from a Read returning a message to the next
+  Read on that pipe, ie. the time the server spent acting on it
+  (including its replies).
+
+Cpu time is read from the server's thread by the host: with per-thread
+clocks where the OS has them (linux), else through psutil if installed
+(windows), else it is not available. Coroutine servers on the async host
+share the loop thread, so their cpu time is that of the whole loop.
+
+Counters are updated without locks, as with pipe stats.
+'''
+import time
+
+try:
+    import psutil
+    psutil_found = True
+except ImportError:
+    psutil_found = False
+
+from .Pipe_Stats import Format_Duration
+
+# Set by Enable_Server_Stats.
+_enabled = False
+
+
+def Enable_Server_Stats(enable = True):
+    '''
+    Turn accounting on or off for servers started afterward.
+    '''
+    global _enabled
+    _enabled = enable
+    return
+
+
+def Server_Stats_Enabled():
+    '''
+    Returns True if server accounting is enabled.
+    '''
+    return _enabled
+
+
+def Get_Thread_CPU_Time(thread):
+    '''
+    Returns the cpu time in seconds used so far by the given thread, or
+    None if it can't be measured here (or the thread ended).
+    '''
+    if thread is None or not thread.is_alive():
+        return None
+    # Per-thread clocks (unix).
+    if hasattr(time, 'pthread_getcpuclockid'):
+        try:
+            return time.clock_gettime(time.pthread_getcpuclockid(thread.ident))
+        except (OSError, OverflowError):
+            pass
+    # Thread times through psutil, by native thread id (windows).
+    if psutil_found:
+        try:
+            for entry in psutil.Process().threads():
+                if entry.id == thread.native_id:
+                    return entry.user_time + entry.system_time
+        except psutil.Error:
+            pass
+    return None
+
+
+class Server_Stats:
+    '''
+    Accounting for one server.
+
+    Attributes:
+    * name
+      - String, name of the server (its module).
+    * thread
+      - Thread running the server, set when each run starts.
+    * start_time
+      - time.perf_counter() when the thread was set.
+    * shared_thread
+      - Bool, True if the thread also runs other servers (coroutine
+        servers on the async host).
+    * messages
+      - Int, messages read by the server's pipes.
+    * handler_count
+      - Int, number of handler times recorded.
+    * handler_total
+      - Float, sum of handler times in seconds.
+    * handler_max
+      - Float, longest handler time in seconds.
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.thread = None
+        self.start_time = None
+        self.shared_thread = False
+        self.messages = 0
+        self.handler_count = 0
+        self.handler_total = 0.0
+        self.handler_max = 0.0
+        return
+
+
+    def Set_Thread(self, thread):
+        '''
+        Set the thread running the server, if changed.
+        '''
+        if thread is not self.thread:
+            self.thread = thread
+            self.start_time = time.perf_counter()
+        return
+
+
+    def Record_Handler(self, seconds):
+        '''
+        Record the time taken handling one message.
+        '''
+        self.handler_count += 1
+        self.handler_total += seconds
+        if seconds > self.handler_max:
+            self.handler_max = seconds
+        return
+
+
+    def Get_CPU_Time(self):
+        '''
+        Returns the cpu time in seconds of the server's thread, or None if
+        unavailable.
+        '''
+        return Get_Thread_CPU_Time(self.thread)
+
+
+    def Get_Snapshot(self):
+        '''
+        Returns a dict of the current stats, with times in seconds.
+        '''
+        return {
+            'name'          : self.name,
+            'thread'        : self.thread.name if self.thread else None,
+            'shared_thread' : self.shared_thread,
+            'cpu_time'      : self.Get_CPU_Time(),
+            'messages'      : self.messages,
+            'handler_avg'   : self.handler_total / self.handler_count if self.handler_count else 0.0,
+            'handler_max'   : self.handler_max,
+            }
+
+
+class Server_Stats_Sampler:
+    '''
+    Produces one-line cpu summaries of a set of servers, with cpu usage
+    over the time since the previous summary.
+
+    Attributes:
+    * last_samples
+      - Dict of (cpu_time, messages) per Server_Stats, from the last call.
+    * last_time
+      - time.perf_counter() of the last call.
+    '''
+    def __init__(self):
+        self.last_samples = {}
+        self.last_time = time.perf_counter()
+        return
+
+
+    def Format_Summary(self, stats_list):
+        '''
+        Returns a one-line summary of the given Server_Stats, busiest
+        first: cpu usage since the last call, messages since the last
+        call, and average and max handler times overall.
+        '''
+        now = time.perf_counter()
+        elapsed = max(now - self.last_time, 1e-9)
+
+        entries = []
+        samples = {}
+        for stats in stats_list:
+            cpu_time = stats.Get_CPU_Time()
+            samples[stats] = (cpu_time, stats.messages)
+            cpu_usage = None
+            if stats in self.last_samples:
+                last_cpu, last_messages = self.last_samples[stats]
+                interval = elapsed
+            else:
+                # New server; measure from when it started.
+                last_cpu, last_messages = 0.0, 0
+                interval = now - (stats.start_time or self.last_time)
+            if cpu_time is not None:
+                cpu_usage = (cpu_time - (last_cpu or 0.0)) / max(interval, 1e-9)
+            entries.append((cpu_usage, stats, stats.messages - last_messages))
+        self.last_samples = samples
+        self.last_time = now
+
+        if not entries:
+            return 'Server stats: no servers.'
+        entries.sort(key = lambda x: -1 if x[0] is None else x[0], reverse = True)
+        parts = []
+        for cpu_usage, stats, messages in entries:
+            cpu_text = 'cpu n/a' if cpu_usage is None else f'{cpu_usage * 100:.1f}% cpu'
+            if stats.shared_thread:
+                cpu_text += ' (shared loop)'
+            avg = stats.handler_total / stats.handler_count if stats.handler_count else 0.0
+            parts.append('{} {}, {} msgs, avg {} max {}'.format(
+                stats.name, cpu_text, messages,
+                Format_Duration(avg), Format_Duration(stats.handler_max)))
+        return 'Server stats: ' + '; '.join(parts)
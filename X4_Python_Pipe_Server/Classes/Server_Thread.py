@@ -1,17 +1,40 @@
-
 import threading
-import win32api
-import winerror
-from .Misc import Client_Garbage_Collected
+import weakref
+import traceback
+import contextvars
+from .Misc import Client_Garbage_Collected, Server_Cancelled, Cancel_Token
+from .Misc import Is_Coroutine_Function
+from .Transport import pipe_errors, Is_Disconnect_Error
+from .Supervisor import Supervisor
+from .Server_Stats import Server_Stats, Server_Stats_Enabled
+from .Server_Profiler import Get_Profiler
+
+# Server whose entry function is running in the current thread or task,
+# so pipes can register with it.
+_current_server = contextvars.ContextVar('x4_current_server', default = None)
+
+
+def Get_Current_Server():
+    '''
+    Returns the Server_Thread running the calling code, or None.
+    '''
+    return _current_server.get()
+
 
 class Server_Thread:
     '''
     Class to handle a single server thread.
     Starts a pipe server in a seperate thread, which runs until it closes.
-    If the x4 client pipe is closed, the server will be restarted.
-    
-    TODO: support cleanly closing threads, likely with a global flag
-    checked by pipe operations which raise a special exception.
+    If the x4 client pipe is closed, or the server crashes on another
+    exception, the server will be restarted, with backoff and a crash
+    budget as decided by its Supervisor. Get_Health reports its state.
+
+    Each run of the entry_function gets a Cancel_Token in its args, as
+    'cancel_token', which is cancelled when the run ends (for whatever
+    reason) or when the server is closed. Cancelling interrupts the
+    pipes created during the run, so blocked pipe calls raise
+    Server_Cancelled. Subthreads started by the server are not tracked,
+    and should be stopped through the token (eg. with Add_Callback).
     TODO: maybe make this a subclass of threading.Thread, and customize
     the run/start methods.
 
@@ -21,81 +44,264 @@ class Server_Thread:
       - This should not expect to store any state through game reloads,
         since such events will cause the function to be restarted
         from scratch.
+      - May be a coroutine function (async def), in which case it is
+        run in its own event loop within the thread.
     * thread
       - Thread running the server.
     * test
       - Bool, if True then in test mode, and server will not reboot on
         a disconnect.
+    * exception
+      - The exception that crashed the server's last run, if any, else None.
+    * supervisor
+      - Supervisor holding the restart policy and health state.
+    * stats
+      - Server_Stats for cpu and message accounting, or None if not
+        enabled when the server was created.
+    * profiler
+      - Server_Profiler covering each run, or None if not profiled.
+    * pipes
+      - WeakSet of pipes created by the current run, interrupted when
+        its token is cancelled.
+    * cancel_token
+      - Cancel_Token for the whole server, cancelled by Close.
+    * run_token
+      - Cancel_Token for the current run, a child of cancel_token.
     '''
     def __init__(self, entry_function, test = False):
+        self.entry_function = entry_function
+        self.test = test
+        self.thread = None
+        self.exception = None
+        self.supervisor = Supervisor()
+        self.stats = None
+        if Server_Stats_Enabled():
+            self.stats = Server_Stats(self.Get_Name())
+            self.stats.shared_thread = self.Uses_Shared_Thread()
+        self.profiler = Get_Profiler(self.Get_Name(), self.Uses_Shared_Thread())
+        self.pipes = weakref.WeakSet()
+        self.cancel_token = Cancel_Token()
+        self.run_token = None
+        self.Start()
+        return
+
+
+    def Start(self):
+        '''
+        Start running the server.
+        '''
         # Set up the thread.
         # For potential future development, the thread will call a
         #  class method on this class object, inheriting any object
         #  attributes.
-        self.entry_function = entry_function
-        self.test = test
-        self.thread = threading.Thread(target = self.Run_Server, 
-                                       args = [])
+        self.thread = threading.Thread(target = self.Run_Server,
+                                       args = [],
+                                       name = f'server {self.entry_function.__module__}')
         self.thread.start()
-        return            
+        return
+
+
+    def Get_Name(self):
+        '''
+        Returns a short name for the server, from its module (file) name.
+        '''
+        return self.entry_function.__module__.replace('user_module_', '', 1)
+
+
+    def Uses_Shared_Thread(self):
+        '''
+        Returns True if the server shares its thread with other servers.
+        '''
+        return False
+
+
+    def Get_Args(self):
+        '''
+        Returns the args dict to pass to the entry_function.
+        '''
+        # Pass any args of interest, notably the test mode flag.
+        return {
+            'test'         : self.test,
+            'cancel_token' : self.run_token,
+            }
+
+
+    def Begin_Run(self):
+        '''
+        Set up a new run_token, before running the entry_function.
+        '''
+        self.run_token = Cancel_Token(parent = self.cancel_token)
+        self.run_token.Add_Callback(self.Interrupt_Pipes)
+        self.exception = None
+        self.supervisor.Run_Started()
+        if self.stats is not None:
+            self.stats.Set_Thread(threading.current_thread())
+        if self.profiler is not None:
+            self.profiler.Start()
+        return
+
+
+    def End_Run(self, ex = None):
+        '''
+        Cancel the run_token after the entry_function finishes, stopping
+        anything still tied to the run, and decide on a restart.
+        ex is the exception that ended the run, if any.
+        Returns the delay in seconds before restarting, or None to stop.
+        '''
+        if self.profiler is not None:
+            self.profiler.Stop()
+        self.run_token.Cancel()
+        # Don't let the server token collect finished runs.
+        self.cancel_token.Remove_Callback(self.run_token.Cancel)
+
+        restart = False
+        error = None
+        crash = False
+        if ex is None:
+            # Returned normally.
+            pass
+        elif isinstance(ex, pipe_errors + (Client_Garbage_Collected, Server_Cancelled)):
+            restart = self.Handle_Pipe_Exception(ex)
+            # Unexpected pipe errors stop the server; keep a record.
+            if not restart and not self.test and not self.Is_Closing():
+                error = ex
+        elif self.Is_Closing():
+            # Likely fallout of the close; not a crash.
+            pass
+        else:
+            self.exception = ex
+            error = ex
+            crash = True
+            restart = not self.test
+            print(f'Server {self.entry_function.__module__} crashed on exception:')
+            print(''.join(traceback.format_exception(type(ex), ex, ex.__traceback__)))
+
+        delay = self.supervisor.Run_Ended(restart, error, crash)
+        if delay is None and crash and restart:
+            print(f'Server {self.entry_function.__module__} crashed too often; not restarting.')
+        elif delay:
+            print(f'Restarting server {self.entry_function.__module__} in {delay:.1f} s.')
+        return delay
+
+
+    def Get_Health(self):
+        '''
+        Returns a dict of the server health (see Supervisor.Get_Health).
+        '''
+        return self.supervisor.Get_Health()
+
+
+    def Is_Closing(self):
+        '''
+        Returns True if Close has been called.
+        '''
+        return self.cancel_token.Is_Cancelled()
 
 
     def Run_Server(self):
         '''
         Entry point for a thread.
         This will run the server's entry_function, restarting it whenever
-        the x4 pipe is broken, finishing when the function returns
-        normally or on other exception.
+        the x4 pipe is broken or it crashes (as the supervisor allows),
+        finishing when the function returns normally or is closed.
         '''
-        boot_server = True
-        while boot_server:
-            boot_server = False
+        # Let pipes made by the server find it.
+        _current_server.set(self)
+        while not self.Is_Closing():
+            self.Begin_Run()
 
-            # Fire up the server, listening for particular errors.
+            # Fire up the server, catching whatever ends it.
+            ex = None
             try:
-                # Pass any args of interest, notably the test mode flag.
-                self.entry_function({'test' : self.test})
-                
-            except (win32api.error, Client_Garbage_Collected) as ex:
-                # win32api.error exceptions have the fields:
-                #  winerror : integer error code (eg. 109)
-                #  funcname : Name of function that errored, eg. 'ReadFile'
-                #  strerror : String description of error
-
-                if self.test:
-                    print('Pipe client disconnected; stopping test.')
-                    
-                elif isinstance(ex, Client_Garbage_Collected):
-                    print('Pipe client garbage collected, restarting server.')
-                    # Keep running the server.
-                    boot_server = True
-                
-                # If X4 was reloaded, this results in a ERROR_BROKEN_PIPE error
-                # (assuming x4 lua was wrestled into closing its pipe properly
-                #  on garbage collection).
-                elif ex.winerror == winerror.ERROR_BROKEN_PIPE:
-                    print('Pipe client disconnected, restarting server.')
-                    # Keep running the server.
-                    boot_server = True
-
-            #except Exception as ex:
-            #    # Any other exception, reraise for now.
-            #    raise ex
+                if Is_Coroutine_Function(self.entry_function):
+                    # Imported only when needed, being slow to import.
+                    import asyncio
+                    asyncio.run(self.entry_function(self.Get_Args()))
+                else:
+                    self.entry_function(self.Get_Args())
+            except Exception as run_ex:
+                ex = run_ex
+
+            delay = self.End_Run(ex)
+            # Wait out any backoff, waking early if closed.
+            if delay is None or self.cancel_token.Wait(delay):
+                break
+
+        if self.Is_Closing():
+            self.supervisor.Set_Stopped()
+        return
+
+
+    def Handle_Pipe_Exception(self, ex):
+        '''
+        Handle a pipe exception raised out of the entry_function.
+        Returns True if the server should be restarted.
+        '''
+        # Pipe errors (win32api.error or Pipe_Error) have the fields:
+        #  winerror : integer error code (eg. 109)
+        #  funcname : Name of function that errored, eg. 'ReadFile'
+        #  strerror : String description of error
+        # Pipes interrupted by Close end up here; don't restart.
+        if self.Is_Closing():
+            print('Server closed.')
+
+        elif self.test:
+            print('Pipe client disconnected; stopping test.')
+
+        elif isinstance(ex, Client_Garbage_Collected):
+            print('Pipe client garbage collected, restarting server.')
+            # Keep running the server.
+            return True
+
+        # If X4 was reloaded, this results in a ERROR_BROKEN_PIPE error
+        # (assuming x4 lua was wrestled into closing its pipe properly
+        #  on garbage collection).
+        elif Is_Disconnect_Error(ex):
+            print('Pipe client disconnected, restarting server.')
+            # Keep running the server.
+            return True
+        return False
+
 
+    def Add_Pipe(self, pipe):
+        '''
+        Track a pipe created by this server's current run, giving it the
+        run_token to check.
+        '''
+        pipe.cancel_token = self.run_token
+        pipe.server_stats = self.stats
+        self.pipes.add(pipe)
+        if self.run_token.Is_Cancelled():
+            pipe.Interrupt()
+        return
+
+
+    def Interrupt_Pipes(self):
+        '''
+        Interrupt all pipes of the current run, and stop tracking them.
+        '''
+        pipes = list(self.pipes)
+        self.pipes = weakref.WeakSet()
+        for pipe in pipes:
+            pipe.Interrupt()
         return
-    
+
 
     def Close(self):
         '''
-        Close the server thread, perhaps unsafely.
-        Pending development.
+        Stop the server without restarting it, cancelling its token (and
+        so interrupting its pipes). Returns right away; use Join to wait
+        for it to finish.
         '''
+        self.cancel_token.Cancel()
         return
 
 
-    def Join(self):
+    def Join(self, timeout = None):
         '''
-        Calls thread.join, blocking until the thread returns.
+        Calls thread.join, blocking until the thread returns, or until
+        timeout seconds if given.
+        Returns True if the server finished.
         '''
-        self.thread.join()
-        return
\ No newline at end of file
+        self.thread.join(timeout)
+        return not self.thread.is_alive()
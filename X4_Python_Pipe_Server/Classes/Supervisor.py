@@ -0,0 +1,143 @@
+'''
+Restart policy and health state of a server.
+
+Servers restart whenever x4 breaks their pipe (eg. on a save reload),
+and also after crashing on other exceptions. To keep a broken server
+from spinning in a tight restart loop:
+* Restarts after a run shorter than stable_time are delayed, with the
+  delay doubling on each further short run (up to max_backoff). A run
+  lasting stable_time resets this, so normal x4 reloads restart at once.
+* Crashes are limited to crash_budget within crash_window seconds; one
+  more marks the server as failed, and it is not restarted.
+'''
+import time
+import traceback
+from collections import deque
+
+class Supervisor:
+    '''
+    Tracks the runs of one server, deciding when to restart it.
+
+    Attributes:
+    * state
+      - String, one of:
+        'starting' : not yet run.
+        'running'  : entry function is running.
+        'restarting' : waiting to restart after a run ended.
+        'failed'   : stopped on an error, or out of crash budget.
+        'stopped'  : stopped normally (returned, closed, or test ended).
+    * restarts
+      - Int, number of restarts so far.
+    * crashes
+      - Int, total number of crashes (exceptions other than disconnects).
+    * last_error
+      - String traceback of the last error, or None.
+    * last_error_time
+      - time.time() of the last error, or None.
+    * crash_times
+      - Deque of time.monotonic() of crashes within crash_window.
+    * backoff
+      - Float, delay in seconds before the next restart.
+    * run_start
+      - time.monotonic() when the current or last run started.
+    '''
+    # Delays for restarting after short runs.
+    min_backoff = 0.1
+    max_backoff = 30
+    # Runs at least this long reset the backoff.
+    stable_time = 30
+    # Crashes allowed within the window before giving up.
+    crash_budget = 5
+    crash_window = 300
+
+    def __init__(self):
+        self.state = 'starting'
+        self.restarts = 0
+        self.crashes = 0
+        self.last_error = None
+        self.last_error_time = None
+        self.crash_times = deque()
+        self.backoff = 0
+        self.run_start = None
+        return
+
+
+    def Run_Started(self):
+        '''
+        Note that a run of the server started.
+        '''
+        self.state = 'running'
+        self.run_start = time.monotonic()
+        return
+
+
+    def Run_Ended(self, restart, error = None, crash = False):
+        '''
+        Note that a run of the server ended, and pick what to do next.
+
+        * restart
+          - Bool, True if the server wants restarting (eg. x4 disconnected,
+            or it crashed outside test mode).
+        * error
+          - Exception that ended the run abnormally, if any; its traceback
+            is recorded as the last_error.
+        * crash
+          - Bool, True if the error counts against the crash budget.
+
+        Returns the delay in seconds before restarting, or None if the
+        server should not restart.
+        '''
+        now = time.monotonic()
+        if error is not None:
+            self.last_error = ''.join(traceback.format_exception(
+                type(error), error, error.__traceback__))
+            self.last_error_time = time.time()
+
+        if crash:
+            self.crashes += 1
+            self.crash_times.append(now)
+            while self.crash_times and now - self.crash_times[0] > self.crash_window:
+                self.crash_times.popleft()
+            if len(self.crash_times) > self.crash_budget:
+                restart = False
+
+        if not restart:
+            self.state = 'failed' if error is not None else 'stopped'
+            return None
+
+        # Back off only while runs are short.
+        if self.run_start is not None and now - self.run_start >= self.stable_time:
+            self.backoff = 0
+        delay = self.backoff
+        self.backoff = min(max(self.backoff * 2, self.min_backoff), self.max_backoff)
+
+        self.state = 'restarting'
+        self.restarts += 1
+        return delay
+
+
+    def Set_Stopped(self):
+        '''
+        Mark the server as stopped, eg. when closed while restarting.
+        '''
+        if self.state != 'failed':
+            self.state = 'stopped'
+        return
+
+
+    def Get_Health(self):
+        '''
+        Returns a dict summarizing the server health, with the state,
+        restarts, crashes, uptime (seconds of the current run, or None)
+        and last_error (traceback string, or None).
+        '''
+        uptime = None
+        if self.state == 'running' and self.run_start is not None:
+            uptime = time.monotonic() - self.run_start
+        return {
+            'state'      : self.state,
+            'restarts'   : self.restarts,
+            'crashes'    : self.crashes,
+            'uptime'     : uptime,
+            'last_error' : self.last_error,
+            }
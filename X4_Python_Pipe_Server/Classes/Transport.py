@@ -0,0 +1,1231 @@
+'''
+OS level pipe transports, used by the Pipe classes.
+
+Each transport implements the same small interface: open a server end,
+wait for a client, open a client end, and read/write whole messages.
+The default is windows named pipes (as opened by the x4 lua winpipe dll),
+with a unix domain socket alternative so servers can be run and
+benchmarked on linux machines.
+
+The transport is picked at runtime, in order of preference:
+* An explicit transport name given to a Pipe.
+* The name set through Set_Default_Transport (eg. from the host
+  command line).
+* The X4_PIPE_TRANSPORT environment variable.
+* Windows named pipes on windows, unix sockets elsewhere.
+
+Server transports keep a standby server end for each pipe once a client
+connects: a second named pipe instance on windows, or the still open
+listening socket on unix. When the client reconnects (eg. after an x4
+save reload) it is accepted right away by the standby, even while the
+server is still restarting, and the restarted server adopts the standby
+instead of creating a new pipe.
+'''
+import os
+import sys
+import atexit
+import threading
+import socket
+import struct
+import ctypes
+import tempfile
+from pathlib import Path
+
+from .Misc import Pipe_Error
+
+# Conditional import of pywin32, checking if it is available.
+# This is always expected on windows, and never elsewhere.
+# Only pywintypes is imported here, for the "error" exception (which
+# win32api.error refers to); the heavier win32 modules are imported by
+# Import_Win32 when the first named pipe is set up, keeping them off the
+# host startup path.
+try:
+    import pywintypes
+    pywin32_found = True
+except ImportError:
+    pywin32_found = False
+
+# pywin32 modules, set by Import_Win32.
+win32api = None
+winerror = None
+win32pipe = None
+win32file = None
+win32security = None
+win32process = None
+win32con = None
+
+def Import_Win32():
+    '''
+    Import the pywin32 modules used by named pipes, if not done already.
+    '''
+    global win32api, winerror, win32pipe, win32file
+    global win32security, win32process, win32con
+    if win32con is not None:
+        return
+    # Note: import pywin32 as win32api, if needed, though subpackages are
+    #  directly available.
+    # The top level has the "error" exception.
+    import win32api
+    # This has windows error codes.
+    import winerror
+    # This can open a pipe.
+    import win32pipe
+    # This reads/writes the pipe file.
+    import win32file
+    # This provides support for changing access permissions (for users where
+    # the defaults don't work). Note: defaults work for most users.
+    import win32security
+    # Support for looking at processes.
+    import win32process
+    # Set last, as the flag for the rest being imported.
+    import win32con
+    #import ntsecuritycon as con
+    return
+
+
+# Windows error codes of interest, used by all transports.
+# (Duplicated here since winerror is only available on windows.)
+ERROR_BROKEN_PIPE = 109
+ERROR_PIPE_BUSY   = 231
+ERROR_NO_DATA     = 232
+ERROR_MORE_DATA   = 234
+ERROR_PIPE_CONNECTED = 535
+ERROR_OPERATION_ABORTED = 995
+ERROR_IO_PENDING  = 997
+
+# Flag for CreateNamedPipe, failing if another instance of the pipe
+# already exists (eg. from another running host).
+FILE_FLAG_FIRST_PIPE_INSTANCE = 0x00080000
+# Flag for CreateNamedPipe and CreateFile, opening the handle for
+# overlapped (asynchronous) I/O.
+FILE_FLAG_OVERLAPPED = 0x40000000
+
+# Tuple of exception types signalling pipe access problems, for use
+# in except clauses.
+pipe_errors = (Pipe_Error,) + ((pywintypes.error,) if pywin32_found else ())
+
+
+def Is_Disconnect_Error(ex):
+    '''
+    Returns True if the given pipe exception indicates the other end
+    of the pipe was closed.
+    '''
+    return getattr(ex, 'winerror', None) == ERROR_BROKEN_PIPE
+
+
+def Is_Interrupt_Error(ex):
+    '''
+    Returns True if the given pipe exception was raised by a blocked call
+    being interrupted (see Transport.Interrupt).
+    '''
+    return getattr(ex, 'winerror', None) == ERROR_OPERATION_ABORTED
+
+
+def Is_Create_Error(ex):
+    '''
+    Returns True if the given pipe exception was raised when trying to
+    create the server end of a pipe, generally because another server
+    already owns it.
+    '''
+    return getattr(ex, 'funcname', None) in ('CreateNamedPipe', 'bind')
+
+
+def Describe_Error(ex):
+    '''
+    Returns a string describing a pipe exception.
+    '''
+    return '{} in {} : {}'.format(
+        getattr(ex, 'winerror', None),
+        getattr(ex, 'funcname', None),
+        getattr(ex, 'strerror', str(ex)))
+
+
+# Standby server ends, keyed by (transport class, pipe_path), holding
+# (handle, buffer_size, overlapped). Handles are transport specific.
+_standby_servers = {}
+_standby_lock = threading.Lock()
+
+
+def _Put_Standby(transport, handle):
+    '''
+    Record a standby server handle for the transport's pipe, returning
+    False (leaving the handle with the caller) if one is already recorded.
+    '''
+    key = (type(transport), transport.pipe_path)
+    with _standby_lock:
+        if key in _standby_servers:
+            return False
+        _standby_servers[key] = (handle, transport.buffer_size, transport.overlapped)
+    return True
+
+
+def _Take_Standby(transport):
+    '''
+    Remove and return the standby server handle for the transport's pipe,
+    or None if there is none. Standbys made with a different buffer_size
+    or overlapped mode are closed instead.
+    '''
+    key = (type(transport), transport.pipe_path)
+    with _standby_lock:
+        entry = _standby_servers.pop(key, None)
+    if entry is None:
+        return None
+    handle, buffer_size, overlapped = entry
+    if buffer_size != transport.buffer_size or overlapped != transport.overlapped:
+        transport.Close_Standby(handle, transport.pipe_path)
+        return None
+    return handle
+
+
+def _Is_Standby(transport, handle):
+    '''
+    Returns True if the handle is the recorded standby for the
+    transport's pipe.
+    '''
+    with _standby_lock:
+        entry = _standby_servers.get((type(transport), transport.pipe_path))
+    return entry is not None and entry[0] is handle
+
+
+def Close_Standby_Servers():
+    '''
+    Close all standby server ends. Called automatically on exit.
+    '''
+    with _standby_lock:
+        entries = list(_standby_servers.items())
+        _standby_servers.clear()
+    for (transport_class, pipe_path), (handle, _, _) in entries:
+        try:
+            transport_class.Close_Standby(handle, pipe_path)
+        except Exception:
+            pass
+    return
+
+atexit.register(Close_Standby_Servers)
+
+
+# Cached SECURITY_ATTRIBUTES for server pipes, built on first use since
+# the account lookups are slow and their result doesn't change.
+_security_attributes = None
+_security_attributes_built = False
+
+def Get_Security_Attributes(verbose = False):
+    '''
+    Returns the SECURITY_ATTRIBUTES to create server pipes with, giving
+    the current user read/write access, or None to use the defaults if
+    that couldn't be set up. Built once, then reused.
+    '''
+    global _security_attributes, _security_attributes_built
+    if _security_attributes_built:
+        return _security_attributes
+
+    # Note: at least one user had access_denied errors from the x4
+    # lua code, not resolved by running x4 as admin, possibly linked
+    # to pipe permissions.
+    # Documentation on setting up security is very sparse. The only
+    # solid python example found is here:
+    # http://timgolden.me.uk/python/win32_how_do_i/add-security-to-a-file.html
+    # This edits permissions after creation, though in testing this
+    # approach requires a separate read connection to the pipe, and
+    # would prevent nMaxInstances==1 from working.
+    # As such, it would be possible for x4 to connect twice to the same
+    # pipe after the security permissions are done, which is undesirable.
+
+    # Security attributes have a SECURITY_DESCRIPTOR member to modify.
+    sec_attr = win32security.SECURITY_ATTRIBUTES()
+    sec_desc = sec_attr.SECURITY_DESCRIPTOR
+
+
+    # Create a new dacl ("discretionary access control list").
+    dacl = win32security.ACL ()
+
+    # Look up windows users.
+    # Note: for the person with perm problems, "Everyone" and
+    # "Administrators" lookups failed (1332 error), but the user lookup
+    # worked, and just setting read/write for the user was sufficient.
+    perms_set = False
+    for account_name in [win32api.GetUserName()]:
+        # One user indicated the printed account name for them was blank,
+        # followed by perms not working. Warn in that case, and leave
+        # perms at default.
+        # TODO: this didn't fix the problem; would need more input from
+        # the user to figure out exactly what is going on.
+        if not account_name.strip():
+            if verbose:
+                print(f'Failed to retrieve account name with win32api.GetUserName')
+            continue
+
+        try:
+            account_id, domain, type = win32security.LookupAccountName (None, account_name)
+            # Set read/write permission (execute doesn't make sense).
+            dacl.AddAccessAllowedAce(win32security.ACL_REVISION,
+                                        win32file.FILE_GENERIC_READ | win32file.FILE_GENERIC_WRITE,
+                                        account_id)
+            perms_set = True
+            if verbose:
+                print(f'Setting pipe read/write permission for account "{account_name}"')
+        except win32api.error as ex:
+            if verbose:
+                print(f'Failed to set pipe read/write permission for account '
+                        f'"{account_name}"; error code {ex.winerror} in '
+                        f'{ex.funcname} : {ex.strerror}')
+            continue
+
+    if perms_set:
+        # Apply to the security object.
+        # Args are: (1 if dacle used, dacl, 1 if using defaults)
+        sec_desc.SetSecurityDescriptorDacl(1, dacl, 0)
+        # Leave user/group/etc. at defaults (eg. unspecified).
+    else:
+        # If all perms failed, just clear this and use defaults.
+        sec_attr = None
+
+    _security_attributes = sec_attr
+    _security_attributes_built = True
+    return sec_attr
+
+
+class Transport:
+    '''
+    Base class for pipe transports.
+    A transport owns the OS handles for one end of one pipe.
+
+    Parameters:
+    * pipe_name
+      - String, name of the pipe without OS path prefix.
+    * buffer_size
+      - Int, bytes to reserve for the buffers in each direction, and
+        the largest message that can be read.
+    * verbose
+      - Bool, if True then print extra setup messages.
+    * overlapped
+      - Bool, if True then the OS handles are opened for overlapped I/O,
+        which the async calls need on windows. Async pipes set this.
+
+    Attributes:
+    * pipe_path
+      - String, OS path to the pipe.
+    * read_buffer
+      - Writable buffer of buffer_size bytes, allocated once and reused
+        by every read.
+    * interrupted
+      - Bool, True once Interrupt has been called.
+    '''
+    # If True, servers keep a standby server end after a client connects,
+    # for fast reconnects. Exposed mainly so benchmarks can compare.
+    use_standby = True
+
+    def __init__(self, pipe_name, buffer_size, verbose = False, overlapped = False):
+        self.pipe_name = pipe_name
+        self.buffer_size = buffer_size
+        self.verbose = verbose
+        self.overlapped = overlapped
+        self.pipe_path = self.Get_Pipe_Path(pipe_name)
+        self.read_buffer = self.Allocate_Read_Buffer()
+        self.interrupted = False
+        return
+
+    def Allocate_Read_Buffer(self):
+        '''
+        Returns a new writable buffer of buffer_size bytes for reads.
+        '''
+        return bytearray(self.buffer_size)
+
+    def Get_Pipe_Path(self, pipe_name):
+        '''
+        Returns the OS path for the given pipe name.
+        '''
+        raise NotImplementedError()
+
+    def Open_Server(self):
+        '''
+        Create the server end of the pipe. Does not wait for a client.
+        '''
+        raise NotImplementedError()
+
+    def Connect(self):
+        '''
+        Wait for a client to connect to the server end of the pipe.
+        '''
+        raise NotImplementedError()
+
+    def Open_Client(self):
+        '''
+        Open the client end of an existing pipe.
+        '''
+        raise NotImplementedError()
+
+    def Read_View(self):
+        '''
+        Read one message into read_buffer, returning a memoryview of its
+        bytes. In non-blocking mode, returns None if no message is waiting.
+        The view is only valid until the next read; copy anything that
+        needs to be kept.
+        '''
+        raise NotImplementedError()
+
+    def Read(self):
+        '''
+        Read one message, returning a copy of its bytes. In non-blocking
+        mode, returns None if no message is waiting.
+        '''
+        view = self.Read_View()
+        if view is None:
+            return None
+        return bytes(view)
+
+    def Write(self, data):
+        '''
+        Write one message from the given bytes.
+        '''
+        raise NotImplementedError()
+
+    def Set_Blocking(self, blocking):
+        '''
+        Set blocking (True) or non-blocking (False) access mode.
+        '''
+        raise NotImplementedError()
+
+    def Get_Client_Executable(self) -> Path:
+        '''
+        Returns the path of the executable of the client process.
+        '''
+        raise NotImplementedError()
+
+    def Close(self):
+        '''
+        Close this end of the pipe. A server's standby end is left open.
+        '''
+        raise NotImplementedError()
+
+    def Interrupt(self):
+        '''
+        Called from another thread to stop this transport: a Connect or
+        Read blocked on it (or started afterward) raises a pipe error
+        matched by Is_Interrupt_Error or Is_Disconnect_Error. The
+        transport should then just be closed.
+        '''
+        raise NotImplementedError()
+
+    def Check_Interrupted(self):
+        '''
+        Raise an interrupt error if Interrupt was called, so that calls
+        starting after it don't block.
+        '''
+        if self.interrupted:
+            raise Pipe_Error(ERROR_OPERATION_ABORTED, 'interrupt',
+                             'Pipe access was interrupted')
+        return
+
+    @staticmethod
+    def Close_Standby(handle, pipe_path):
+        '''
+        Close a standby server handle made by this transport type.
+        '''
+        raise NotImplementedError()
+
+    # Async versions of the blocking calls, used by the Async_Pipe classes.
+    # By default these run the blocking call on the event loop's thread
+    # executor; transports with native event loop support override them,
+    # waiting without a thread: unix sockets through the selector, and
+    # overlapped windows pipes through the proactor's completion port.
+    # asyncio is imported within these (a dict lookup once loaded), as it
+    # is slow to import and only needed by async servers.
+    # Note: windows named pipe handles serialize synchronous accesses, so
+    # a pending read will hold up a write on the same handle.
+
+    async def Connect_Async(self):
+        '''
+        Async version of Connect.
+        '''
+        import asyncio
+        await asyncio.get_running_loop().run_in_executor(None, self.Connect)
+        return
+
+    async def Read_View_Async(self):
+        '''
+        Async version of Read_View, waiting until a message is available.
+        '''
+        import asyncio
+        return await asyncio.get_running_loop().run_in_executor(None, self.Read_View)
+
+    async def Read_Async(self):
+        '''
+        Async version of Read, waiting until a message is available.
+        '''
+        return bytes(await self.Read_View_Async())
+
+    async def Write_Async(self, data):
+        '''
+        Async version of Write.
+        '''
+        import asyncio
+        await asyncio.get_running_loop().run_in_executor(None, self.Write, data)
+        return
+
+
+class _OVERLAPPED(ctypes.Structure):
+    '''
+    Windows OVERLAPPED struct, for synchronous calls on overlapped pipe
+    handles.
+    '''
+    _fields_ = [
+        ('Internal'     , ctypes.c_void_p),
+        ('InternalHigh' , ctypes.c_void_p),
+        ('Offset'       , ctypes.c_uint32),
+        ('OffsetHigh'   , ctypes.c_uint32),
+        ('hEvent'       , ctypes.c_void_p),
+        ]
+
+
+# kernel32, with argument types set for the overlapped calls, made by
+# Get_Kernel32 on first use.
+_kernel32 = None
+
+def Get_Kernel32():
+    '''
+    Returns kernel32 set up for the calls made on overlapped pipes.
+    '''
+    global _kernel32
+    if _kernel32 is not None:
+        return _kernel32
+    from ctypes import wintypes
+    kernel32 = ctypes.WinDLL('kernel32', use_last_error = True)
+    handle, dword, bool_ = wintypes.HANDLE, wintypes.DWORD, wintypes.BOOL
+    pointer = ctypes.c_void_p
+    kernel32.CreateEventW.restype  = handle
+    kernel32.CreateEventW.argtypes = (pointer, bool_, bool_, wintypes.LPCWSTR)
+    kernel32.CloseHandle.argtypes  = (handle,)
+    kernel32.ReadFile.argtypes     = (handle, pointer, dword, pointer, pointer)
+    kernel32.WriteFile.argtypes    = (handle, ctypes.c_char_p, dword, pointer, pointer)
+    kernel32.ConnectNamedPipe.argtypes    = (handle, pointer)
+    kernel32.GetOverlappedResult.argtypes = (handle, pointer, pointer, bool_)
+    kernel32.CancelIoEx.argtypes   = (handle, pointer)
+    _kernel32 = kernel32
+    return kernel32
+
+
+class _Proactor_Pipe:
+    '''
+    Wrapper of a pipe handle for the asyncio proactor, which takes
+    objects with a fileno() and registers each with its completion port
+    once (keeping a weak reference). A handle can only be registered
+    once, so each transport keeps its wrapper for the handle's life.
+
+    Attributes:
+    * handle
+      - The wrapped pipe handle.
+    '''
+    def __init__(self, handle):
+        self.handle = handle
+        return
+
+    def fileno(self):
+        return int(self.handle)
+
+
+class Win_Pipe_Transport(Transport):
+    '''
+    Transport using windows named pipes in message mode.
+    This is what the x4 lua side connects to.
+
+    Overlapped transports (as used by async pipes) run their async calls
+    through the event loop's IOCP proactor (the default loop on windows),
+    so waiting pipes don't hold threads. Their sync calls make overlapped
+    calls and wait on them.
+
+    Attributes:
+    * pipe_file
+      - Open pipe/file handle.
+    * is_server
+      - Bool, True if this is the server end.
+    * blocking
+      - Bool, False if in non-blocking mode.
+    * io_thread_id
+      - Native id of the thread that last made a blocking call, which
+        Interrupt cancels, or None.
+    * proactor_pipe
+      - _Proactor_Pipe of pipe_file, once used by async calls, else None.
+    '''
+    def __init__(self, *args, **kwargs):
+        if not pywin32_found:
+            raise RuntimeError('pywin32 not found; named pipes unavailable')
+        Import_Win32()
+        super().__init__(*args, **kwargs)
+        self.pipe_file = None
+        self.is_server = False
+        self.blocking = True
+        self.io_thread_id = None
+        self.proactor_pipe = None
+        return
+
+    def Get_Pipe_Path(self, pipe_name):
+        # Must be: "//<server>/pipe/<pipename>"
+        return "\\\\.\\pipe\\" + pipe_name
+
+
+    def Allocate_Read_Buffer(self):
+        # Overlapped reads fill a plain bytearray, through ctypes or the
+        # proactor.
+        if self.overlapped:
+            return bytearray(self.buffer_size)
+        # ReadFile fills buffers made by AllocateReadBuffer in place.
+        return win32file.AllocateReadBuffer(self.buffer_size)
+
+
+    # Instances allowed per pipe name: the connected one plus a standby.
+    max_instances = 2
+
+    def Open_Server(self):
+        self.is_server = True
+        # Adopt the standby instance made after the last connection, which
+        # a reconnecting client may already be connected to.
+        if self.use_standby:
+            self.pipe_file = _Take_Standby(self)
+            if self.pipe_file is not None:
+                if self.verbose:
+                    print(f'Using standby pipe instance for {self.pipe_path}')
+                return
+        self.pipe_file = self.Create_Instance(first = True)
+
+        # -Removed; requires nMaxInstances > 1 (or does it? maybe some other problem)
+        ## Get the existing file security to be modified, dacl information.
+        #sd = win32security.GetFileSecurity (self.pipe_path, win32security.DACL_SECURITY_INFORMATION)
+        ## Apply the dacl.
+        #sd.SetSecurityDescriptorDacl (1, dacl, 0)
+        #win32security.SetFileSecurity (self.pipe_path, win32security.DACL_SECURITY_INFORMATION, sd)
+        return
+
+
+    def Create_Instance(self, first):
+        '''
+        Returns a handle to a new server instance of the pipe.
+        If first, creation fails if any other instance exists.
+        '''
+        # Create the pipe in server mode.
+        return win32pipe.CreateNamedPipe(
+            # Note: for some reason this doesn't use keyword args,
+            #  so arg names included in comments.
+            # pipeName
+            self.pipe_path,
+            # The lua winapi opens pipes as read/write; try to match that.
+            # openMode
+            win32pipe.PIPE_ACCESS_DUPLEX
+            | (FILE_FLAG_FIRST_PIPE_INSTANCE if first else 0)
+            | (FILE_FLAG_OVERLAPPED if self.overlapped else 0),
+            # pipeMode
+            # Set writes to message, reads to message.
+            # This means reading from the pipe grabs a complete message
+            # as written, instead of a lump of bytes.
+            win32pipe.PIPE_TYPE_MESSAGE | win32pipe.PIPE_READMODE_MESSAGE | win32pipe.PIPE_WAIT,
+            # nMaxInstances
+            # Allow one standby instance beyond the connected one. Other
+            # hosts are still kept out by FILE_FLAG_FIRST_PIPE_INSTANCE.
+            self.max_instances,
+            # nOutBufferSize
+            self.buffer_size,
+            # nInBufferSize
+            # Can limit this to choke writes and see what errors they give.
+            # In testing, this needs to be large enough for any single message,
+            #  else the client write fails with no error code (eg. code 0).
+            # In testing, a closed server and a full pipe generate the same
+            #  error code, so x4 stalling on full buffers will not be supported.
+            # This buffer should be sized large enough to never fill up.
+            self.buffer_size,
+            # nDefaultTimeOut
+            300,
+
+            # sa, security access.
+            # If set to None, will use some system defaults, with rd/wr
+            # access for the owner and rd for others (maybe, unclear).
+            Get_Security_Attributes(self.verbose),
+            )
+
+
+    def Create_Standby(self):
+        '''
+        Create the standby instance for this pipe, if there isn't one.
+        '''
+        with _standby_lock:
+            if (type(self), self.pipe_path) in _standby_servers:
+                return
+        try:
+            handle = self.Create_Instance(first = False)
+        except win32api.error as ex:
+            # Eg. an old instance is not closed yet; the next reconnect
+            # just won't be sped up.
+            if self.verbose:
+                print(f'Failed to create standby pipe instance: {Describe_Error(ex)}')
+            return
+        if not _Put_Standby(self, handle):
+            win32file.CloseHandle(handle)
+        return
+
+
+    @staticmethod
+    def Close_Standby(handle, pipe_path):
+        win32file.CloseHandle(handle)
+        return
+
+
+    def Connect(self):
+        # Wait to connect automatically.
+        # This appears to be a stall op that waits for a client to connect.
+        # Returns 0, an integer for okayish errors (io pending, or pipe already
+        #  connected), or raises an exception on other errors.
+        # If the client connected first (eg. to a standby instance), don't
+        #  consider that an error, so just ignore any error code but let
+        #  exceptions get raised.
+        self.Check_Interrupted()
+        self.io_thread_id = threading.get_native_id()
+        if self.overlapped:
+            self.Call_Overlapped('ConnectNamedPipe')
+        else:
+            win32pipe.ConnectNamedPipe(self.pipe_file, None)
+        # Prepare for the next reconnect.
+        if self.use_standby:
+            self.Create_Standby()
+        return
+
+
+    def Open_Client(self):
+        '''
+        Note: the lua side winapi uses this for opening the pipe:
+          HANDLE hPipe = CreateFile(
+              pipename,
+              GENERIC_READ |  // read and write access
+              GENERIC_WRITE,
+              0,              // no sharing
+              NULL,           // default security attributes
+              OPEN_EXISTING,  // opens existing pipe
+              0,              // default attributes
+              NULL);          // no template file
+        '''
+        self.pipe_file = win32file.CreateFile(
+            # pipeName
+            self.pipe_path,
+            # Access mode; both read and write.
+            win32file.GENERIC_WRITE | win32file.GENERIC_READ,
+            # No sharing.
+            0,
+            # Default security.
+            None,
+            # Open existing.
+            win32file.OPEN_EXISTING,
+            # Default attributes, unless overlapped.
+            FILE_FLAG_OVERLAPPED if self.overlapped else 0,
+            # No template.
+            None)
+
+        # The above defaults to byte mode. Switch to message.
+        win32pipe.SetNamedPipeHandleState(
+            self.pipe_file,
+            win32pipe.PIPE_READMODE_MESSAGE,
+            None,
+            None)
+        return
+
+
+    def Read_View(self):
+        # Get byte data, up to the size of the buffer, into the reused
+        # read buffer. (Passing a size instead would allocate a new
+        # buffer_size bytes object on every call.)
+        # For synchronous reads, the returned data is the buffer sliced
+        # to the bytes read.
+        # Non-blocking reads raise ERROR_NO_DATA if the pipe is empty.
+        self.Check_Interrupted()
+        if self.blocking:
+            self.io_thread_id = threading.get_native_id()
+        if self.overlapped:
+            buffer = (ctypes.c_char * self.buffer_size).from_buffer(self.read_buffer)
+            try:
+                size = self.Call_Overlapped('ReadFile', buffer, self.buffer_size, None)
+            except Pipe_Error as ex:
+                if ex.winerror == ERROR_NO_DATA and not self.blocking:
+                    return None
+                raise
+            return memoryview(self.read_buffer)[:size]
+        try:
+            error, data = win32file.ReadFile(self.pipe_file, self.read_buffer)
+        except win32api.error as ex:
+            # These exceptions have the fields:
+            #  winerror : integer error code (eg. 109)
+            #  funcname : Name of function that errored, eg. 'ReadFile'
+            #  strerror : String description of error
+            if ex.winerror == winerror.ERROR_NO_DATA and not self.blocking:
+                # Return None in this case.
+                return None
+            # Re-raise other exceptions.
+            raise ex
+        return memoryview(data)
+
+
+    def Write(self, data):
+        # Similar to above, ignore this error, rely on exceptions.
+        # Don't worry about non-blocking full-pipe exceptions for now;
+        #  assume there is always room.
+        if self.overlapped:
+            if not isinstance(data, bytes):
+                data = bytes(data)
+            self.Call_Overlapped('WriteFile', data, len(data), None)
+            return
+        error, bytes_written = win32file.WriteFile(self.pipe_file, data)
+        return
+
+
+    def Call_Overlapped(self, funcname, *args):
+        '''
+        Make a synchronous call to the named kernel32 function on the
+        overlapped pipe_file, waiting for it to finish. The handle and an
+        OVERLAPPED are added as the first and last args.
+        Returns the bytes transferred. Raises Pipe_Error on failure.
+        '''
+        from ctypes import wintypes
+        kernel32 = Get_Kernel32()
+        handle = int(self.pipe_file)
+        event = kernel32.CreateEventW(None, True, False, None)
+        overlapped = _OVERLAPPED()
+        # Setting the low bit of the event keeps the completion off the
+        # event loop's completion port, which the handle may be registered
+        # with for async calls.
+        overlapped.hEvent = event | 1
+        transferred = wintypes.DWORD()
+        try:
+            if not getattr(kernel32, funcname)(handle, *args, ctypes.byref(overlapped)):
+                error = ctypes.get_last_error()
+                # The client connected ahead of ConnectNamedPipe.
+                if error == ERROR_PIPE_CONNECTED:
+                    return 0
+                if error not in (ERROR_IO_PENDING, ERROR_MORE_DATA):
+                    raise Pipe_Error(error, funcname, ctypes.FormatError(error))
+            if not kernel32.GetOverlappedResult(
+                    handle, ctypes.byref(overlapped), ctypes.byref(transferred), True):
+                error = ctypes.get_last_error()
+                # Messages larger than the buffer are cut short, as for
+                # non-overlapped reads.
+                if error != ERROR_MORE_DATA:
+                    raise Pipe_Error(error, funcname, ctypes.FormatError(error))
+        finally:
+            kernel32.CloseHandle(event)
+        return transferred.value
+
+
+    def Get_Proactor(self):
+        '''
+        Returns the running event loop's IOCP proactor for async calls,
+        or None if this transport isn't overlapped or the loop has no
+        proactor (eg. a selector loop), in which case the executor is used.
+        '''
+        import asyncio
+        if not self.overlapped:
+            return None
+        # ProactorEventLoop keeps this private, but it is what asyncio's
+        # own windows pipe transports use.
+        proactor = getattr(asyncio.get_running_loop(), '_proactor', None)
+        if proactor is None:
+            return None
+        if self.proactor_pipe is None or self.proactor_pipe.handle is not self.pipe_file:
+            self.proactor_pipe = _Proactor_Pipe(self.pipe_file)
+        return proactor
+
+
+    def Overlapped_Error(self, ex, funcname):
+        '''
+        Returns a Pipe_Error for an OSError raised by a proactor call.
+        '''
+        # Interrupted calls are aborted, which the proactor reports as a
+        # reset connection.
+        if self.interrupted:
+            code = ERROR_OPERATION_ABORTED
+        else:
+            code = getattr(ex, 'winerror', None) or ERROR_BROKEN_PIPE
+        return Pipe_Error(code, funcname, ex.strerror or str(ex))
+
+
+    async def Connect_Async(self):
+        proactor = self.Get_Proactor()
+        if proactor is None:
+            return await super().Connect_Async()
+        self.Check_Interrupted()
+        try:
+            await proactor.accept_pipe(self.proactor_pipe)
+        except OSError as ex:
+            raise self.Overlapped_Error(ex, 'ConnectNamedPipe')
+        # Prepare for the next reconnect.
+        if self.use_standby:
+            self.Create_Standby()
+        return
+
+
+    async def Read_View_Async(self):
+        proactor = self.Get_Proactor()
+        if proactor is None:
+            return await super().Read_View_Async()
+        self.Check_Interrupted()
+        try:
+            size = await proactor.recv_into(self.proactor_pipe, self.read_buffer)
+        except OSError as ex:
+            raise self.Overlapped_Error(ex, 'ReadFile')
+        # The proactor returns 0 bytes for a broken pipe.
+        if not size:
+            raise Pipe_Error(ERROR_BROKEN_PIPE, 'ReadFile', 'Pipe has been ended')
+        return memoryview(self.read_buffer)[:size]
+
+
+    async def Write_Async(self, data):
+        proactor = self.Get_Proactor()
+        if proactor is None:
+            return await super().Write_Async(data)
+        self.Check_Interrupted()
+        try:
+            await proactor.send(self.proactor_pipe, data)
+        except OSError as ex:
+            raise self.Overlapped_Error(ex, 'WriteFile')
+        return
+
+
+    def Set_Blocking(self, blocking):
+        self.blocking = blocking
+        win32pipe.SetNamedPipeHandleState(
+            self.pipe_file,
+            win32pipe.PIPE_READMODE_MESSAGE
+            | (win32pipe.PIPE_WAIT if blocking else win32pipe.PIPE_NOWAIT),
+            None,
+            None)
+        return
+
+
+    def Get_Client_Executable(self) -> Path:
+        proc_handle = None
+        try:
+            proc_id = win32pipe.GetNamedPipeClientProcessId(self.pipe_file)
+            proc_handle = win32api.OpenProcess(
+                win32con.PROCESS_QUERY_INFORMATION,# | win32con.PROCESS_VM_READ,
+                False,
+                proc_id)
+            exe_path_name = win32process.GetModuleFileNameEx(proc_handle,0)
+        except Exception as ex:
+            print(f'Get_Client_Executable failed with exception: {ex}')
+            exe_path_name = ''
+        finally:
+            # Close the handle if open.
+            if proc_handle is not None:
+                win32api.CloseHandle(proc_handle)
+        return Path(exe_path_name)
+
+
+    def Close(self):
+        if self.is_server:
+            # The routine for closing is described here:
+            # https://docs.microsoft.com/en-us/windows/win32/ipc/named-pipe-operations
+            win32file.FlushFileBuffers(self.pipe_file)
+            win32pipe.DisconnectNamedPipe(self.pipe_file)
+        win32file.CloseHandle(self.pipe_file)
+        return
+
+
+    # Access right needed by CancelSynchronousIo.
+    THREAD_TERMINATE = 0x0001
+
+    def Interrupt(self):
+        self.interrupted = True
+        # Overlapped calls, sync or async, are cancelled through the
+        # handle from any thread, raising ERROR_OPERATION_ABORTED.
+        if self.overlapped:
+            if self.pipe_file is not None:
+                Get_Kernel32().CancelIoEx(int(self.pipe_file), None)
+            return
+        # Synchronous pipe calls can only be cancelled per thread, which
+        # pywin32 doesn't wrap, so go through kernel32. The blocked call
+        # then raises ERROR_OPERATION_ABORTED.
+        thread_id = self.io_thread_id
+        if thread_id is None:
+            return
+        kernel32 = ctypes.windll.kernel32
+        thread_handle = kernel32.OpenThread(self.THREAD_TERMINATE, False, thread_id)
+        if thread_handle:
+            # Fails harmlessly if the thread isn't blocked right now.
+            kernel32.CancelSynchronousIo(thread_handle)
+            kernel32.CloseHandle(thread_handle)
+        return
+
+
+class Unix_Socket_Transport(Transport):
+    '''
+    Transport using unix domain sockets of SOCK_SEQPACKET type, which
+    preserve message boundaries like windows message mode pipes.
+    Sockets are placed in a shared directory, given by the X4_PIPE_DIR
+    environment variable, else "x4_pipes" in the system temp folder.
+
+    Socket errors are translated to Pipe_Error exceptions using the
+    equivalent windows error codes.
+
+    The standby server end is the listening socket itself, kept open after
+    a client connects (and after Close) so a reconnecting client waits in
+    its backlog until the restarted server accepts it.
+
+    Attributes:
+    * listen_socket
+      - Socket accepting connections, for servers.
+    * conn
+      - Connected socket used for reads and writes.
+    '''
+    def __init__(self, *args, **kwargs):
+        if not hasattr(socket, 'AF_UNIX'):
+            raise RuntimeError('Unix domain sockets not supported on this OS')
+        super().__init__(*args, **kwargs)
+        self.listen_socket = None
+        self.conn = None
+        self.read_view = memoryview(self.read_buffer)
+        return
+
+    def Get_Pipe_Path(self, pipe_name):
+        pipe_dir = os.environ.get('X4_PIPE_DIR',
+                                  Path(tempfile.gettempdir()) / 'x4_pipes')
+        return str(Path(pipe_dir) / pipe_name)
+
+
+    def _New_Socket(self):
+        '''
+        Returns a new seqpacket socket, with buffers sized to fit the
+        largest message.
+        '''
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        # Note: linux doubles these internally for bookkeeping overhead.
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.buffer_size)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.buffer_size)
+        return sock
+
+
+    def Open_Server(self):
+        # Adopt the listening socket kept from the last connection.
+        if self.use_standby:
+            self.listen_socket = _Take_Standby(self)
+            if self.listen_socket is not None:
+                if self.verbose:
+                    print(f'Using standby socket for {self.pipe_path}')
+                return
+
+        Path(self.pipe_path).parent.mkdir(parents = True, exist_ok = True)
+
+        # A leftover socket file may exist from a server that exited
+        # without cleanup. Probe it: if something answers, another server
+        # owns this pipe, else the file is stale and can be removed.
+        if os.path.exists(self.pipe_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            try:
+                probe.connect(self.pipe_path)
+                raise Pipe_Error(ERROR_PIPE_BUSY, 'bind',
+                                 'Pipe is in use by another server')
+            except OSError:
+                os.unlink(self.pipe_path)
+            finally:
+                probe.close()
+
+        self.listen_socket = self._New_Socket()
+        try:
+            self.listen_socket.bind(self.pipe_path)
+        except OSError as ex:
+            self.listen_socket.close()
+            raise Pipe_Error(ERROR_PIPE_BUSY, 'bind', ex.strerror)
+        # Single client, matching nMaxInstances of the windows pipes.
+        self.listen_socket.listen(1)
+        return
+
+
+    def Connect(self):
+        self.Check_Interrupted()
+        try:
+            self.conn, _ = self.listen_socket.accept()
+        except OSError as ex:
+            # Eg. the socket was shut down by Interrupt.
+            raise Pipe_Error(ERROR_OPERATION_ABORTED if self.interrupted
+                             else ERROR_BROKEN_PIPE, 'accept', ex.strerror)
+        if self.use_standby:
+            _Put_Standby(self, self.listen_socket)
+        return
+
+
+    @staticmethod
+    def Close_Standby(handle, pipe_path):
+        handle.close()
+        try:
+            os.unlink(pipe_path)
+        except OSError:
+            pass
+        return
+
+
+    def Open_Client(self):
+        self.conn = self._New_Socket()
+        try:
+            self.conn.connect(self.pipe_path)
+        except OSError as ex:
+            self.conn.close()
+            self.conn = None
+            raise Pipe_Error(ERROR_PIPE_BUSY, 'connect', ex.strerror)
+        return
+
+
+    def Read_View(self):
+        self.Check_Interrupted()
+        try:
+            size, _, flags, _ = self.conn.recvmsg_into([self.read_view])
+        except BlockingIOError:
+            return None
+        except OSError as ex:
+            raise Pipe_Error(ERROR_BROKEN_PIPE, 'recv', ex.strerror)
+
+        # An empty read means the other end closed the connection (or
+        # Interrupt shut it down).
+        if not size:
+            self.Check_Interrupted()
+            raise Pipe_Error(ERROR_BROKEN_PIPE, 'recv', 'Pipe has been ended')
+        # Oversized messages would otherwise be silently truncated.
+        if flags & socket.MSG_TRUNC:
+            raise Pipe_Error(ERROR_MORE_DATA, 'recv',
+                             'Message larger than buffer_size')
+        return self.read_view[:size]
+
+
+    def Write(self, data):
+        try:
+            self.conn.send(data)
+        except BlockingIOError:
+            # Only possible in non-blocking mode; treat as a full pipe.
+            raise Pipe_Error(ERROR_PIPE_BUSY, 'send', 'Pipe is full')
+        except OSError as ex:
+            raise Pipe_Error(ERROR_BROKEN_PIPE, 'send', ex.strerror)
+        return
+
+
+    def Set_Blocking(self, blocking):
+        self.conn.setblocking(blocking)
+        return
+
+
+    async def Connect_Async(self):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        self.Check_Interrupted()
+        self.listen_socket.setblocking(False)
+        try:
+            self.conn, _ = await loop.sock_accept(self.listen_socket)
+        except OSError as ex:
+            raise Pipe_Error(ERROR_OPERATION_ABORTED if self.interrupted
+                             else ERROR_BROKEN_PIPE, 'accept', ex.strerror)
+        if self.use_standby:
+            # Leave the listening socket blocking for a sync Connect.
+            self.listen_socket.setblocking(True)
+            _Put_Standby(self, self.listen_socket)
+        return
+
+
+    async def Read_View_Async(self):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        if self.conn.getblocking():
+            self.conn.setblocking(False)
+        while True:
+            view = self.Read_View()
+            if view is not None:
+                return view
+            # Sleep until the socket has something to read.
+            ready = loop.create_future()
+            fileno = self.conn.fileno()
+            loop.add_reader(fileno, lambda: ready.done() or ready.set_result(None))
+            try:
+                await ready
+            finally:
+                loop.remove_reader(fileno)
+
+
+    async def Write_Async(self, data):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        if self.conn.getblocking():
+            self.conn.setblocking(False)
+        try:
+            await loop.sock_sendall(self.conn, data)
+        except OSError as ex:
+            raise Pipe_Error(ERROR_BROKEN_PIPE, 'send', ex.strerror)
+        return
+
+
+    def Get_Client_Executable(self) -> Path:
+        try:
+            # Credentials are a struct of (pid, uid, gid).
+            creds = self.conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                                         struct.calcsize('3i'))
+            proc_id = struct.unpack('3i', creds)[0]
+            exe_path_name = os.readlink(f'/proc/{proc_id}/exe')
+        except Exception as ex:
+            print(f'Get_Client_Executable failed with exception: {ex}')
+            exe_path_name = ''
+        return Path(exe_path_name)
+
+
+    def Close(self):
+        if self.conn is not None:
+            self.conn.close()
+        # The standby listening socket stays open for the next server.
+        if (self.listen_socket is not None
+        and not _Is_Standby(self, self.listen_socket)):
+            self.listen_socket.close()
+            # Remove the socket file, so clients see the pipe as gone.
+            try:
+                os.unlink(self.pipe_path)
+            except OSError:
+                pass
+        return
+
+
+    def Interrupt(self):
+        self.interrupted = True
+        # Shutting down a socket wakes any thread blocked on it, unlike
+        # closing it. If not yet connected, this stops the accept, at the
+        # cost of the listening socket (the next server makes a new one).
+        sock = self.conn if self.conn is not None else self.listen_socket
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        return
+
+
+# Available transports, keyed by name.
+transports = {
+    'win_pipe'    : Win_Pipe_Transport,
+    'unix_socket' : Unix_Socket_Transport,
+    }
+
+# Name of the transport used when a Pipe doesn't specify one.
+default_transport_name = os.environ.get(
+    'X4_PIPE_TRANSPORT',
+    'win_pipe' if sys.platform == 'win32' else 'unix_socket')
+
+
+def Set_Default_Transport(name):
+    '''
+    Set the transport used by Pipes that don't specify one.
+    '''
+    global default_transport_name
+    if name not in transports:
+        raise ValueError(f'Unknown pipe transport: {name}')
+    default_transport_name = name
+    # Set the environment as well, so that child processes match.
+    os.environ['X4_PIPE_TRANSPORT'] = name
+    return
+
+
+def Get_Transport_Class(name = None):
+    '''
+    Returns the Transport subclass for the given name, or the default
+    if no name given.
+    '''
+    if name is None:
+        name = default_transport_name
+    if name not in transports:
+        raise ValueError(f'Unknown pipe transport: {name}')
+    return transports[name]
@@ -2,5 +2,30 @@
 Support classes for the python server.
 '''
 from .Server_Thread import Server_Thread
-from .Misc import Client_Garbage_Collected
-from .Pipe import Pipe_Server, Pipe_Client
\ No newline at end of file
+from .Supervisor import Supervisor
+from .Server_Process import Server_Process
+from .Module_Cache import Load_Module, Set_Cache_Dir, Get_Module_Name
+from .Module_Watcher import Module_Watcher
+from .Extension_Index import Extension_Index
+from .Misc import Client_Garbage_Collected, Pipe_Error, Server_Cancelled, Cancel_Token
+from .Pipe import Pipe_Server, Pipe_Client
+from .Async_Pipe import Async_Pipe_Server, Async_Pipe_Client
+from .Ring_Buffer import Ring_Buffer
+from .Pipe_Stats import Enable_Stats, Format_Stats, Histogram
+from .Quantile_Sketch import Quantile_Sketch
+from .Server_Stats import Enable_Server_Stats, Server_Stats_Sampler
+from .Server_Profiler import Enable_Profiling, profile_modes
+from .Pipe_Recorder import Enable_Recording, Read_Recording, Replayer
+from .Game_Clock import Game_Clock, Get_Game_Clock
+from .Transport import pipe_errors, Is_Disconnect_Error, Is_Create_Error, Is_Interrupt_Error
+from .Transport import Describe_Error, Set_Default_Transport, transports
+
+def __getattr__(name):
+    '''
+    Import Async_Server_Host on first access, since it loads asyncio,
+    which is slow to import and unused unless the async host is requested.
+    '''
+    if name == 'Async_Server_Host':
+        from .Async_Host import Async_Server_Host
+        return Async_Server_Host
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
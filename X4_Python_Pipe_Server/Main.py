@@ -25,7 +25,10 @@ TODO: change permissions to be folder name based instead of id based.
 
 TODO: maybe permissions from json to ini format.
 
-TODO: maybe use multiprocessing instead of threading.
+Servers run in threads by default. Modules may instead ask to run in
+their own process (see Server_Process), by setting "run_in_process = True",
+which permissions.json can override per module path, eg:
+    "run_in_process": {"extensions/some_ext/python/Server.py": false}
 
 TODO: think of a safe, scalable way to handle restarting threads,
 particularly subthreads that a user server thread may have started,
@@ -33,19 +36,13 @@ which might get orphaned when that thread function exceptions out
 on pipe closure.  (Currently pipe servers are responsible for
 restarting their own subthreads.)
 
-TODO: rethink server restart behavior; perhaps they should not auto-restart,
-but instead be fully killed when the x4 pipe closes, and then only
-restarted when x4 MD api requests the restart. In this way, mods can change
-their python side code on the fly, reload their save, and the new code
-would get loaded.
-(The md api would need to re-announce servers whenever the game or ui reloads,
-as well as whenever the server resets.)
-(Perhaps this is less robust in some way?)
-(Manual effort needed to clean out the imported packages, similar to what
-is done in some gui code for rerunning scripts.)
-Overall, it is probably reasonably easy for developers to just shut down
-this host server and restart it, if they want to update their server code;
-x4 side should automatically reconnect.
+Server code changes during development can be picked up without
+restarting the host by running with "--watch": loaded module files are
+polled for changes, and a changed module has its server closed, its
+user_module_* entry dropped from sys.modules, and is then reimported and
+restarted. The host pipe stays up throughout, and x4 reconnects to the
+restarted server as after a save reload. Packages imported by the module
+itself are not reloaded.
 '''
 r'''
 Debug test args (for convenient swapping out):
@@ -56,13 +53,17 @@ Debug test args (for convenient swapping out):
 # in the change_log. This line should always start "version =".
 version = '1.4.3'
 
+# Startup timing for --startup-report starts here, so time is imported
+# ahead of everything else.
+import time
+startup_start = time.perf_counter()
+
 # Setup include path to this package.
 import sys
 import json
 from pathlib import Path
 from collections import defaultdict
 import argparse
-import time
 
 # To support packages cross-referencing each other, set up this
 # top level as a package, findable on the sys path.
@@ -86,20 +87,28 @@ if str(home_path) not in sys.path:
     
 #from X4_Python_Pipe_Server.Servers import Test1
 #from X4_Python_Pipe_Server.Servers import Send_Keys
+# Note: Async_Server_Host is imported when requested, as it loads asyncio,
+# which is slow to import.
 from X4_Python_Pipe_Server.Classes import Server_Thread
+from X4_Python_Pipe_Server.Classes import Server_Process
 from X4_Python_Pipe_Server.Classes import Pipe_Server, Pipe_Client
 from X4_Python_Pipe_Server.Classes import Client_Garbage_Collected
-import win32api
-import winerror
-import win32file
-import win32pipe
+from X4_Python_Pipe_Server.Classes import pipe_errors, Is_Disconnect_Error
+from X4_Python_Pipe_Server.Classes import Is_Create_Error, Describe_Error
+from X4_Python_Pipe_Server.Classes import Set_Default_Transport, transports
+from X4_Python_Pipe_Server.Classes import Enable_Stats, Format_Stats
+from X4_Python_Pipe_Server.Classes import Enable_Server_Stats, Server_Stats_Sampler
+from X4_Python_Pipe_Server.Classes import Enable_Profiling, profile_modes
+from X4_Python_Pipe_Server.Classes import Enable_Recording
+from X4_Python_Pipe_Server.Classes import Load_Module, Set_Cache_Dir
+from X4_Python_Pipe_Server.Classes import Get_Module_Name, Module_Watcher
+from X4_Python_Pipe_Server.Classes import Extension_Index
 import threading
 import traceback
 
-# Note: in other projects importlib.machinery could be used directly,
-# but appears to be failing when pyinstalling this package, so do
-# a more directly import of machinery.
-from importlib import machinery
+# Seconds taken by each startup phase, for --startup-report, starting
+# with the imports above.
+startup_times = {'imports' : time.perf_counter() - startup_start}
 
 # Flag to use during development, for extra exception throws.
 developer = False
@@ -107,6 +116,35 @@ developer = False
 # Name of the host pipe.
 pipe_name = 'x4_python_host'
 
+# Capabilities announced to x4 on the host pipe after it connects, as
+# "capabilities:<comma separated names>". Lua only sends framing control
+# messages (and typed messages) to servers once the host announces them,
+# since older hosts (before 1.5) would read those as text. Older lua just
+# ignores the announcement.
+# * framing - servers handle control, batch and chunk messages.
+# * typed   - servers decode typed codec messages.
+host_capabilities = ['framing', 'typed']
+
+# Seconds to wait for a server to stop when hot reloading it.
+reload_timeout = 5
+
+# Seconds to wait for all servers to stop on a host restart or shutdown.
+shutdown_timeout = 5
+
+# Threads of the host itself are named with this prefix, so they aren't
+# reported as leaked by servers.
+host_thread_prefix = 'x4_host'
+
+# Announced modules are imported and started concurrently, on up to this
+# many threads, so one slow import doesn't hold up the rest.
+import_workers = 8
+
+# Count of resets, which close all servers. Imports still running from
+# announcements before a reset check this (under import_lock) before
+# starting their server, so they don't start one after the close.
+import_generation = 0
+import_lock = threading.Lock()
+
 # Loaded permissions from pipe_permissions.json.
 permissions = None
 # Permissions can be placed alongside the exe or Main.py.
@@ -114,6 +152,9 @@ permissions = None
 # Go with the exe/main directory.
 permissions_path = main_path / 'permissions.json'
 
+# Index of the extensions of the connected x4 install, for permissions.
+extension_index = Extension_Index()
+
 class Reset_Requested (Exception):
     '''
     Custom exception thrown on a reset request from a client.
@@ -156,12 +197,122 @@ def Main():
         help =  'Path to a specific python module to run in test mode,'
                 ' relative to the x4-path.' )
     
+    argparser.add_argument(
+        '--transport',
+        default = None,
+        choices = list(transports.keys()),
+        help =  'Pipe transport used by the host and all servers. Defaults to'
+                ' windows named pipes on windows (as used by x4), else unix'
+                ' domain sockets, for running servers on other systems.' )
+
+    argparser.add_argument(
+        '--async-host',
+        action='store_true',
+        help =  'Run all extension servers from a single asyncio event loop.'
+                ' Servers with an "async def main" run as tasks on the loop;'
+                ' others run on its thread executor.' )
+
+    argparser.add_argument(
+        '--pipe-stats',
+        nargs = '?',
+        const = 0,
+        default = None,
+        type = float,
+        metavar = 'Seconds',
+        help =  'Collect message counts and read/write latency histograms for'
+                ' every pipe, printed when the host receives a "stats"'
+                ' command, and every given number of seconds if provided.' )
+
+    argparser.add_argument(
+        '--server-stats',
+        nargs = '?',
+        const = 0,
+        default = None,
+        type = float,
+        metavar = 'Seconds',
+        help =  'Account cpu time, messages handled and handler times per'
+                ' extension server, printed as a one-line summary every given'
+                ' number of seconds if provided. A "server_stats" command'
+                ' prints the summary and writes a json snapshot next to the'
+                ' permissions file.' )
+
+    argparser.add_argument(
+        '--profile-servers',
+        nargs = '*',
+        default = None,
+        metavar = 'Name',
+        help =  'Profile the named extension servers (module file names, eg.'
+                ' "Send_Keys"), or all if no names given. Profiles are written'
+                ' to a "profiles" folder next to the permissions file whenever'
+                ' a server restarts or the host exits.' )
+
+    argparser.add_argument(
+        '--profile-mode',
+        choices = profile_modes,
+        default = 'sample',
+        help =  'Profiler used by --profile-servers: "sample" (default)'
+                ' periodically samples server stacks with low overhead,'
+                ' writing collapsed stack files for flame graphs; "cprofile"'
+                ' traces every call, writing pstats files.' )
+
+    argparser.add_argument(
+        '--record-pipes',
+        nargs = '*',
+        default = None,
+        metavar = 'Pipe_Name',
+        help =  'Record all messages of the named pipes (eg. "x4_measure_fps"),'
+                ' or all pipes if no names given, to a "recordings" folder next'
+                ' to the permissions file, for replaying with'
+                ' Benchmarks/Replay_Session.py.' )
+
+    argparser.add_argument(
+        '--startup-report',
+        action='store_true',
+        help =  'Print the time taken by each startup phase once the first'
+                ' pipe client connects: interpreter launch, imports,'
+                ' permissions load, pipe creation, and the wait for the'
+                ' connection.' )
+
+    argparser.add_argument(
+        '--watch',
+        nargs = '?',
+        const = 1.0,
+        default = None,
+        type = float,
+        metavar = 'Seconds',
+        help =  'Watch loaded extension modules for changes, checking every'
+                ' given number of seconds (default 1), and reload and restart'
+                ' the servers of changed modules.' )
+
+    argparser.add_argument(
+        '--no-module-cache',
+        action='store_true',
+        help =  'Always compile extension modules from source, instead of'
+                ' using the compiled code cache kept next to the permissions'
+                ' file.' )
+
     argparser.add_argument(
         '-v', '--verbose',
         action='store_true',
         help =  'Print extra messages.' )
        
     args = argparser.parse_args(sys.argv[1:])
+
+    # Threads running before any servers, to tell apart leaked ones.
+    baseline_threads = set(threading.enumerate())
+
+    if args.transport:
+        Set_Default_Transport(args.transport)
+
+    # Stats need to be enabled before pipes are created.
+    if args.pipe_stats is not None:
+        Enable_Stats()
+        if args.pipe_stats > 0:
+            threading.Thread(
+                target = Print_Stats_Periodically,
+                args = (args.pipe_stats,),
+                name = host_thread_prefix + '_stats',
+                daemon = True).start()
     
     if args.permissions_path:
         global permissions_path
@@ -171,6 +322,28 @@ def Main():
             print('Error: permissions_path directory not found')
             return
 
+    # Server accounting needs enabling before servers are started; the
+    # periodic printout is set up once servers exist.
+    if args.server_stats is not None:
+        Enable_Server_Stats()
+
+    # Profiling also needs enabling before servers are started.
+    if args.profile_servers is not None:
+        Enable_Profiling(
+            permissions_path.parent / 'profiles',
+            names = args.profile_servers,
+            mode = args.profile_mode)
+
+    # Recording needs enabling before pipes are created.
+    if args.record_pipes is not None:
+        Enable_Recording(
+            permissions_path.parent / 'recordings',
+            names = args.record_pipes)
+
+    # Cache compiled modules alongside the permissions.
+    if not args.no_module_cache:
+        Set_Cache_Dir(permissions_path.parent / 'module_cache')
+
     # Check if running in test mode.
     test_python_client = False
     if args.test:
@@ -198,16 +371,45 @@ def Main():
             return
 
 
-    # List of directly launched threads.
-    threads = []
-    # List of relative path strings received from x4, to python server
+    # Directly launched servers, keyed by module relative path.
+    servers = {}
+    # Event loop host for the servers, if requested.
+    async_host = None
+    if args.async_host:
+        from X4_Python_Pipe_Server.Classes import Async_Server_Host
+        async_host = Async_Server_Host()
+    # Set of relative paths received from x4, to python server
     # modules that have been loaded before.
-    module_relpaths = []
+    module_relpaths = set()
+    # Threads importing and starting announced modules, made when the
+    # first module is announced.
+    import_pool = None
 
     print('X4 Python Pipe Server v{}\n'.format(version))
 
     # Load permissions, if the permissions file found.
+    start = time.perf_counter()
     Load_Permissions()
+    startup_times['permissions'] = time.perf_counter() - start
+
+    # Print server accounting periodically, if requested.
+    server_stats_sampler = Server_Stats_Sampler()
+    if args.server_stats:
+        threading.Thread(
+            target = Print_Server_Stats_Periodically,
+            args = (args.server_stats, servers),
+            name = host_thread_prefix + '_server_stats',
+            daemon = True).start()
+
+    # Poll loaded modules for changes, if requested.
+    watcher = None
+    if args.watch is not None:
+        watcher = Module_Watcher()
+        threading.Thread(
+            target = Watch_Modules,
+            args = (watcher, args.watch, servers, async_host, test_python_client),
+            name = host_thread_prefix + '_watch',
+            daemon = True).start()
 
     # Put this into a loop, to keep rebooting the server when the
     # pipe gets disconnected (eg. x4 loaded a save).
@@ -218,16 +420,26 @@ def Main():
         # TODO: maybe reuse Server_Thread somehow, though don't actually
         # want a separate thread for this.
         try:
+            start = time.perf_counter()
             pipe = Pipe_Server(pipe_name, verbose = args.verbose)
+            if 'pipe creation' not in startup_times:
+                startup_times['pipe creation'] = time.perf_counter() - start
         
             # For python testing, kick off a client thread.
             if test_python_client:
                 # Set up the reader in another thread.
-                reader_thread = threading.Thread(target = Pipe_Client_Test, args = (args,))
+                reader_thread = threading.Thread(
+                    target = Pipe_Client_Test, args = (args,),
+                    name = host_thread_prefix + '_test_client')
                 reader_thread.start()
 
             # Wait for client.
+            start = time.perf_counter()
             pipe.Connect()
+            if 'first connect' not in startup_times:
+                startup_times['first connect'] = time.perf_counter() - start
+                if args.startup_report:
+                    Print_Startup_Report()
 
             # Clear out any old x4 path; the game may have shut down and
             # relaunched from a different location.
@@ -242,6 +454,14 @@ def Main():
                 if exe_path is not None:
                     x4_path = exe_path.parent
 
+            # Index the extensions once per connection; only changed
+            # content.xml files get reread.
+            if x4_path:
+                extension_index.Refresh(x4_path)
+
+            # Tell x4 what this host's pipes support.
+            pipe.Write('capabilities:' + ','.join(host_capabilities))
+
             # Listen to runtime messages, announcing relative paths to
             # python modules to load from extensions.
             while 1:
@@ -258,6 +478,19 @@ def Main():
                 # Handle restart requests similar to pipe disconnect exceptions.
                 elif message == 'restart':
                     raise Reset_Requested()
+
+                # Print a snapshot of the pipe stats.
+                elif message == 'stats':
+                    print(Format_Stats())
+
+                # Print server accounting, and save a snapshot.
+                elif message == 'server_stats':
+                    print(server_stats_sampler.Format_Summary(Get_Server_Stats(servers)))
+                    Write_Server_Stats(servers)
+
+                # Print the state of each server.
+                elif message == 'health':
+                    print(Format_Health(servers))
             
                 #-Removed; x4 7.5 no longer fills package.path with the game path.
                 #elif message.startswith('package.path:'):
@@ -304,6 +537,7 @@ def Main():
                     # This list will end with an empty entry, even if the message
                     # has no paths, so can throw away the last list item.
                     module_paths = [Path(x) for x in message.split(';')[:-1]]
+                    announce_time = time.perf_counter()
 
                     # Handle each path.
                     for module_path in module_paths:
@@ -324,27 +558,23 @@ def Main():
                             continue
 
                         # Record this path as seen.
-                        module_relpaths.append(module_path)
-
-                        # Import the module.
-                        module = Import(full_path)
-
-                        # Continue if the import succeeded.
-                        if module != None:
-                            # Pull out the main() function.
-                            main = getattr(module, 'main', None)
-
-                            # Start the thread.
-                            if main != None:
-                                print(f'Starting main() function of module: {full_path}.')
-                                thread = Server_Thread(module.main, test = test_python_client)
-                                threads.append(thread)
-                            else:
-                                print(f'Module lacks "main()": {module_path}')
-
-
-        except (win32api.error, Client_Garbage_Collected, Reset_Requested) as ex:
-            # win32api.error exceptions have the fields:
+                        module_relpaths.add(module_path)
+
+                        # Import and start the module in the background.
+                        if import_pool is None:
+                            from concurrent.futures import ThreadPoolExecutor
+                            import_pool = ThreadPoolExecutor(
+                                max_workers = import_workers,
+                                thread_name_prefix = host_thread_prefix + '_import')
+                        import_pool.submit(
+                            Import_And_Start,
+                            full_path, module_path, announce_time, servers,
+                            import_generation, watcher, async_host,
+                            test_python_client)
+
+
+        except pipe_errors + (Client_Garbage_Collected, Reset_Requested) as ex:
+            # Pipe errors (win32api.error or Pipe_Error) have the fields:
             #  winerror : integer error code (eg. 109)
             #  funcname : Name of function that errored, eg. 'ReadFile'
             #  strerror : String description of error
@@ -360,10 +590,18 @@ def Main():
                 
             elif isinstance(ex, Reset_Requested):
                 print('Client requested pipe restart, restarting.')
+                # Stop all servers, and forget their modules so that they
+                # are imported fresh when announced again. Imports still
+                # pending are left to finish, but won't start servers.
+                Reset_Imports()
+                Close_Servers(servers, baseline_threads)
+                module_relpaths.clear()
+                if watcher is not None:
+                    watcher.files.clear()
                 
             # If another host was already running, there will have been
             # an error when trying to set up the pipe.
-            elif ex.funcname == 'CreateNamedPipe':
+            elif Is_Create_Error(ex):
                 print('Pipe creation error. Is another instance already running?')
                 shutdown = True
                 
@@ -373,12 +611,12 @@ def Main():
             # Update: as of x4 3.0 or so, garbage collection started crashing
             #  the game, so this error is only expected when x4 shuts down
             #  entirely.
-            elif ex.winerror == winerror.ERROR_BROKEN_PIPE:
+            elif Is_Disconnect_Error(ex):
                 # Keep running the server.
                 print('Pipe client disconnected.')
 
             else:
-                print(f'Unhandled win32api error: {ex.winerror} in {ex.funcname} : {ex.strerror}')
+                print(f'Unhandled pipe error: {Describe_Error(ex)}')
                 shutdown = True
                 
             # This should now loop back and restart the pipe, if
@@ -386,6 +624,12 @@ def Main():
             if not shutdown:
                 print('Restarting host.')
             else:
+                # Stop everything, so the process can exit.
+                if import_pool is not None:
+                    import_pool.shutdown(cancel_futures = True)
+                Close_Servers(servers, baseline_threads)
+                if async_host is not None and not async_host.Close(shutdown_timeout):
+                    print('Async server host did not stop.')
                 # Pause before closing, so user can see the error.
                 input('Press <enter> to finish exiting...')
                 
@@ -402,15 +646,8 @@ def Main():
             except Exception as ex:
                 pass
             
-            # Let subthreads keep running; they internally loop.
-            #if threads:
-            #    print('Shutting down subthreads.')
-            ## Close all subthreads.
-            #for thread in threads:
-            #    thread.Close()
-            ## Wait for closures to complete.
-            #for thread in threads:
-            #    thread.Join()
+            # Let subthreads keep running across pipe disconnects; they
+            # internally loop. Restarts and shutdowns close them above.
 
 
 
@@ -449,17 +686,14 @@ def Import(full_path : Path):
     # If the path doesnt exist, send it to the loader anyway to trigger
     # a nice error message.
     try:
-        # Attempt to load/run the module.
-        module = machinery.SourceFileLoader(
-            # Provide the name sys will use for this module.
-            # Use the basename to get rid of any path, and prefix
-            #  to ensure the name is unique (don't want to collide
-            #  with other loaded modules).
-            'user_module_' + full_path.name.replace(' ','_'),
-            # Just grab the name; it should be found on included paths.
-            str(full_path)
-            ).load_module()
-        print('Imported {}'.format(full_path))
+        # Attempt to load/run the module, using compiled code from the
+        # module cache when still valid.
+        start = time.perf_counter()
+        module = Load_Module(full_path)
+        elapsed = time.perf_counter() - start
+        print('Imported {} in {:.1f} ms{}'.format(
+            full_path, elapsed * 1000,
+            ' (cached code)' if module.__loader__.cache_hit else ''))
                 
     except Exception as ex:
         module = None
@@ -484,6 +718,247 @@ def Import(full_path : Path):
     return module
 
 
+def Reset_Imports():
+    '''
+    Stop imports that are still running from earlier announcements from
+    starting their servers, ahead of closing the servers for a reset.
+    '''
+    global import_generation
+    with import_lock:
+        import_generation += 1
+    return
+
+
+def Import_And_Start(full_path, module_path, announce_time, servers,
+                     generation, watcher = None, async_host = None,
+                     test = False):
+    '''
+    Import an announced module and start its server, recording it in
+    servers (and the watcher, if given). Runs on the import pool, so
+    errors are reported here per module. The server isn't started if
+    the host was reset since the announcement (import_generation no
+    longer matches generation).
+    '''
+    try:
+        # Import the module.
+        module = Import(full_path)
+
+        # Continue if the import succeeded.
+        if module is None:
+            return
+        # Hold the lock until the server is recorded, so a reset can't
+        # close the servers in between.
+        with import_lock:
+            if generation != import_generation:
+                print(f'Not starting {module_path}; host was reset since its announcement.')
+                return
+            server = Start_Server(module, module_path, async_host, test)
+            if server is not None:
+                servers[module_path] = server
+                print('Server for {} started {:.1f} ms after announcement.'.format(
+                    module_path, (time.perf_counter() - announce_time) * 1000))
+            # Watch the file actually loaded (maybe a .txt).
+            if watcher is not None:
+                watcher.Add(module_path, module.__file__)
+
+    except Exception as ex:
+        print(f'Failed to start {full_path}')
+        print(f'Exception of type "{type(ex).__name__}" encountered.\n')
+        ex_text = str(ex)
+        if ex_text:
+            print(ex_text)
+        if developer:
+            print(traceback.format_exc())
+    return
+
+
+def Start_Server(module, module_path, async_host = None, test = False):
+    '''
+    Start the server for an imported module, running its main() function
+    in a thread, process or async host task as appropriate.
+    Returns the server object, or None if the module lacks main().
+    '''
+    # Pull out the main() function.
+    main = getattr(module, 'main', None)
+    if main is None:
+        print(f'Module lacks "main()": {module_path}')
+        return None
+
+    print(f'Starting main() function of module: {module.__file__}.')
+    if Get_Run_In_Process(module, module_path):
+        # Reimport in the child from the path actually loaded (maybe a .txt).
+        return Server_Process(module.__file__, test = test)
+    if async_host:
+        return async_host.Start_Server(main, test = test)
+    return Server_Thread(main, test = test)
+
+
+def Watch_Modules(watcher, interval, servers, async_host = None, test = False):
+    '''
+    Poll the watched modules every interval seconds, reloading any that
+    changed. Meant to run in a daemon thread.
+    '''
+    while True:
+        time.sleep(interval)
+        for module_path, file_path in watcher.Poll():
+            try:
+                Reload_Module(module_path, file_path, servers, async_host, test)
+            except Exception as ex:
+                # Keep watching other modules regardless.
+                print(f'Error reloading {file_path}: {type(ex).__name__}: {ex}')
+                if developer:
+                    print(traceback.format_exc())
+
+
+def Reload_Module(module_path, file_path, servers, async_host = None, test = False):
+    '''
+    Stop the server of a changed module, reimport the module, and start
+    its new server. The old server is left running if the new code
+    doesn't compile, or if it doesn't stop within reload_timeout.
+    '''
+    print(f'Module changed, reloading: {file_path}')
+
+    # Catch syntax errors from a bad (or partial) save before stopping
+    # anything.
+    try:
+        compile(Path(file_path).read_bytes(), str(file_path), 'exec')
+    except Exception as ex:
+        print(f'Not reloading, due to {type(ex).__name__}: {ex}')
+        return
+
+    server = servers.pop(module_path, None)
+    if server is not None:
+        server.Close()
+        if not server.Join(reload_timeout):
+            # Keep it, so a later change can try again.
+            servers[module_path] = server
+            print(f'Server did not stop within {reload_timeout} s; not reloading.'
+                  ' (Servers blocked on something other than their pipes'
+                  ' cannot be stopped.)')
+            return
+
+    # Drop the old module, so the import runs it fresh.
+    sys.modules.pop(Get_Module_Name(file_path), None)
+    module = Import(Path(file_path))
+    if module is not None:
+        server = Start_Server(module, module_path, async_host, test)
+        if server is not None:
+            servers[module_path] = server
+    return
+
+
+def Close_Servers(servers, baseline_threads, timeout = None):
+    '''
+    Close all servers, waiting up to timeout seconds in total for them to
+    stop (default shutdown_timeout), and report any that didn't along
+    with threads left running that the host didn't start.
+    Servers are removed from the servers dict.
+    '''
+    if timeout is None:
+        timeout = shutdown_timeout
+    if not servers:
+        return
+    print(f'Stopping {len(servers)} servers.')
+
+    # Take the servers out first, since imports may still add to it.
+    closing = {}
+    for module_path in list(servers):
+        closing[module_path] = servers.pop(module_path)
+
+    # Signal all at once, then wait on them in turn.
+    for server in closing.values():
+        server.Close()
+    deadline = time.perf_counter() + timeout
+    for module_path, server in closing.items():
+        if not server.Join(max(0, deadline - time.perf_counter())):
+            print(f'Server for {module_path} did not stop within {timeout} s.')
+
+    # Anything else still running was started by a server, and is leaked.
+    leaked = [x for x in threading.enumerate()
+              if x not in baseline_threads
+              and not x.name.startswith(host_thread_prefix)]
+    if leaked:
+        print('Threads left running by servers: {}'.format(
+            ', '.join(x.name for x in leaked)))
+    return
+
+
+def Format_Health(servers):
+    '''
+    Returns a printable multi-line summary of the health of the servers,
+    with the last error of any that are failed or restarting.
+    '''
+    if not servers:
+        return 'No servers running.'
+    lines = ['Server health:']
+    for module_path, server in list(servers.items()):
+        health = server.Get_Health()
+        line = f'  {module_path}: {health["state"]}'
+        if health['uptime'] is not None:
+            line += ', up {:.0f} s'.format(health['uptime'])
+        if health['restarts']:
+            line += f', {health["restarts"]} restarts'
+        if health['crashes']:
+            line += f', {health["crashes"]} crashes'
+        lines.append(line)
+        if health['last_error'] and health['state'] in ('failed', 'restarting'):
+            lines.append('    Last error: ' + health['last_error'].rstrip().replace('\n', '\n    '))
+    return '\n'.join(lines)
+
+
+def Get_Process_Age():
+    '''
+    Returns the seconds since this process was launched, or None if not
+    available. For a onefile exe, this is since the launch of the
+    bootloader process that unpacked it.
+    '''
+    # psutil is optional, and only imported here to keep it out of
+    # normal startup.
+    try:
+        import psutil
+        process = psutil.Process()
+        # Onefile exes run unpacked in a temp folder, as a child of the
+        # bootloader.
+        if (getattr(sys, 'frozen', False)
+        and Path(sys._MEIPASS) != Path(sys.executable).parent):
+            process = process.parent() or process
+        return time.time() - process.create_time()
+    except Exception:
+        pass
+    # Fall back on the process start time in linux, in clock ticks
+    # since boot.
+    try:
+        import os
+        stat = Path('/proc/self/stat').read_text()
+        start_ticks = int(stat.rsplit(')', 1)[1].split()[19])
+        return (time.clock_gettime(time.CLOCK_BOOTTIME)
+                - start_ticks / os.sysconf('SC_CLK_TCK'))
+    except (OSError, AttributeError, ValueError, IndexError):
+        return None
+
+
+def Print_Startup_Report():
+    '''
+    Print the time taken by each startup phase, from startup_times, with
+    the interpreter launch time being that from the process launch up to
+    the start of Main.py.
+    '''
+    elapsed = time.perf_counter() - startup_start
+    process_age = Get_Process_Age()
+    phases = {'interpreter' : None if process_age is None else process_age - elapsed}
+    phases.update(startup_times)
+
+    lines = ['Startup report:']
+    for name, seconds in phases.items():
+        lines.append('  {:<15} {}'.format(
+            name, 'n/a' if seconds is None else '{:.1f} ms'.format(seconds * 1000)))
+    # The connect wait includes however long the client took to start.
+    lines.append('  {:<15} {:.1f} ms'.format(
+        'total', (elapsed if process_age is None else process_age) * 1000))
+    print('\n'.join(lines))
+    return
+
+
 def Load_Permissions():
     '''
     Loads the permissions json file, or creates one if needed.
@@ -525,14 +1000,12 @@ def Check_Permission(x4_path, module_path):
         # second folder. Use negative indexing to go backwards, eg.
         # -1 is ".", -2 is "extensions", -3 is the extension folder.
         # (Note: pathlib is dumb and doesn't allow negative indices on parents.)
-        ext_dir = x4_path / [x for x in module_path.parents][-3]
-
-        # Load the content.xml. Can do xml or raw text; text should
-        # be good enough for now (avoid adding lxml to the exe).
-        content_text = (ext_dir / 'content.xml').read_text()
+        ext_dir = [x for x in module_path.parents][-3]
 
-        # The first id="..." should be the extension id.
-        content_id = content_text.split('id="')[1].split('"')[0]
+        # Look up the extension's content.xml details.
+        if extension_index.x4_path != x4_path:
+            extension_index.Refresh(x4_path)
+        content_id = extension_index.Get(ext_dir.name).content_id
 
         # Check its permission.
         if permissions.get(content_id) == True:
@@ -558,6 +1031,69 @@ def Check_Permission(x4_path, module_path):
         return False
 
 
+def Print_Stats_Periodically(interval):
+    '''
+    Print the pipe stats every interval seconds, forever.
+    Meant to run in a daemon thread.
+    '''
+    while True:
+        time.sleep(interval)
+        print(Format_Stats())
+
+
+def Get_Server_Stats(servers):
+    '''
+    Returns a list of the Server_Stats of the servers that have them.
+    '''
+    return [x.stats for x in list(servers.values())
+            if getattr(x, 'stats', None) is not None]
+
+
+def Print_Server_Stats_Periodically(interval, servers):
+    '''
+    Print a one-line server accounting summary every interval seconds,
+    forever. Meant to run in a daemon thread.
+    '''
+    sampler = Server_Stats_Sampler()
+    while True:
+        time.sleep(interval)
+        print(sampler.Format_Summary(Get_Server_Stats(servers)))
+
+
+def Write_Server_Stats(servers):
+    '''
+    Write a json snapshot of the server accounting and health, next to
+    the permissions file.
+    '''
+    snapshot = {}
+    for module_path, server in list(servers.items()):
+        entry = {'health': server.Get_Health()}
+        stats = getattr(server, 'stats', None)
+        if stats is not None:
+            entry['stats'] = stats.Get_Snapshot()
+        snapshot[Path(module_path).as_posix()] = entry
+    path = permissions_path.parent / 'server_stats.json'
+    try:
+        with open(path, 'w') as file:
+            json.dump(snapshot, file, indent = 2)
+        print(f'Wrote server stats to {path}')
+    except OSError as ex:
+        print(f'Failed to write server stats to {path}: {ex}')
+    return
+
+
+def Get_Run_In_Process(module, module_path):
+    '''
+    Returns True if the server module should run in its own process,
+    as set by its "run_in_process" attribute, or overridden by the
+    "run_in_process" dict in the permissions file.
+    '''
+    overrides = permissions.get('run_in_process', {}) if permissions else {}
+    if module_path.as_posix() in overrides:
+        return bool(overrides[module_path.as_posix()])
+    return bool(getattr(module, 'run_in_process', False))
+
+
 def Pipe_Client_Test(args):
     '''
     Function to mimic the x4 client.
@@ -583,12 +1119,18 @@ def Pipe_Client_Test(args):
     message = ';'.join(modules) + ';'
     pipe.Write("modules:" + message)
 
-    # Keep-alive blocking read.
-    pipe.Read()
+    # Keep-alive blocking read, past the host's capabilities announcement.
+    while pipe.Read().startswith('capabilities:'):
+        pass
                 
     return
 
 
 if __name__ == '__main__':
+    # Needed for server processes when running as an exe. Only frozen
+    # exes need it, so skip the multiprocessing import otherwise.
+    if getattr(sys, 'frozen', False):
+        import multiprocessing
+        multiprocessing.freeze_support()
     Main()
 
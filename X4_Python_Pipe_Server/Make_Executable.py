@@ -13,6 +13,7 @@ except Exception:
     pyinstaller_found = False
 
 import subprocess
+import time
 
 This_dir = Path(__file__).parent
 
@@ -32,6 +33,30 @@ def Clear_Dir(dir_path):
     return
 
 
+def Measure_Launch_Time(exe_path, runs):
+    '''
+    Launch the exe the given number of times with "--help", which covers
+    the interpreter start and host imports, and print the launch times.
+    The first run is reported separately, as it may be slowed by a cold
+    disk cache or virus scanning of the new files.
+    '''
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run([str(exe_path), '--help'], capture_output = True)
+        times.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            print(f'Launch test failed with code {result.returncode}.')
+            return
+    print('Launch time: first {:.0f} ms'.format(times[0] * 1000), end = '')
+    if len(times) > 1:
+        print(', then best {:.0f} ms, average {:.0f} ms over {} runs'.format(
+            min(times[1:]) * 1000, sum(times[1:]) / len(times[1:]) * 1000,
+            len(times) - 1), end = '')
+    print('.')
+    return
+
+
 def Make(*args):
     # Set up command line arguments.
     argparser = argparse.ArgumentParser(
@@ -51,14 +76,39 @@ def Make(*args):
         help = 'Delete the pyinstaller work folder when done, though this'
                ' will slow down rebuilds.')
     
+    argparser.add_argument(
+        '-onefile', 
+        action='store_true',
+        help =  'Pack everything into the single exe, instead of the default'
+                ' folder of files. This is easier to move around, but slower'
+                ' to launch, as it unpacks into a temp folder on every run.')
+    
+    # Onedir is now the default; the flag is kept for older scripts.
     argparser.add_argument(
         '-onedir', 
         action='store_true',
-        help =  'Puts files separated into a folder, mainly to aid in debug,'
-                ' though also skips needing to unpack into a temp folder.')
+        help =  'Puts files separated into a folder (the default).')
+    
+    argparser.add_argument(
+        '-optimize', 
+        type = int,
+        choices = [0, 1, 2],
+        default = 1,
+        help =  'Python optimization level of the precompiled modules packed'
+                ' into the exe: 1 (default) strips asserts, 2 also strips'
+                ' docstrings. Extension modules loaded at runtime are'
+                ' unaffected.')
+    
+    argparser.add_argument(
+        '-launch-runs', 
+        type = int,
+        default = 5,
+        help =  'Number of times to launch the built exe, to measure its'
+                ' launch time; 0 to skip.')
     
     # Run the parser on the input args.
     args, remainder = argparser.parse_known_args(args)
+    onedir = not args.onefile
 
     if not pyinstaller_found:
         raise RuntimeError('PyInstaller not found')
@@ -189,7 +239,9 @@ def Make(*args):
     ]
     
     # Exe packing is different between one-dir and one-file.
-    if not args.onedir:
+    # One-dir launches faster, running the precompiled modules in place
+    # instead of unpacking everything into a temp folder first.
+    if not onedir:
         spec_lines += [
             'exe = EXE(pyz,',
             '    a.scripts,',
@@ -219,7 +271,9 @@ def Make(*args):
             '    name = "{}",'.format(program_name),
             '    debug = False,',
             '    strip = False,',
-            '    upx = True,',
+            # Upx packed binaries get unpacked in memory on every launch;
+            # skip it, as size matters less for a folder.
+            '    upx = False,',
             # Set to a console mode compile.
             '    console = True,',
             '    windowed = False,',
@@ -234,7 +288,7 @@ def Make(*args):
             '    a.zipfiles,',
             '    a.datas,',
             '    strip = False,',
-            '    upx = True,',
+            '    upx = False,',
             '    name = "{}",'.format(program_name),
             ')',
             '',
@@ -258,9 +312,12 @@ def Make(*args):
     #  and target the PyInstaller package.
     # By going through python, it is also possible to set optimization
     #  mode that will be applied to the compiled code.
-    # TODO: add optimization flag.
     pyinstaller_call_args = [
         'python', 
+        ]
+    if args.optimize:
+        pyinstaller_call_args.append('-' + 'O' * args.optimize)
+    pyinstaller_call_args += [
         '-m', 'PyInstaller', 
         str(spec_file_path),
         '--distpath', str(dist_folder),
@@ -283,7 +340,7 @@ def Make(*args):
 
     # Check if the exe was created.
     # This is an extra folder deep in onedir mode.
-    exe_path = dist_folder / (program_name if args.onedir else '') / (program_name + '.exe')
+    exe_path = dist_folder / (program_name if onedir else '') / (program_name + '.exe')
     if not exe_path.exists():
         # It wasn't found; quit early.
         print('Executable not created.')
@@ -291,7 +348,7 @@ def Make(*args):
 
     # When setting to onedir, the files are buried an extra folder down.
     # This will bring them up, just to remove a level of nesting.
-    if args.onedir:
+    if onedir:
         # Traverse the folder with the files; this was collected under
         #  another folder with the name of the program.
         path_to_exe_files = dist_folder / program_name
@@ -325,6 +382,11 @@ def Make(*args):
         if build_folder.exists():
             Clear_Dir(build_folder)
 
+
+    # Measure how long the exe takes to launch, up to parsing its args.
+    if args.launch_runs > 0:
+        Measure_Launch_Time(dist_folder / (program_name + '.exe'), args.launch_runs)
+
     
     # Restory any original workind directory, in case this function
     #  was called from somewhere else.
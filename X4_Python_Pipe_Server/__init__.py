@@ -20,3 +20,8 @@ _Init()
 
 # Make available the pipes for easy import into dynamically loaded modules.
 from .Classes import Pipe_Server, Pipe_Client
+from .Classes import Async_Pipe_Server, Async_Pipe_Client
+# Shared game time to wall clock mapping, fed by the time api.
+from .Classes import Get_Game_Clock
+# Duration statistics with quantile estimates, for modules timing things.
+from .Classes import Histogram
@@ -27,7 +27,7 @@ import sys
 import time
 import threading
 import copy
-from collections import defaultdict
+from collections import defaultdict, deque
 
 # This will be specific to windows for now.
 if not sys.platform == 'win32':
@@ -68,7 +68,13 @@ def main(args):
     before processing keys sent.
     '''
     # Set up the pipe and connect to x4.
-    pipe = Pipe_Server(pipe_name)
+    # Note: x4 will sometimes send non-ack messages to the pipe, and there
+    # is no way to know when they will arrive other than testing it.
+    # Paired unidirectional pipes are used so that a reader thread can
+    # sit in a blocking Read while this thread Writes key events as soon
+    # as they are captured. (With a single pipe, a pending Read blocks
+    # any Write on the same handle.)
+    pipe = Pipe_Server(pipe_name, dual_channel = True)
         
     # Enable test mode if requested.
     if args['test']:
@@ -84,27 +90,40 @@ def main(args):
     # Wait for client.
     pipe.Connect()
 
+    # Event used to wake this thread when keys are captured or messages
+    # arrive from x4.
+    wake_event = threading.Event()
+
     # Set up the listener class object to use.
-    keyboard_listener = Keyboard_Listener()
+    keyboard_listener = Keyboard_Listener(wake_event)
 
     # Set up a key combo processor.
     combo_processor = Key_Combo_Processor()
 
-    # Note: x4 will sometimes send non-ack messages to the pipe, and there
-    # is no way to know when they will arrive other than testing it.
-    # This cannot be done in one thread with blocking Reads/Writes.
-    # While conceptually spinning off a second Read thread will work,
-    #  it was tried and failed, as the write thread got stuck on Write
-    #  while the read thread was waiting on Read since both were waiting
-    #  on the same pipe that can only wait on one request.
-    # The solution is to set the pipe to non-blocking, and do everything
-    #  in a single thread.
-    # TODO: maybe revisit if ever changing to paired unidirectional pipes.
-    pipe.Set_Nonblocking()
-   
+    # Start the pipe reader.
+    pipe_reader = Pipe_Reader(pipe, wake_event)
+
+    # Wake up promptly if the host stops this server (older hosts don't
+    # pass a token).
+    cancel_token = args.get('cancel_token')
+    if cancel_token is not None:
+        cancel_token.Add_Callback(wake_event.set)
+    
+
+    # Start set, so the first pass doesn't wait.
+    wake_event.set()
 
     try:
         while 1:
+
+            # Sleep until a key is captured or a message arrives.
+            # The timeout only paces the window focus check, which has
+            # no event to wait on; it can be slower outside x4.
+            # Clear as soon as woken, before the reader and key buffers
+            # are drained below, so that anything buffered during the
+            # drain sets the event again and wakes the next wait.
+            wake_event.wait(0.200)
+            wake_event.clear()
         
             # Determine if x4 is the focused window.
             # Get the window title of whatever window has focus.
@@ -133,13 +152,11 @@ def main(args):
                 combo_processor.Reset_State()
             
 
-            # Try to read any data.
+            # Handle any messages the reader picked up.
             # This will grab as much as it can get, so response handling
-            # doesn't bog down when a lot of acks come back (since this
-            # is checked on a timer, where each interval can send several
-            # key events, eg. when keys are held down).
-            message = pipe.Read()
-            while message != None:
+            # doesn't bog down when a lot of acks come back (eg. when keys
+            # are held down).
+            for message in pipe_reader.Retrieve_Messages():
                 print('Received: ' + message)
 
                 # Ignore pings; they were just testing the pipe.
@@ -162,8 +179,12 @@ def main(args):
                     # throw a pipe error exception (as expected by
                     # Server_Thread to reboot this module).
 
-                # Try to get another message.
-                message = pipe.Read()
+            # If the reader hit a pipe error (eg. x4 reloaded), pass it
+            # up to Server_Thread so this server restarts.
+            pipe_reader.Raise_Error()
+            # Stop if cancelled by the host.
+            if cancel_token is not None:
+                cancel_token.Check()
                 
 
             # If anything is in the key_buffer, process into key combos.
@@ -198,31 +219,77 @@ def main(args):
                     pipe.Write(message)
 
 
-            # General pause between checks.
-            # Assuming x4 is at 60 fps, that is 16 ms between frames.
-            # Responsiveness here probably doesn't need to be much better than
-            # a couple frames, though. 
-            # Although, x4 processing will add a frame or two at least.
-            # TODO: maybe revisit this timer stepping.
-            # TODO: maybe reduce this if any traffic was handled above.
-            if x4_has_focus:
-                time.sleep(0.040)
-            else:
-                # Slow down when outside x4, though still quick enough
-                # to response when tabbing back in quickly.
-                time.sleep(0.200)
-
     finally:
         # Stop the listener when an error occurs, eg. x4 closing.
         keyboard_listener.Stop()
     return
 
 
+class Pipe_Reader:
+    '''
+    Reads messages from the pipe in a separate thread, using blocking
+    reads, and buffers them for the main server thread.
+    Requires a dual_channel pipe, so that the main thread can Write while
+    a Read is pending.
+
+    Attributes:
+    * messages
+      - Deque of messages received but not yet retrieved.
+    * error
+      - Exception raised by the pipe Read, if any, which stops the reader.
+    * wake_event
+      - threading.Event set whenever a message or error arrives.
+    '''
+    def __init__(self, pipe, wake_event):
+        self.pipe = pipe
+        self.wake_event = wake_event
+        self.messages = deque()
+        self.error = None
+        # Daemon, so that a reader stuck on a dead pipe never holds up exit.
+        self.thread = threading.Thread(target = self.Run, daemon = True)
+        self.thread.start()
+        return
+
+    def Run(self):
+        '''
+        Thread loop; reads until the pipe errors.
+        '''
+        try:
+            while 1:
+                message = self.pipe.Read()
+                self.messages.append(message)
+                self.wake_event.set()
+        except Exception as ex:
+            self.error = ex
+            self.wake_event.set()
+        return
+
+    def Retrieve_Messages(self):
+        '''
+        Returns the buffered messages, and empties the buffer.
+        '''
+        # Pop from the shared deque rather than swapping it out, so that
+        # a message the reader appends meanwhile is left for the next call
+        # instead of landing in a list already handed back.
+        ret_val = []
+        while self.messages:
+            ret_val.append(self.messages.popleft())
+        return ret_val
+
+    def Raise_Error(self):
+        '''
+        Reraise any exception the reader stopped on.
+        '''
+        if self.error is not None:
+            raise self.error
+        return
+
+
 def Pipe_Client_Test():
     '''
     Function to mimic the x4 client.
     '''
-    pipe = Pipe_Client(pipe_name)
+    pipe = Pipe_Client(pipe_name, dual_channel = True)
 
     # Pick some keys to capture.
     # Some given as MD registered string combos, some as ego keycodes.
@@ -302,9 +369,12 @@ class Keyboard_Listener():
     extra functionality, buffering, and correction for missing info
     (notably up/down event annotation and key scancodes.
     '''
-    def __init__(self):
+    def __init__(self, wake_event = None):
         # Set up the keyboard listener.
 
+        # Optional threading.Event to set whenever a key is buffered.
+        self.wake_event = wake_event
+
         # Buffer of Key_Events. Index 0 is oldest press.
         # TODO: rethink buffer limit; it is mostly for safety, but if ever
         # hit it will cause problems with detecting key releases (eg. set
@@ -344,6 +414,8 @@ class Keyboard_Listener():
         '''
         if len(self.key_buffer) < self.max_keys_buffered:
             self.key_buffer.append( Key_Event(key_object, self.last_scancode, True))
+        if self.wake_event:
+            self.wake_event.set()
         return
     
     def Buffer_Releases(self, key_object):
@@ -353,6 +425,8 @@ class Keyboard_Listener():
         '''
         if len(self.key_buffer) < self.max_keys_buffered:
             self.key_buffer.append( Key_Event(key_object, self.last_scancode, False))
+        if self.wake_event:
+            self.wake_event.set()
         return
 
     def Event_Precheck(self, msg, data):
@@ -3,10 +3,65 @@ Python side of the time api.
 This provides actual realtime timer support, which will work within
 a single frame (which is otherwise not possible with X4's internal
 timer).
+
+Commands:
+* ping
+  - Ignored; sent when x4 sets up the pipe.
+* get
+  - Replies with the current time, in seconds.
+* tic:<id>
+  - Starts the named timer; "tic" alone uses an unnamed one.
+* toc:<id>
+  - Replies with the seconds since the named timer's tic, leaving it
+    running. Replies "ERROR" if the timer was never started.
+* record:<id>
+  - As toc, but instead of replying, adds the time to the statistics
+    kept for the id: count, total, min, max, and p50/p95/p99 from a
+    Quantile_Sketch (through the server's Histogram). This keeps
+    aggregation off the game thread.
+* report
+  - Replies with a summary table of the recorded statistics, one line
+    per id, which is also printed to the host console.
+* calibrate:<count>
+  - Measures the pipe overheads with count probes. Each probe is a
+    "calibrate:<index>" message, which x4 answers by writing "echo"
+    twice, as two separate messages. Times measured per probe:
+    - round trip: from writing the probe to reading the first echo,
+      including x4's frame-polled read delay.
+    - overhead: between reading the two echos, ie. what an empty tic/toc
+      pair measures, being the cost of one x4 write to the server.
+  - Replies with a table of both distributions, once all probes are
+    done, and keeps their medians for correcting tocs. Other commands
+    arriving meanwhile are handled afterward, so replies stay in order;
+    this stalls the server for the whole calibration, which in game
+    takes a frame or two per probe (eg. ~30 s for 1000 probes at 60 fps).
+    Replies "ERROR" if count is missing or not an integer from 1 to
+    max_calibrate_count.
+* correct:<0 or 1>
+  - Turns on or off removing the calibrated overhead median from toc
+    and record times; a bare "correct" turns it on. Off until this is
+    sent. Has no effect until calibrated.
+* sync:<game time>,<engine time>
+  - Adds a sample of x4's game time (GetCurTime) and engine real time
+    (GetCurRealTime), taken in the same frame, to the host's shared
+    Game_Clock, which fits them against the python clock. Other servers
+    use Get_Game_Clock() to convert between game and wall clock times,
+    without pipe round trips. No reply; malformed samples are printed
+    as errors and skipped.
+* dilation
+  - Replies with the current game seconds per real second (eg. the
+    SETA factor, or 0 while paused), or "ERROR" before two syncs.
+
+A message may hold several commands, each ended by a semicolon, eg.
+"tic:a;toc:b;get;". Ids are ignored where not used (eg. "get:<id>"),
+so callers can tag every command. The replies to a message are sent
+together in one batch, in command order, which x4 unpacks into
+separate reads.
 '''
-from X4_Python_Pipe_Server import Pipe_Server, Pipe_Client
+from X4_Python_Pipe_Server import Pipe_Server, Pipe_Client, Get_Game_Clock, Histogram
 import time
 import threading
+from collections import deque
 
 # Name of the pipe to use.
 pipe_name = 'x4_time'
@@ -15,6 +70,15 @@ pipe_name = 'x4_time'
 # of x4.
 test_python_client = 0
 
+# Medians from the last calibration, in seconds, or None if not yet run:
+# 'round_trip' and 'overhead'. Kept across reconnects.
+calibration = None
+# If True, toc and record times have the calibrated overhead removed.
+correct_tocs = False
+# Most probes allowed in one calibrate command, bounding how long it
+# stalls other commands.
+max_calibrate_count = 1000
+
 
 def main(args):
     '''
@@ -28,7 +92,8 @@ def main(args):
         test_python_client = True
 
     # Set up the pipe and connect to x4.
-    pipe = Pipe_Server(pipe_name)
+    # Writes are batched, to send all replies to a message at once.
+    pipe = Pipe_Server(pipe_name, batch_writes = True)
         
     # For python testing, kick off a client thread.
     if test_python_client:
@@ -39,42 +104,186 @@ def main(args):
     # Wait for client.
     pipe.Connect()
 
-    # Var to hold the last tic time.
-    last_tic = 0
-           
+    # Start times of running timers, keyed by id (an empty string for
+    # plain "tic"). Timers are kept until the pipe reconnects.
+    timers = {}
+    # Histograms of record commands, keyed by id.
+    records = {}
+    # Messages that arrived during a calibration, to handle after it.
+    deferred = deque()
 
     while 1:        
-        # Blocking wait for a message from x4.
-        message = pipe.Read()
+        # Blocking wait for a message from x4, unless some were put off.
+        message = deferred.popleft() if deferred else pipe.Read()
 
         if test_python_client:
             print(pipe_name + ' server got: ' + message)
 
-        # React based on command.
-        if message == 'ping':
-            # Ignore any setup pings.
-            pass
+        # Handle each command in turn; a lone command may omit the
+        # ending semicolon.
+        for command in message.split(';'):
+            if command:
+                Handle_Command(pipe, command, timers, records, deferred)
+
+        # Send all of the replies to this message.
+        pipe.Flush()
+                        
+        # TODO: maybe use time.sleep(?) for a bit if ever switching to
+        # non-blocking reads.
+    return
+
+
+def Handle_Command(pipe, command, timers, records, deferred):
+    '''
+    Handle one command, writing any reply to the pipe.
+    '''
+    global correct_tocs
+    # Split off the id, if any.
+    name, _, id = command.partition(':')
+
+    # React based on command.
+    if name == 'ping':
+        # Ignore any setup pings.
+        pass
 
-        elif message == 'get':
-            # Return current time.
-            pipe.Write(time.perf_counter())
+    elif name == 'get':
+        # Return current time.
+        pipe.Write(time.perf_counter())
 
-        elif message == 'tic':
-            # Record current time in prep for toc.
-            last_tic = time.perf_counter()
+    elif name == 'tic':
+        # Record current time in prep for toc.
+        timers[id] = time.perf_counter()
 
-        elif message == 'toc':
-            # Return time since the tic.
-            pipe.Write(time.perf_counter() - last_tic)
+    elif name == 'toc':
+        # Return time since the tic.
+        if id in timers:
+            pipe.Write(Get_Elapsed(timers[id]))
+        else:
+            print(f'Error: {pipe_name} toc of unstarted timer "{id}"')
+            # Still reply, so x4 replies stay in order.
+            pipe.Write('ERROR')
 
+    elif name == 'record':
+        # Add the time since the tic to the id's stats, without replying.
+        if id in timers:
+            if id not in records:
+                records[id] = Histogram()
+            records[id].Add(Get_Elapsed(timers[id]))
         else:
-            print('Error:' + pipe_name + ' unrecognized command: ' + message)
-                        
-        # TODO: maybe use time.sleep(?) for a bit if ever switching to
-        # non-blocking reads.
+            print(f'Error: {pipe_name} record of unstarted timer "{id}"')
+
+    elif name == 'report':
+        # Return the stats table, and show it in the console too.
+        report = Format_Report(records)
+        print(report)
+        pipe.Write(report)
+
+    elif name == 'calibrate':
+        try:
+            count = int(id)
+        except ValueError:
+            count = 0
+        if 0 < count <= max_calibrate_count:
+            report = Calibrate(pipe, count, deferred)
+            print(report)
+            pipe.Write(report)
+        else:
+            print(f'Error: {pipe_name} bad calibrate count "{id}"')
+            # Still reply, so x4 replies stay in order.
+            pipe.Write('ERROR')
+
+    elif name == 'correct':
+        correct_tocs = id != '0'
+
+    elif name == 'sync':
+        # Stamp the sample with its arrival time.
+        try:
+            game_time, engine_time = id.split(',')
+            game_time, engine_time = float(game_time), float(engine_time)
+        except ValueError:
+            print(f'Error: {pipe_name} bad sync "{id}"')
+        else:
+            Get_Game_Clock().Add_Sample(game_time, engine_time)
+
+    elif name == 'dilation':
+        dilation = Get_Game_Clock().Get_Dilation()
+        pipe.Write('ERROR' if dilation is None else dilation)
+
+    else:
+        print('Error:' + pipe_name + ' unrecognized command: ' + command)
     return
 
 
+def Get_Elapsed(start):
+    '''
+    Returns the seconds since the start time, less the calibrated
+    overhead if correcting tocs.
+    '''
+    elapsed = time.perf_counter() - start
+    if correct_tocs and calibration is not None:
+        elapsed = max(elapsed - calibration['overhead'], 0.0)
+    return elapsed
+
+
+def Calibrate(pipe, count, deferred):
+    '''
+    Measure the round trip and overhead times of count probes, saving
+    their medians to calibration. Returns a table of the distributions.
+    Other messages read meanwhile are added to deferred.
+    '''
+    global calibration
+    stats = {
+        'round trip' : Histogram(),
+        'overhead'   : Histogram(),
+        }
+    for index in range(count):
+        start = time.perf_counter()
+        pipe.Write(f'calibrate:{index}')
+        pipe.Flush()
+        first = Read_Echo(pipe, deferred)
+        second = Read_Echo(pipe, deferred)
+        stats['round trip'].Add(first - start)
+        stats['overhead'].Add(second - first)
+
+    if count > 0:
+        calibration = {
+            'round_trip' : stats['round trip'].Get_Quantile(0.5),
+            'overhead'   : stats['overhead'].Get_Quantile(0.5),
+            }
+    return Format_Report(stats, sort = False)
+
+
+def Read_Echo(pipe, deferred):
+    '''
+    Read until a calibration echo arrives, returning the time it was
+    read. Other messages are added to deferred.
+    '''
+    while True:
+        message = pipe.Read()
+        now = time.perf_counter()
+        if message == 'echo':
+            return now
+        deferred.append(message)
+
+
+def Format_Report(records, sort = True):
+    '''
+    Returns a table of the recorded timing stats, one line per id (sorted
+    unless sort is False), with times in milliseconds.
+    '''
+    if not records:
+        return 'No timings recorded.'
+    lines = []
+    items = sorted(records.items()) if sort else records.items()
+    for id, stats in items:
+        summary = stats.Get_Snapshot()
+        lines.append('{}: count {}, mean {:.3f}, min {:.3f}, max {:.3f},'
+                     ' p50 {:.3f}, p95 {:.3f}, p99 {:.3f} ms'.format(
+            id, summary['count'],
+            *[summary[x] * 1000 for x in ['mean', 'min', 'max', 'p50', 'p95', 'p99']]))
+    return '\n'.join(lines)
+
+
 def Pipe_Client_Test():
     '''
     Function to mimic the x4 client.
@@ -84,13 +293,50 @@ def Pipe_Client_Test():
     # Run a number of tests, to see how time values progress.
     for _ in range(5):
 
-        # Send commands.
-        for command in ['ping', 'get', 'tic', 'toc']:
+        # Send commands, singly and batched, with overlapping timers.
+        for command in ['ping', 'get', 'tic', 'toc', 'tic:a', 'tic:b',
+                        'toc:a;toc:b;get;', 'toc:missing']:
             pipe.Write(command)
 
         # Capture and print responses.
-        for _ in range(2):
+        for _ in range(6):
             response = pipe.Read()
             print(pipe_name + ' client got: ' + response)
 
-    return
\ No newline at end of file
+    # Record a spread of times, then report on them.
+    for index in range(200):
+        pipe.Write('tic:spread;record:spread;' if index % 10 else 'tic:spread')
+        if not index % 10:
+            time.sleep(0.001)
+            pipe.Write('record:spread')
+    pipe.Write('report')
+    print(pipe_name + ' client got:\n' + pipe.Read())
+
+    # Calibrate, echoing the probes as x4 does, then time empty tic/toc
+    # pairs with the overhead removed.
+    count = 20
+    pipe.Write(f'calibrate:{count}')
+    for _ in range(count):
+        pipe.Read()
+        pipe.Write('echo')
+        pipe.Write('echo')
+    print(pipe_name + ' client got:\n' + pipe.Read())
+    pipe.Write('correct:1')
+    for _ in range(3):
+        pipe.Write('tic:empty')
+        pipe.Write('toc:empty')
+        print(pipe_name + ' client got corrected toc: ' + pipe.Read())
+
+    # Sync a game clock running at double speed, with engine time
+    # following the python clock.
+    for index in range(5):
+        engine_time = time.perf_counter()
+        pipe.Write(f'sync:{100 + 2 * engine_time},{engine_time}')
+        time.sleep(0.01)
+    pipe.Write('dilation')
+    print(pipe_name + ' client got dilation: ' + pipe.Read())
+    clock = Get_Game_Clock()
+    print(pipe_name + ' client converted game time now: {}, expected {}'.format(
+        clock.Wall_To_Game(), 100 + 2 * time.perf_counter()))
+
+    return
@@ -0,0 +1,330 @@
+--[[
+Typed binary codec for pipe messages.
+Matches X4_Python_Pipe_Server/Classes/Codec.py; see there for the format.
+
+Typed messages start with "\0T", followed by one tagged value:
+    n/t/f : nil, true, false
+    i     : zigzag varint int
+    d     : 8-byte little-endian double
+    s     : varint length, string bytes (also interned, indexed from 0)
+    r     : varint index of an interned string
+    l     : varint count, then values
+    m     : varint count, then key,value pairs
+Varints are unsigned LEB128 (7 bits per byte, low first, high bit set
+on all but the last byte).
+
+Lua tables are sent as lists ('l') if their keys are exactly 1..n,
+otherwise as maps ('m'). Empty tables are sent as empty maps.
+Numbers are sent as ints when integral and within +/-2^52,
+else as doubles.
+
+Pure lua, so doubles are packed with math.frexp/ldexp.
+]]
+
+local L = {
+    -- Header marking a typed message.
+    typed_header = "\0T",
+    -- Header marking a codec control message, followed by the codec name.
+    control_header = "\0C",
+}
+
+local byte   = string.byte
+local char   = string.char
+local sub    = string.sub
+local floor  = math.floor
+local concat = table.concat
+
+-- Largest magnitude sent as an int; zigzag doubles it, which lua
+-- numbers still hold exactly.
+local int_limit = 4503599627370496
+
+
+-------------------------------------------------------------------------------
+-- Number packing.
+
+-- Returns the varint string for a non-negative integer.
+local function Pack_Varint(value)
+    if value < 128 then
+        return char(value)
+    end
+    local bytes = {}
+    while value >= 128 do
+        bytes[#bytes + 1] = value % 128 + 128
+        value = floor(value / 128)
+    end
+    bytes[#bytes + 1] = value
+    return char(unpack(bytes))
+end
+
+-- Returns the varint at position, and the position following it.
+local function Unpack_Varint(data, position)
+    local value = 0
+    local scale = 1
+    while true do
+        local b = byte(data, position)
+        if b == nil then
+            error("truncated typed message")
+        end
+        position = position + 1
+        if b < 128 then
+            return value + b * scale, position
+        end
+        value = value + (b - 128) * scale
+        scale = scale * 128
+    end
+end
+
+-- Returns an 8-byte little-endian IEEE754 string for a double.
+local function Pack_Double(value)
+    local sign = 0
+    if value < 0 or (value == 0 and 1/value < 0) then
+        sign = 1
+        value = -value
+    end
+
+    local exponent, mantissa
+    if value ~= value then
+        -- NaN.
+        exponent, mantissa = 2047, 1
+    elseif value == math.huge then
+        exponent, mantissa = 2047, 0
+    elseif value == 0 then
+        exponent, mantissa = 0, 0
+    else
+        -- value = fraction * 2^power, with fraction in [0.5, 1).
+        local fraction, power = math.frexp(value)
+        exponent = power + 1022
+        if exponent >= 2047 then
+            exponent, mantissa = 2047, 0
+        elseif exponent <= 0 then
+            -- Subnormal; stored as a multiple of 2^-1074.
+            exponent = 0
+            mantissa = math.ldexp(value, 1074)
+        else
+            -- Drop the implicit leading 1.
+            mantissa = (fraction * 2 - 1) * 4503599627370496
+        end
+    end
+
+    -- Mantissa is 52 bits: 6 low bytes, then 4 bits shared with exponent.
+    local bytes = {}
+    for i = 1, 6 do
+        bytes[i] = mantissa % 256
+        mantissa = floor(mantissa / 256)
+    end
+    bytes[7] = (exponent % 16) * 16 + mantissa
+    bytes[8] = sign * 128 + floor(exponent / 16)
+    return char(unpack(bytes))
+end
+
+-- Returns the double at position.
+local function Unpack_Double(data, position)
+    local b1, b2, b3, b4, b5, b6, b7, b8 = byte(data, position, position + 7)
+    if b8 == nil then
+        error("truncated typed message")
+    end
+    local sign = 1
+    if b8 >= 128 then
+        sign = -1
+    end
+    local exponent = (b8 % 128) * 16 + floor(b7 / 16)
+    local mantissa = ((((((b7 % 16) * 256 + b6) * 256 + b5) * 256 + b4) * 256 + b3) * 256 + b2) * 256 + b1
+
+    if exponent == 0 then
+        return sign * math.ldexp(mantissa, -1074)
+    elseif exponent == 2047 then
+        if mantissa == 0 then
+            return sign * math.huge
+        end
+        return 0/0
+    end
+    return sign * math.ldexp(1 + mantissa / 4503599627370496, exponent - 1023)
+end
+
+
+-------------------------------------------------------------------------------
+-- Encoding.
+
+-- Returns true if the table keys are exactly 1..n, with n > 0.
+local function Is_List(value)
+    local length = #value
+    if length == 0 then
+        return false
+    end
+    local count = 0
+    for _ in pairs(value) do
+        count = count + 1
+    end
+    return count == length
+end
+
+-- Append the encoding of a value to the parts list.
+-- 'interned' has 'strings', mapping strings already sent to their
+-- index, and 'count' of strings sent.
+local function Encode_Value(value, parts, interned)
+    local value_type = type(value)
+
+    if value_type == "number" then
+        if value == floor(value) and value >= -int_limit and value <= int_limit then
+            parts[#parts + 1] = "i"
+            -- Zigzag, so small negative numbers stay small.
+            if value >= 0 then
+                parts[#parts + 1] = Pack_Varint(value * 2)
+            else
+                parts[#parts + 1] = Pack_Varint(-value * 2 - 1)
+            end
+        else
+            parts[#parts + 1] = "d"
+            parts[#parts + 1] = Pack_Double(value)
+        end
+
+    elseif value_type == "string" then
+        local index = interned.strings[value]
+        if index ~= nil then
+            parts[#parts + 1] = "r"
+            parts[#parts + 1] = Pack_Varint(index)
+        else
+            interned.strings[value] = interned.count
+            interned.count = interned.count + 1
+            parts[#parts + 1] = "s"
+            parts[#parts + 1] = Pack_Varint(#value)
+            parts[#parts + 1] = value
+        end
+
+    elseif value_type == "table" then
+        if Is_List(value) then
+            parts[#parts + 1] = "l"
+            parts[#parts + 1] = Pack_Varint(#value)
+            for i = 1, #value do
+                Encode_Value(value[i], parts, interned)
+            end
+        else
+            -- Count is only known after walking the table; fill it in after.
+            parts[#parts + 1] = "m"
+            local count_index = #parts + 1
+            parts[count_index] = ""
+            local count = 0
+            for key, item in pairs(value) do
+                Encode_Value(key, parts, interned)
+                Encode_Value(item, parts, interned)
+                count = count + 1
+            end
+            parts[count_index] = Pack_Varint(count)
+        end
+
+    elseif value == nil then
+        parts[#parts + 1] = "n"
+    elseif value == true then
+        parts[#parts + 1] = "t"
+    elseif value == false then
+        parts[#parts + 1] = "f"
+    else
+        error("typed codec cannot encode "..value_type)
+    end
+end
+
+-- Encode a lua value into a typed message string.
+function L.Encode(value)
+    local parts = {L.typed_header}
+    Encode_Value(value, parts, {strings = {}, count = 0})
+    return concat(parts)
+end
+
+
+-------------------------------------------------------------------------------
+-- Decoding.
+
+-- Decode the value at position.
+-- Returns the value and the position following it.
+-- 'interned' is a list of strings decoded so far, indexed from 1.
+local function Decode_Value(data, position, interned)
+    local tag = sub(data, position, position)
+    position = position + 1
+
+    if tag == "i" then
+        local value
+        value, position = Unpack_Varint(data, position)
+        if value % 2 == 1 then
+            return -(value + 1) / 2, position
+        end
+        return value / 2, position
+
+    elseif tag == "r" then
+        local index
+        index, position = Unpack_Varint(data, position)
+        local value = interned[index + 1]
+        if value == nil then
+            error("bad string reference in typed message")
+        end
+        return value, position
+
+    elseif tag == "s" then
+        local length
+        length, position = Unpack_Varint(data, position)
+        if position + length - 1 > #data then
+            error("truncated typed message")
+        end
+        local value = sub(data, position, position + length - 1)
+        interned[#interned + 1] = value
+        return value, position + length
+
+    elseif tag == "d" then
+        return Unpack_Double(data, position), position + 8
+
+    elseif tag == "m" then
+        local count
+        count, position = Unpack_Varint(data, position)
+        local value = {}
+        local key, item
+        for i = 1, count do
+            key , position = Decode_Value(data, position, interned)
+            item, position = Decode_Value(data, position, interned)
+            -- Lua tables cannot hold nil keys; skip any.
+            if key ~= nil then
+                value[key] = item
+            end
+        end
+        return value, position
+
+    elseif tag == "l" then
+        local count
+        count, position = Unpack_Varint(data, position)
+        local value = {}
+        for i = 1, count do
+            value[i], position = Decode_Value(data, position, interned)
+        end
+        return value, position
+
+    elseif tag == "n" then
+        return nil, position
+    elseif tag == "t" then
+        return true, position
+    elseif tag == "f" then
+        return false, position
+    end
+    error("unknown typed tag '"..tag.."' at position "..(position - 1))
+end
+
+-- Decode a typed message string into a lua value.
+function L.Decode(message)
+    local value, position = Decode_Value(message, #L.typed_header + 1, {})
+    if position ~= #message + 1 then
+        error("extra data after typed message value")
+    end
+    return value
+end
+
+
+-- Returns true if the message is a typed message.
+function L.Is_Typed(message)
+    return sub(message, 1, #L.typed_header) == L.typed_header
+end
+
+-- Returns a control message announcing support for the named codec.
+function L.Pack_Control(codec)
+    return L.control_header..codec
+end
+
+
+Register_Require_Response("extensions.sn_mod_support_apis.ui.named_pipes.Codec", L)
+return L
@@ -210,6 +210,12 @@ function L.Process_Command()
 
     elseif args.command == "UnsuppressPausedReads" then
         Pipes.Set_Suppress_Paused_Reads(args.pipe_name, false)
+
+    elseif args.command == "DualChannel" then
+        Pipes.Set_Dual_Channel(args.pipe_name, true)
+
+    elseif args.command == "TypedCodec" then
+        Pipes.Set_Codec(args.pipe_name, "typed")
     end
 end
 
@@ -34,6 +34,7 @@ local winpipe = require("extensions.sn_mod_support_apis.ui.c_library.winpipe")
 
 local Lib = require("extensions.sn_mod_support_apis.ui.named_pipes.Library")
 local FIFO = Lib.FIFO
+local Codec = require("extensions.sn_mod_support_apis.ui.named_pipes.Codec")
 -- Pass along any debug params.
 Lib.debug.print_to_log = debug.print_to_log
 
@@ -45,6 +46,23 @@ local L = {
     -- Flag indicating if the winpipe lib was loaded.
     winpipe_loaded = winpipe ~= nil,
 
+    -- Flag indicating if the winpipe lib reads messages containing null
+    -- bytes intact, needed for framed messages (batches, chunks, typed).
+    -- Older dlls cut messages at the first null byte.
+    binary_reads = winpipe ~= nil and winpipe.READ_SIZE ~= nil,
+
+    -- Name of the python host pipe, which announces the capabilities of
+    -- the host's pipes after connecting.
+    host_pipe_name = "x4_python_host",
+
+    -- Set of capability names announced by the connected host, eg.
+    -- "framing" (servers handle control/batch/chunk messages) and "typed"
+    -- (servers decode typed messages). Hosts before 1.5 announce nothing,
+    -- and would read framing messages as text, so servers only get them
+    -- once the host has announced support. Cleared when the host pipe
+    -- reconnects, since the host may have changed.
+    host_capabilities = {},
+
     -- Prefix to add to the pipe_name to get a file path.
     pipe_path_prefix = "\\\\.\\pipe\\",
         
@@ -67,6 +85,33 @@ Each entry is a subtable with these fields:
   - Name of the pipe (same as the key).
 * file
   - File object to read/write/close.
+  - For dual channel pipes, this is only written.
+* dual_channel
+  - Bool, if true then messages are read from a second pipe, named
+    with an "_out" suffix, matching a python server in dual_channel mode.
+* read_file
+  - File object of the "_out" pipe, for dual channel pipes.
+* batch_fifo
+  - FIFO of messages unpacked from a batch message, not yet returned
+    by reads.
+* peer_read_size
+  - Int, largest message the server reads in one piece, as told by the
+    server on connecting, or nil if not known. Larger writes are split
+    into chunks.
+* chunk_parts
+  - List of the parts of a chunked message read so far.
+* codec
+  - String, "text" (default) or "typed".
+  - When "typed", the server is told on connection that x4 can decode
+    typed messages (see codec.lua), and table messages are written typed
+    if the server can decode them (see peer_codec).
+  - Typed messages read from the pipe are always decoded into lua values.
+* peer_codec
+  - String, codec the server decodes, set on connection: "typed" if
+    the typed codec was announced to a host that supports it, else "text".
+* text_serializer
+  - Optional function converting a table message to a text string,
+    used when the server can't decode typed messages.
 * retry_allowed
   - Bool, if a failed access is allowed one retry.
   - Set prior to an access attempt if the pipe was already open, but
@@ -120,6 +165,31 @@ function L.Set_Suppress_Paused_Reads(pipe_name, new_state)
     pipes[pipe_name].suppress_reads_when_paused = new_state
 end
 
+-- Set the given pipe to use paired unidirectional pipes.
+-- 'new_state' should be true or false.
+-- Any open file is disconnected, so the next access opens both pipes.
+function L.Set_Dual_Channel(pipe_name, new_state)
+    L.Declare_Pipe(pipe_name)
+    if pipes[pipe_name].dual_channel ~= new_state then
+        L.Disconnect_Pipe(pipe_name)
+        pipes[pipe_name].dual_channel = new_state
+    end
+end
+
+-- Set the codec used by the given pipe, "text" or "typed".
+-- Any open file is disconnected, so the server hears of the change
+-- on the next connection.
+-- The optional text_serializer converts table messages to strings when
+-- typed messages can't be sent (old dll or host).
+function L.Set_Codec(pipe_name, codec, text_serializer)
+    L.Declare_Pipe(pipe_name)
+    pipes[pipe_name].text_serializer = text_serializer
+    if pipes[pipe_name].codec ~= codec then
+        L.Disconnect_Pipe(pipe_name)
+        pipes[pipe_name].codec = codec
+    end
+end
+
 -------------------------------------------------------------------------------
 -- Scheduling reads/writes.
 
@@ -315,10 +385,18 @@ function L.Declare_Pipe(pipe_name)
         pipes[pipe_name] = {
             name = pipe_name,
             file = nil,
+            dual_channel = false,
+            read_file = nil,
             retry_allowed = false,
             suppress_reads_when_paused = false,
             write_fifo = FIFO.new(),
             read_fifo  = FIFO.new(),
+            batch_fifo = FIFO.new(),
+            codec = "text",
+            peer_codec = "text",
+            text_serializer = nil,
+            peer_read_size = nil,
+            chunk_parts = {},
         }
         
         -- Attach the garbage collector function.
@@ -378,6 +456,61 @@ function L.Connect_Pipe(pipe_name)
             -- A simple error description is used for the Test function.
             error("open_pipe returned nil for "..pipe_name)
         end
+
+        -- Dual channel pipes read from a second pipe, opened after the
+        -- first to match the server's connection order.
+        if pipes[pipe_name].dual_channel then
+            pipes[pipe_name].read_file = winpipe.open_pipe(L.pipe_path_prefix .. pipe_name .. "_out")
+            if pipes[pipe_name].read_file == nil then
+                if debug.print_connect_errors then
+                    DebugError(pipe_name.."_out; winpipe.open_pipe returned nil, last windows error code: "..tostring(winpipe.GetLastError()))
+                end
+                -- Close the first pipe, so both are retried together.
+                pcall(function () pipes[pipe_name].file:close() end)
+                pipes[pipe_name].file = nil
+                error("open_pipe returned nil for "..pipe_name.."_out")
+            end
+        end
+        -- A new server may have a different read size, and won't know
+        -- about any partial chunked message.
+        pipes[pipe_name].peer_read_size = nil
+        pipes[pipe_name].peer_codec = "text"
+        pipes[pipe_name].chunk_parts = {}
+        -- A new host may be an older version.
+        if pipe_name == L.host_pipe_name then
+            L.host_capabilities = {}
+        end
+
+        -- Tell the server how large a message x4 can read, and which codec
+        -- x4 can decode, ahead of any other messages. Servers only send
+        -- framed messages (which need binary_reads) after this.
+        -- Text needs no codec announcement.
+        -- Only done for hosts that announced framing support; pipes opened
+        -- before the announcement stay text until they reconnect.
+        if L.binary_reads and L.host_capabilities.framing then
+            local controls = {L.Pack_Control("read_size", winpipe.READ_SIZE)}
+            if pipes[pipe_name].codec ~= "text" then
+                table.insert(controls, L.Pack_Control("codec", pipes[pipe_name].codec))
+                -- Servers decode any codec their host announces.
+                if L.host_capabilities[pipes[pipe_name].codec] then
+                    pipes[pipe_name].peer_codec = pipes[pipe_name].codec
+                end
+            end
+            for i, control in ipairs(controls) do
+                local bytes_written = pipes[pipe_name].file:write(control)
+                if bytes_written == 0 then
+                    L.Disconnect_Pipe(pipe_name)
+                    error("control message failed for "..pipe_name)
+                end
+            end
+        elseif pipes[pipe_name].codec ~= "text" and debug.print_to_log then
+            if not L.binary_reads then
+                DebugError(pipe_name.."; typed codec needs an updated winpipe dll; using text")
+            else
+                DebugError(pipe_name.."; typed codec needs a host announcing framing (v1.5+); using text")
+            end
+        end
+
         -- Announce to the server that x4 just connected.
         -- Removed; depends on server protocol, and MD can send this signal
         -- if needed for a particular server.
@@ -422,6 +555,12 @@ function L.Disconnect_Pipe(pipe_name)
         
         -- Unlink from the file entirely.
         pipes[pipe_name].file = nil
+
+        -- Close the read side of dual channel pipes as well.
+        if pipes[pipe_name].read_file ~= nil then
+            pcall(function () pipes[pipe_name].read_file:close() end)
+            pipes[pipe_name].read_file = nil
+        end
         
         -- Signal the disconnect.
         Lib.Raise_Signal(pipe_name.."_disconnected")
@@ -518,7 +657,7 @@ function L.Poll_For_Reads()
                     
                     -- Debug print.
                     if debug.print_to_chat then
-                        CallEventScripts("directChatMessageReceived", pipe_name..";Read: "..message_or_nil)
+                        CallEventScripts("directChatMessageReceived", pipe_name..";Read: "..tostring(message_or_nil))
                     end
                     
                     -- Maybe ignore this if paused.
@@ -611,10 +750,10 @@ function L.Poll_For_Writes()
                 if retval then
                     -- Debug print.
                     if debug.print_to_chat then
-                        CallEventScripts("directChatMessageReceived", pipe_name..";Wrote: "..message)
+                        CallEventScripts("directChatMessageReceived", pipe_name..";Wrote: "..tostring(message))
                     end
                     if debug.print_to_log then
-                        DebugError(pipe_name.." Wrote: '"..message.."' with callback "..tostring(callback))
+                        DebugError(pipe_name.." Wrote: '"..tostring(message).."' with callback "..tostring(callback))
                     end
                     
                 
@@ -673,22 +812,138 @@ end
 -- Reading interface.
 
 
+-- Headers of framed messages, matching X4_Python_Pipe_Server/Classes/Framing.py.
+-- Batch messages pack several messages together. After the header, each
+-- message is a 4-byte little-endian length followed by the message text.
+L.batch_header = "\0B"
+-- Chunks hold part of a message too large to send in one piece, with
+-- the last chunk using its own header.
+L.chunk_header      = "\0F"
+L.last_chunk_header = "\0L"
+-- Control messages hold "name:value" text, telling the other side
+-- what this side supports.
+L.control_header = "\0C"
+
+-- Returns a control message setting name to value.
+function L.Pack_Control(name, value)
+    return L.control_header..name..":"..tostring(value)
+end
+
+-- Record the capabilities in a host message, if it is a capabilities
+-- announcement ("capabilities:<comma separated names>").
+function L.Handle_Host_Message(message)
+    local names = string.match(message, "^capabilities:(.*)$")
+    if names == nil then
+        return
+    end
+    L.host_capabilities = {}
+    for name in string.gmatch(names, "[^,]+") do
+        L.host_capabilities[name] = true
+    end
+end
+
+-- Handle a control message from the server.
+function L.Handle_Control(pipe_name, message)
+    local name, value = string.match(message, "^(.-):(.*)$", #L.control_header + 1)
+    if name == "read_size" then
+        pipes[pipe_name].peer_read_size = tonumber(value)
+    end
+end
+
+-- Split a batch message into a list of its messages.
+function L.Unpack_Batch(message)
+    local messages = {}
+    local position = #L.batch_header + 1
+    local length = #message
+    while position <= length do
+        local b1, b2, b3, b4 = string.byte(message, position, position + 3)
+        local size = b1 + b2 * 256 + b3 * 65536 + b4 * 16777216
+        table.insert(messages, string.sub(message, position + 4, position + 3 + size))
+        position = position + 4 + size
+    end
+    return messages
+end
+
+
+-- Decode a typed message into a lua value; other messages pass through.
+function L.Decode_Message(message)
+    if message ~= nil and Codec.Is_Typed(message) then
+        return Codec.Decode(message)
+    end
+    return message
+end
+
+
 -- Attempt to read a pipe, possibly throwing an error.
--- Returns a string if the read succesful.
+-- Returns a string (or lua value, for typed messages) if the read succesful.
 -- Returns nil if the pipe is empty but otherwise looks good.
 -- Raises an error on other problems.
 -- Note: as of X4 4.0 (or possibly changes to windows pipes?), empty messages
 -- show up as nil and are not supported, so never send an empty string to
 -- a pipe.
 function L._Read_Pipe_Raw(pipe_name)
+    -- Return messages left over from a prior batch first.
+    if pipes[pipe_name] ~= nil and not FIFO.Is_Empty(pipes[pipe_name].batch_fifo) then
+        return L.Decode_Message(FIFO.Read(pipes[pipe_name].batch_fifo))
+    end
+
     -- Open the pipe if needed. Let errors carry upward.
     L.Connect_Pipe(pipe_name)
-    
+
+    -- Keep reading through control messages and chunks, until a whole
+    -- message is read or the pipe is empty. A partial chunked message
+    -- is kept for the next read.
+    local return_value
+    while true do
+        return_value = L._Read_File(pipe_name)
+        if return_value == nil then
+            return nil
+        end
+        local header = string.sub(return_value, 1, 2)
+
+        if header == L.chunk_header or header == L.last_chunk_header then
+            local chunk_parts = pipes[pipe_name].chunk_parts
+            table.insert(chunk_parts, string.sub(return_value, 3))
+            if header == L.last_chunk_header then
+                return_value = table.concat(chunk_parts)
+                pipes[pipe_name].chunk_parts = {}
+                break
+            end
+        elseif header == L.control_header then
+            L.Handle_Control(pipe_name, return_value)
+        else
+            break
+        end
+    end
+
+    -- Unpack batches, returning the first message and queueing the rest.
+    if string.sub(return_value, 1, #L.batch_header) == L.batch_header then
+        local messages = L.Unpack_Batch(return_value)
+        return_value = messages[1]
+        for i = 2, #messages do
+            FIFO.Write(pipes[pipe_name].batch_fifo, messages[i])
+        end
+    end
+
+    -- Note what the host supports. The message is still returned, for
+    -- md to see.
+    if pipe_name == L.host_pipe_name then
+        L.Handle_Host_Message(return_value)
+    end
+    return L.Decode_Message(return_value)
+end
+
+
+-- Read one message from a pipe's file, possibly throwing an error.
+-- Returns the raw message string, or nil if the pipe is empty.
+function L._Read_File(pipe_name)
     -- Read in whatever is in the pipe.
     -- Apparently this either returns text, or [nil, error_message].
     -- The error_message is a formatted string for display, and will be
     --  nil if the read succeeded.
-    local return_value, lua_error_message = pipes[pipe_name].file:read()
+    -- Dual channel pipes read from their separate read_file.
+    local file = pipes[pipe_name].read_file or pipes[pipe_name].file
+    local return_value, lua_error_message = file:read()
     
     -- In docs, GetLastError() should be ERROR_IO_PENDING for a read from a good
     --  pipe that is empty, and hence returned early.
@@ -696,7 +951,8 @@ function L._Read_Pipe_Raw(pipe_name)
     --  const brought up to here for checking.    
     -- Update: microsoft docs incomplete; this actually returns ERROR_NO_DATA.
     -- If the message is larger than the lua side buffer, returns partial
-    --  data and error ERROR_MORE_DATA. TODO: look into this.
+    --  data and error ERROR_MORE_DATA. Servers told the READ_SIZE (see
+    --  Connect_Pipe) split larger messages into chunks to avoid this.
     
     if lua_error_message ~= nil then
         -- Error occurred; either pipe is bad or empty.
@@ -720,6 +976,7 @@ function L._Read_Pipe_Raw(pipe_name)
             error("read failed with error: "..lua_error_message)
         end
     end
+
     return return_value
 end
 
@@ -765,7 +1022,54 @@ end
 function L._Write_Pipe_Raw(pipe_name, message)
     -- Open the pipe if needed. Let errors carry upward.
     L.Connect_Pipe(pipe_name)
-    
+
+    -- Tables are sent typed if the pipe was set up for it and the server
+    -- decodes them, else through the pipe's text serializer.
+    if type(message) == "table" then
+        if pipes[pipe_name].codec == "typed" and pipes[pipe_name].peer_codec == "typed" then
+            message = Codec.Encode(message)
+        elseif pipes[pipe_name].text_serializer ~= nil then
+            message = pipes[pipe_name].text_serializer(message)
+        else
+            error("table message needs the typed codec for "..pipe_name)
+        end
+    end
+
+    -- Split messages too large for the server to read in one piece.
+    local frames = {message}
+    local read_size = pipes[pipe_name].peer_read_size
+    if read_size ~= nil and #message > read_size then
+        frames = L.Split_Chunks(message, read_size)
+    end
+
+    for i, frame in ipairs(frames) do
+        L._Write_File(pipe_name, frame)
+    end
+
+    -- If here, write was succesful.
+    return true
+end
+
+
+-- Split a message into a list of chunks, each at most max_size long
+-- including its header.
+function L.Split_Chunks(message, max_size)
+    local part_size = max_size - #L.chunk_header
+    local chunks = {}
+    local length = #message
+    for start = 1, length, part_size do
+        local header = L.chunk_header
+        if start + part_size > length then
+            header = L.last_chunk_header
+        end
+        table.insert(chunks, header..string.sub(message, start, start + part_size - 1))
+    end
+    return chunks
+end
+
+
+-- Write one message to a pipe's file, raising an error on failure.
+function L._Write_File(pipe_name, message)
     -- Send the write request on the output pipe.
     -- Presumably this returns the number of bytes actually written, or
     -- 0 if there is an error or full pipe.
@@ -842,7 +1146,7 @@ end
 -- This will not try to reconnect right away, since the host is
 -- expected to have some delay to detect disconnection and restart.
 local function Test_Disconnect()
-    local pipe_name = 'x4_python_host'
+    local pipe_name = L.host_pipe_name
     DebugError("Testing Connect_Pipe")
     L.Connect_Pipe(pipe_name)
     DebugError("Testing Disconnect_Pipe")
@@ -0,0 +1,160 @@
+--[[
+Producer side of the shared memory ring buffer.
+Matches X4_Python_Pipe_Server/Classes/Ring_Buffer.py; see there for the
+layout and the producer steps.
+
+For high volume telemetry (eg. many samples per frame), records are
+copied into a named file mapping created by the python server, instead
+of each being sent as a pipe message. The pipe carries only setup (the
+server sends the mapping name) and a doorbell: after writing records,
+the lua user sends one pipe message (at most once per frame, checked
+with Take_Doorbell) so the server knows to drain the ring.
+
+Usage:
+    local Ring = require("extensions.sn_mod_support_apis.ui.named_pipes.Ring_Buffer")
+    local ring = Ring.Open(name_from_server)
+    if ring and Ring.Write(ring, record_string) then ... end
+    if Ring.Take_Doorbell(ring) then Pipes.Schedule_Write(pipe_name, nil, "doorbell") end
+
+Windows only; Open returns nil elsewhere or if the mapping is missing.
+]]
+
+local ffi = require("ffi")
+local C = ffi.C
+-- Kernel32 functions are reachable through ffi.C on windows.
+-- Guard the cdef, in case another mod declared these already.
+pcall(ffi.cdef, [[
+    void* OpenFileMappingA(uint32_t dwDesiredAccess, int bInheritHandle, const char* lpName);
+    void* MapViewOfFile(void* hFileMappingObject, uint32_t dwDesiredAccess, uint32_t dwFileOffsetHigh, uint32_t dwFileOffsetLow, size_t dwNumberOfBytesToMap);
+    int UnmapViewOfFile(const void* lpBaseAddress);
+    int CloseHandle(void* hObject);
+]])
+
+local floor = math.floor
+
+local L = {
+    magic = "X4RB",
+    version = 1,
+    header_size = 192,
+    -- Field positions, as uint32 indices from the start of the mapping.
+    capacity_index = 2,
+    dropped_index  = 3,
+    write_index    = 16,
+    read_index     = 32,
+    -- Length marking a wrap back to the start of the data area.
+    wrap_marker = 0xFFFFFFFF,
+}
+
+-- FILE_MAP_READ | FILE_MAP_WRITE.
+local file_map_access = 0x0004 + 0x0002
+
+
+-- Open the named ring created by the python server.
+-- Returns a ring table, or nil if it could not be opened.
+function L.Open(name)
+    if ffi.os ~= "Windows" then
+        return nil
+    end
+    local ok, handle = pcall(C.OpenFileMappingA, file_map_access, 0, name)
+    if not ok or handle == nil then
+        return nil
+    end
+    -- Map the whole object.
+    local view = C.MapViewOfFile(handle, file_map_access, 0, 0, 0)
+    if view == nil then
+        C.CloseHandle(handle)
+        return nil
+    end
+    local bytes = ffi.cast("uint8_t*", view)
+    if ffi.string(bytes, 4) ~= L.magic then
+        C.UnmapViewOfFile(view)
+        C.CloseHandle(handle)
+        return nil
+    end
+    local header = ffi.cast("uint32_t*", view)
+    if header[1] ~= L.version then
+        C.UnmapViewOfFile(view)
+        C.CloseHandle(handle)
+        return nil
+    end
+
+    return {
+        name     = name,
+        handle   = handle,
+        view     = view,
+        header   = header,
+        data     = bytes + L.header_size,
+        capacity = header[L.capacity_index],
+        -- True when records were written since the last Take_Doorbell.
+        pending  = false,
+    }
+end
+
+
+-- Write one record string into the ring.
+-- Returns true if written, false if the ring was full or the record is
+-- too large (the dropped count is incremented either way).
+function L.Write(ring, record)
+    local header   = ring.header
+    local capacity = ring.capacity
+    local length   = #record
+    -- Length field plus payload, rounded up to 8 bytes.
+    local size     = floor((length + 11) / 8) * 8
+
+    local write_offset = header[L.write_index]
+    local read_offset  = header[L.read_index]
+    local position
+
+    if size + 8 <= capacity then
+        if write_offset >= read_offset then
+            local end_space = capacity - write_offset
+            if read_offset == 0 then
+                -- Cannot end exactly at capacity, since that wraps to 0.
+                end_space = end_space - 8
+            end
+            if size <= end_space then
+                position = write_offset
+            elseif size + 8 <= read_offset then
+                ffi.cast("uint32_t*", ring.data + write_offset)[0] = L.wrap_marker
+                position = 0
+            end
+        elseif write_offset + size + 8 <= read_offset then
+            position = write_offset
+        end
+    end
+
+    if position == nil then
+        header[L.dropped_index] = header[L.dropped_index] + 1
+        return false
+    end
+
+    ffi.cast("uint32_t*", ring.data + position)[0] = length
+    ffi.copy(ring.data + position + 4, record, length)
+    -- Publish only after the record is in place.
+    header[L.write_index] = (position + size) % capacity
+    ring.pending = true
+    return true
+end
+
+
+-- Returns true if records were written since the last call, meaning a
+-- doorbell message should be sent to the server.
+function L.Take_Doorbell(ring)
+    local pending = ring.pending
+    ring.pending = false
+    return pending
+end
+
+
+-- Unmap the ring. The server's mapping stays valid.
+function L.Close(ring)
+    if ring.view ~= nil then
+        C.UnmapViewOfFile(ring.view)
+        C.CloseHandle(ring.handle)
+        ring.view = nil
+    end
+end
+
+
+Register_Require_Response("extensions.sn_mod_support_apis.ui.named_pipes.Ring_Buffer", L)
+return L
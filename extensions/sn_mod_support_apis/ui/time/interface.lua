@@ -81,11 +81,56 @@ Commands:
 - printTimer (id)
   - Prints the time on the timer to the debug log.
 - tic (id)
-  - Starts a fresh timer at time 0.
+  - Starts a fresh timer at time 0, named by id, in the python time
+    server; timers under different ids run independently.
   - Intended as a convenient 1-shot timing solution.
 - toc (id)
-  - Stops the timer associated with tic, returns the time measured,
-    and prints the time to the debug log.
+  - Returns the time measured since the tic of the same id, leaving the
+    timer running.
+- record (id)
+  - As toc, but instead of returning the time, adds it to statistics
+    kept by the python time server for the id: count, mean, min, max,
+    and p50/p95/p99.
+  - Use for benchmarking code run many times, avoiding the cost of
+    collecting every time in lua/md.
+- report (id)
+  - Returns a text table of the record statistics, one line per
+    recorded id, with times in milliseconds.
+  - The table is also printed to the python host console.
+- pipeCommands (commands)
+  - Sends several time server commands in one pipe message, eg.
+    "tic:a;toc:b;get:c;", each ended by a semicolon.
+  - Commands are "tic:<id>", "toc:<id>", "record:<id>", "get:<id>"
+    (system time), "report:<id>" and "dilation:<id>".
+  - Replies are returned as for the individual commands, signalled under
+    their own ids, and arrive together.
+- calibrate (id:count)
+  - Measures the pipe timing overheads over count probes, returning
+    a text table of their distributions (count, mean, min, max, and
+    p50/p95/p99, in milliseconds):
+    - round trip: python to lua and back, including lua's frame-polled
+      read delay.
+    - overhead: the time an empty tic/toc pair measures.
+  - Other time commands sent during calibration are answered after it,
+    so the time server stalls for the whole calibration; each probe
+    takes a frame or two, eg. around 30 seconds for 1000 probes at 60 fps.
+  - count is limited to 1 to 1000.
+- correctToc (state)
+  - If state is 1, the calibrated overhead median is subtracted from
+    later toc and record times; 0 turns this off. Off by default.
+  - Has no effect until calibrate has been run.
+- startClockSync (interval)
+  - Starts sending (game time, engine time) samples to the python time
+    server every interval seconds (default 1), where they are fit to
+    map game time to the python clock. Python servers access this
+    through Get_Game_Clock(), for converting timestamps such as
+    $gametime without pipe round trips.
+- stopClockSync
+  - Stops sending clock samples.
+- getDilation (id)
+  - Returns the game seconds passing per real second, from the clock
+    samples: 1 normally, higher under SETA, 0 while paused.
+  - Returns nothing until two samples have been sent.
 - setAlarm (id:delay)
   - Sets an alarm to fire after a certain delay, in seconds.
   - Arguments are a concantenated string, colon separated.
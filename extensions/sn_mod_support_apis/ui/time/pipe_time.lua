@@ -7,12 +7,19 @@ an import loop.
 
 -- TODO: conditionally include pipes api. For now hardcode.
 local pipes_api = require("extensions.sn_mod_support_apis.ui.named_pipes.Interface")
+-- For alarms; this doesn't import the pipe api, so no loop.
+local Time = require("extensions.sn_mod_support_apis.ui.time.Interface")
 
 -- Table of local functions and data.
 local L = {
     debug = false,
     -- Name of the pipe for higher precision timing.
     pipe_name = 'x4_time',
+    -- Seconds between game clock sync samples, or nil when not syncing.
+    sync_interval = nil,
+    -- Most probes allowed per calibrate, matching the python server,
+    -- which handles no other commands until the probes are done.
+    max_calibrate_count = 1000,
     }
     
 
@@ -21,6 +28,14 @@ function Init()
     RegisterEvent("Time.getSystemTime", L.Get_System_Time)
     RegisterEvent("Time.tic"          , L.Tic)
     RegisterEvent("Time.toc"          , L.Toc)
+    RegisterEvent("Time.record"       , L.Record)
+    RegisterEvent("Time.report"       , L.Report)
+    RegisterEvent("Time.pipeCommands" , L.Pipe_Commands)
+    RegisterEvent("Time.calibrate"    , L.Calibrate)
+    RegisterEvent("Time.correctToc"   , L.Correct_Toc)
+    RegisterEvent("Time.startClockSync", L.Start_Clock_Sync)
+    RegisterEvent("Time.stopClockSync" , L.Stop_Clock_Sync)
+    RegisterEvent("Time.getDilation"  , L.Get_Dilation)
 end
 
 -- Raise an event for md to capture.
@@ -30,6 +45,8 @@ end
 
 
 function L.Get_System_Time(_, id)
+    -- Id is optional; md may signal without a param.
+    id = id or ''
     -- Send a request to the pipe api. Optimistically assume the server
     -- is running. Ignore result.
     pipes_api.Schedule_Write(L.pipe_name, nil, 'get')
@@ -57,15 +74,128 @@ end
 
 
 function L.Tic(_, id)
-    -- Send a request to the pipe api.
-    pipes_api.Schedule_Write(L.pipe_name, nil, 'tic')
+    id = id or ''
+    -- Send a request to the pipe api, starting the timer named by id.
+    pipes_api.Schedule_Write(L.pipe_name, nil, 'tic:'..id)
 end
 
 
 function L.Toc(_, id)
+    id = id or ''
     -- Send a request to the pipe api.
-    pipes_api.Schedule_Write(L.pipe_name, nil, 'toc')
-    
+    pipes_api.Schedule_Write(L.pipe_name, nil, 'toc:'..id)
+    L.Schedule_Reply(id)
+end
+
+
+function L.Record(_, id)
+    id = id or ''
+    -- Add the time since tic to the python side stats; no reply.
+    pipes_api.Schedule_Write(L.pipe_name, nil, 'record:'..id)
+end
+
+
+function L.Report(_, id)
+    id = id or ''
+    -- Request the table of recorded stats, returned under id.
+    pipes_api.Schedule_Write(L.pipe_name, nil, 'report')
+    L.Schedule_Reply(id)
+end
+
+
+-- Measure pipe overheads; id_count is "<id>:<probe count>".
+-- The server sends each probe, answered here with two separate echo
+-- writes, then the table of measured times, returned under id.
+function L.Calibrate(_, id_count)
+    id_count = id_count or ''
+    local id, count = string.match(id_count, "^(.*):(%d+)$")
+    if not id then
+        DebugError(string.format("Time.calibrate: expected 'id:count', got '%s'", id_count))
+        return
+    end
+    count = tonumber(count)
+    -- Checked here too, since a rejected count would leave the probe
+    -- reads waiting.
+    if count < 1 or count > L.max_calibrate_count then
+        DebugError(string.format("Time.calibrate: count must be 1 to %d, got %d", L.max_calibrate_count, count))
+        return
+    end
+    pipes_api.Schedule_Write(L.pipe_name, nil, 'calibrate:'..count)
+    for i = 1, count do
+        pipes_api.Schedule_Read(
+            L.pipe_name,
+            function(message)
+                -- Answer right away; punt on errors.
+                if message ~= 'ERROR' then
+                    pipes_api.Schedule_Write(L.pipe_name, nil, 'echo')
+                    pipes_api.Schedule_Write(L.pipe_name, nil, 'echo')
+                end
+            end
+            )
+    end
+    L.Schedule_Reply(id)
+end
+
+
+function L.Correct_Toc(_, state)
+    -- Turn on or off removing the calibrated overhead from tocs.
+    pipes_api.Schedule_Write(L.pipe_name, nil, 'correct:'..tostring(state))
+end
+
+
+-- Start sending game/engine time samples every interval seconds
+-- (default 1), for python servers to map game time to real time.
+function L.Start_Clock_Sync(_, interval)
+    local was_syncing = L.sync_interval ~= nil
+    L.sync_interval = tonumber(interval) or 1
+    -- An alarm is already pending if syncing; it picks up the interval.
+    if not was_syncing then
+        L.Send_Clock_Sync()
+    end
+end
+
+
+function L.Stop_Clock_Sync()
+    L.sync_interval = nil
+end
+
+
+-- Send one sample, and set an alarm for the next.
+-- Both times are taken in this frame.
+function L.Send_Clock_Sync()
+    if not L.sync_interval then
+        return
+    end
+    pipes_api.Schedule_Write(L.pipe_name, nil, 
+        string.format('sync:%f,%f', GetCurTime(), GetCurRealTime()))
+    Time.Set_Alarm('pipe_time_clock_sync', L.sync_interval, L.Send_Clock_Sync)
+end
+
+
+function L.Get_Dilation(_, id)
+    id = id or ''
+    -- Request the game seconds per real second, fit from clock syncs.
+    pipes_api.Schedule_Write(L.pipe_name, nil, 'dilation')
+    L.Schedule_Reply(id)
+end
+
+
+-- Send several commands in one message, eg. "tic:a;toc:b;get:c;".
+-- Each command replying (get, toc, report, dilation) raises a signal to its own id; the
+-- server batches the replies, but they are unpacked into separate reads.
+function L.Pipe_Commands(_, commands)
+    pipes_api.Schedule_Write(L.pipe_name, nil, commands)
+    for command in string.gmatch(commands, "[^;]+") do
+        local name, id = string.match(command, "^([^:]*):?(.*)$")
+        if name == 'get' or name == 'toc' or name == 'report' or name == 'dilation' then
+            L.Schedule_Reply(id)
+        end
+    end
+end
+
+
+-- Schedule a read of a time reply, raising it to md under id.
+function L.Schedule_Reply(id)
     -- Read the response, providing a callback function.
     pipes_api.Schedule_Read(
         L.pipe_name, 
@@ -74,13 +204,13 @@ function L.Toc(_, id)
             if message ~= 'ERROR' then
                 -- Put the time in the log.
                 if L.debug then
-                    DebugError(string.format("Toc id '%s': %f seconds", id, message))
+                    DebugError(string.format("Reply id '%s': %s", id, message))
                 end
                 -- Return to md.
                 L.Raise_Signal(id, message)
             else
                 if L.debug then
-                    DebugError("Time.Toc failed; pipe not connected.")
+                    DebugError(string.format("Time request '%s' failed; pipe not connected or timer not started.", id))
                 end
             end
         end
@@ -14,6 +14,10 @@ main_dir = this_dir.parent
 # Name of the pipe to use.
 pipe_name = 'x4_script_profile'
 
+# Run in a separate process from the host, since parsing and sorting the
+# large profile messages would otherwise hold up other servers.
+run_in_process = True
+
 # Flag to do a test run with the pipe client handled in python instead
 # of x4.
 test_python_client = 0
@@ -43,6 +47,7 @@ def main(args):
     # Set up the pipe and connect to x4.
     # Increase the size above default a bunch, since messages can be
     # close to 60kB, and two are sent close together.
+    # Typed messages from x4 are decoded automatically.
     pipe = Pipe_Server(pipe_name, buffer_size = 1024 * 256)
         
     # For python testing, kick off a client thread.
@@ -86,28 +91,37 @@ def main(args):
         message = pipe.Read()
 
         if test_python_client:
-            print(pipe_name + ' server got: ' + message)
+            print(pipe_name + ' server got: ' + str(message))
 
         # Ignore any setup pings.
         if message == 'ping':
             continue
         
         try:
-            # First term is the command.
-            command, args = message.split(';', 1)
+            # Typed messages (when x4 has Pipes.Set_Codec to 'typed') are
+            # a list of the command and either a dict of key:value pairs,
+            # or a list of [key parts, value] records, where the key parts
+            # get rejoined with commas.
+            if isinstance(message, list):
+                command, args = message
+                if isinstance(args, dict):
+                    kv_pairs = list(args.items())
+                else:
+                    kv_pairs = [(','.join(key), value) for key, value in args]
+            else:
+                # First term is the command.
+                # args are key:value pairs.
+                # Semicolon separated, with an ending semicolon.
+                # Split, toss the last blank.
+                command, args = message.split(';', 1)
+                kv_pairs = [x.split(':') for x in args.split(';')[0:-1]]
        
             # Generic current state update.
             if command == 'update':
                 
-                # args are key:value pairs.
-                # Semicolon separated, with an ending semicolon.
-                # Split, toss the last blank.
-                kv_pairs = args.split(';')[0:-1]
-
                 # Process them into a dict of strings.
                 # Note: keys are expected to start with $.
-                for kv_pair in kv_pairs:
-                    key, value = kv_pair.split(':')
+                for key, value in kv_pairs:
 
                     # Explicitly handle cases, for casting and clarity.
                     if key == 'path_metrics_timespan':
@@ -122,19 +136,13 @@ def main(args):
 
             elif command == 'ai_metrics':
 
-                # args are key:value pairs.
-                # Semicolon separated, with an ending semicolon.
-                # Split, toss the last blank.
-                kv_pairs = args.split(';')[0:-1]
-
                 for counter in ai_counters.values():
                     counter.Clear()
 
                 # Process them into a dict of strings.
                 # Note: keys are expected to start with $.
                 data = {}
-                for kv_pair in kv_pairs:
-                    key, value = kv_pair.split(':')
+                for key, value in kv_pairs:
 
                     # AI state will be handed off.
                     # These have the prefix added before a dot.
@@ -155,11 +163,7 @@ def main(args):
             elif command == 'event_counts':
                 counter = ai_counters['event_counts']
                 counter.Clear()
-
-                # Split, toss the last blank.
-                kv_pairs = args.split(';')[0:-1]
-                for kv_pair in kv_pairs:
-                    key, value = kv_pair.split(':')
+                for key, value in kv_pairs:
                     counter.Set(key, value)
                 counter.Print(20)
                 
@@ -173,10 +177,7 @@ def main(args):
                 for tracker in path_metrics.values():
                     tracker.Clear()
                 
-                # Split, toss the last blank.
-                kv_pairs = args.split(';')[0:-1]
-                for kv_pair in kv_pairs:
-                    key, value = kv_pair.split(':')
+                for key, value in kv_pairs:
                     # Separate based on key starting with 'ai' or 'md'.
                     if key[0] == 'a':
                         path_metrics['ai'].Set(key, value)
@@ -305,14 +306,16 @@ class Path_Metrics:
     def Clear(self):
         self.metrics.clear()
 
-    def Set(self, name, metrics_str):
+    def Set(self, name, metrics):
         '''
-        Takes a comma separated string with expected metric ordering:
-        sum, min, max, count (ints), comma separated.
+        Takes a comma separated string (or list, from typed messages) with
+        expected metric ordering: sum, min, max, count (ints).
         Overwrites any possible prior metrics.
         TODO: support for summing with prior metrics.
         '''
-        sum, min, max, count = metrics_str.split(',')
+        if isinstance(metrics, str):
+            metrics = metrics.split(',')
+        sum, min, max, count = metrics
         self.metrics[name] = {
             'sum'   : int(sum), 
             'min'   : int(min), 
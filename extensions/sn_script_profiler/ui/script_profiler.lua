@@ -97,6 +97,34 @@ function Init()
     RegisterEvent("Script_Profiler.Record_Event", L.Record_Event)
     
     L.path_gather_start_time = GetCurTime()
+
+    -- Send typed messages, to skip string formatting here and parsing
+    -- on the python side. Hosts without typed support get the old text.
+    Pipes.Set_Codec("x4_script_profile", "typed", L.Serialize_Text)
+end
+
+-- Convert a {command, args} message into the text form:
+-- "command;key:value;key:value;", where args is a table of key:value
+-- pairs or a list of {key parts, value} records, and key parts and list
+-- values are comma separated.
+function L.Serialize_Text(message)
+    local command, args = message[1], message[2]
+    local records = args
+    if args[1] == nil then
+        records = {}
+        for key, value in pairs(args) do
+            table.insert(records, {{key}, value})
+        end
+    end
+    local str_table = {command..";"}
+    for i, record in ipairs(records) do
+        local value = record[2]
+        if type(value) == "table" then
+            value = table.concat(value, ",")
+        end
+        table.insert(str_table, table.concat(record[1], ",")..":"..tostring(value)..";")
+    end
+    return table.concat(str_table)
 end
 
 -- Send collacted data straight to the pipe.
@@ -105,31 +133,30 @@ function L.Send_Script_Info()
     -- Transmit the time elapsed since paths started gathering.
     -- TODO: if server restarted, somehow this transmits to the new server,
     -- then causes it to shut down and restart. why??
-    Pipes.Schedule_Write("x4_script_profile", nil, string.format(
-        "update;path_metrics_timespan:%f;", GetCurTime() - L.path_gather_start_time))
+    Pipes.Schedule_Write("x4_script_profile", nil, {
+        "update", {path_metrics_timespan = GetCurTime() - L.path_gather_start_time}})
     
-    -- Collect the data into a big string for python side processing.
-    -- To maybe speed this up, put substrings into a bit list, then
-    -- use table.concat to join them.
-    -- General format: command;key:value;key:value;...
+    -- Send each table as a typed message of {command, records}, which
+    -- python receives as a list. Each record is {key parts, value}, with
+    -- the comma separated key split into its parts so that repeated
+    -- section and location names get sent once per message.
     for i, field in ipairs({"event_counts", "path_times"}) do
         -- Skip transmit if nothing was recorded.
         local send = false
-        local str_table = {field..";"}
+        local records = {}
         for key, value in pairs(L[field]) do
             -- path_times need more work to break out sum/min/max/count;
-            -- do those with comma separation.
+            -- send those as a list.
             if field == "path_times" then
-                value = string.format("%d,%d,%d,%d", value.sum, value.min, value.max, value.count)
+                value = {value.sum, value.min, value.max, value.count}
             end
-            table.insert(str_table, key..":"..value..";")
+            table.insert(records, {Lib.Split_String_Multi(key, ","), value})
             send = true
         end
         if send then
-            local message = table.concat(str_table)
-            DebugError("Sending "..field..", items: "..#str_table..", size: "..string.len(message))
+            DebugError("Sending "..field..", items: "..#records)
             -- No callback for now.
-            Pipes.Schedule_Write("x4_script_profile", nil, message)
+            Pipes.Schedule_Write("x4_script_profile", nil, {field, records})
         end
         -- Clear old info (for now).
         L[field] = {}